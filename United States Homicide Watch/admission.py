@@ -0,0 +1,167 @@
+'''
+admission.py limits how many expensive requests a process works on at once.
+Each class of request has an AdmissionGate with a fixed number of slots and
+a bounded queue. A request that would have to wait longer than the gate's
+deadline is turned away at once, so the client can be told to retry later
+instead of tying up a thread until everything times out.
+'''
+
+import contextlib
+import math
+import threading
+import time
+
+
+class AdmissionRejected(Exception):
+	'''
+	Raised when a gate turns a request away. retryAfter is the number of
+	seconds the client should wait before trying again.
+	'''
+
+	def __init__(self, gateName, retryAfter):
+		super().__init__(f"Too many {gateName} requests in progress; try again in {retryAfter} seconds")
+		self.gateName = gateName
+		self.retryAfter = retryAfter
+
+
+class AdmissionGate:
+	'''
+	AdmissionGate admits at most limit requests at a time, queues up to
+	queueSize more for at most deadline seconds, and rejects the rest. It
+	keeps a moving average of how long admitted requests take, so a request
+	whose expected wait is already past the deadline is rejected without
+	waiting at all.
+	'''
+
+	# The weight of the newest request in the moving average of request times
+	SMOOTHING = 0.2
+
+	def __init__(self, name, limit, queueSize, deadline):
+		'''
+		PARAMETERS:
+			name - the name of the class of requests, used in messages and metrics
+			limit - the number of requests admitted at once
+			queueSize - the number of requests that may wait for a slot
+			deadline - the number of seconds a request may wait for a slot
+		'''
+		self.name = name
+		self.limit = limit
+		self.queueSize = queueSize
+		self.deadline = deadline
+		self.condition = threading.Condition()
+		self.active = 0
+		self.waiting = 0
+		self.averageSeconds = None
+		self.admittedCount = 0
+		self.queuedCount = 0
+		self.rejectedCount = 0
+
+
+	def acquire(self):
+		'''
+		Waits for a slot and takes it
+
+		Raises AdmissionRejected if the queue is full, the expected wait is
+		longer than the deadline, or no slot frees up before the deadline.
+		'''
+		with self.condition:
+			if self.active < self.limit and self.waiting == 0:
+				self.active = self.active + 1
+				self.admittedCount = self.admittedCount + 1
+				return
+
+			if self.waiting >= self.queueSize or self.getExpectedWait() > self.deadline:
+				raise self.reject()
+
+			self.waiting = self.waiting + 1
+			self.queuedCount = self.queuedCount + 1
+			giveUpTime = time.monotonic() + self.deadline
+
+			try:
+				while self.active >= self.limit:
+					remaining = giveUpTime - time.monotonic()
+
+					if remaining <= 0:
+						raise self.reject()
+
+					self.condition.wait(remaining)
+
+			finally:
+				self.waiting = self.waiting - 1
+
+			self.active = self.active + 1
+			self.admittedCount = self.admittedCount + 1
+
+
+	def release(self, seconds):
+		'''
+		Gives back a slot and wakes one waiting request
+
+		PARAMETERS:
+			seconds - how long the request held the slot
+		'''
+		with self.condition:
+			self.active = self.active - 1
+
+			if self.averageSeconds is None:
+				self.averageSeconds = seconds
+
+			else:
+				self.averageSeconds = self.SMOOTHING * seconds + (1 - self.SMOOTHING) * self.averageSeconds
+
+			self.condition.notify()
+
+
+	@contextlib.contextmanager
+	def admit(self):
+		'''
+		Holds a slot for the duration of a with block
+		'''
+		self.acquire()
+		startTime = time.monotonic()
+
+		try:
+			yield
+
+		finally:
+			self.release(time.monotonic() - startTime)
+
+
+	def getExpectedWait(self):
+		'''
+		Returns roughly how many seconds a request arriving now would wait for a
+		slot, assuming requests keep taking their average time. Must be called
+		with the condition held.
+		'''
+		if self.averageSeconds is None or self.active < self.limit:
+			return 0
+
+		return math.ceil((self.waiting + 1) / self.limit) * self.averageSeconds
+
+
+	def reject(self):
+		'''
+		Counts a rejection and returns the exception to raise. Must be called
+		with the condition held.
+		'''
+		self.rejectedCount = self.rejectedCount + 1
+
+		return AdmissionRejected(self.name, max(1, math.ceil(min(self.getExpectedWait(), self.deadline))))
+
+
+	def getMetrics(self):
+		'''
+		Returns the gate's settings, current load and totals
+		'''
+		with self.condition:
+			return {
+				"limit": self.limit,
+				"queueSize": self.queueSize,
+				"deadlineSeconds": self.deadline,
+				"active": self.active,
+				"waiting": self.waiting,
+				"admitted": self.admittedCount,
+				"queued": self.queuedCount,
+				"rejected": self.rejectedCount,
+				"averageMilliseconds": round(self.averageSeconds * 1000, 3) if self.averageSeconds is not None else None
+			}
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+'''
+anomalies.py flags states and counties whose homicide rates move more than
+chance would explain. It reads every year of every state and county once
+(through the cube), scores each place's series, and replaces the alerts
+table that the /alerts/ route reads. Two kinds of alert are raised:
+
+	yearOverYear - a year whose rate differs sharply from the year before. The
+		score is the Poisson z statistic for equal rates in the two years, so
+		the same change counts for more in a large place than in a small one.
+		A change must also be at least MIN_RELATIVE_CHANGE of the earlier
+		rate, so tiny shifts in very large states are not flagged.
+	changePoint - the year a place's rate settled at a new level. The score is
+		the Poisson likelihood ratio statistic of the best single split of the
+		series against no split, found in one pass from running totals.
+
+Every series is scored at once: the series are packed into numpy matrices,
+one row per place, and each test is a handful of whole-matrix operations.
+With --workers N the series are split across N processes. By default there
+is one process per CPU, but only as many as give each at least
+MIN_SERIES_PER_WORKER series, so the few hundred states and counties are
+scored in this process, which takes milliseconds.
+
+Counties only count the causes CDC did not suppress, as in the cube.
+
+Usage:
+	python3 anomalies.py [--workers 4]
+'''
+
+import argparse
+import concurrent.futures
+import math
+import multiprocessing
+import os
+import time
+
+import numpy
+import psycopg2
+
+from config import loadConfig, getConnectionParameters
+from cube import HomicideCube, getStateOfCounty, getRate
+from datasource import DataSource
+
+# |z| at or above this flags a year-over-year change
+YEAR_OVER_YEAR_Z = 3.0
+
+# The smallest year-over-year change flagged, as a fraction of the earlier rate
+MIN_RELATIVE_CHANGE = 0.25
+
+# The likelihood ratio statistic at or above which a change point is flagged.
+# It is above the 0.1% point of chi-square with one degree of freedom (10.8),
+# allowing for every split of the series being tried.
+CHANGE_POINT_STATISTIC = 15.0
+
+# The fewest years on each side of a change point
+MIN_SEGMENT_YEARS = 3
+
+# The fewest series worth starting a worker process for. The states and
+# counties make a few hundred series, which one process scores in a few
+# milliseconds, so workers only pay off for much larger inputs.
+MIN_SERIES_PER_WORKER = 5000
+
+
+def getSeries(cube):
+	'''
+	Returns every state's and county's yearly totals as series to score
+
+	RETURN:
+		a list of (level, name, state, years) tuples, where years is a list of
+		(year, deaths, population) tuples in year order for the years with data
+	'''
+	seriesList = []
+
+	for level in ["state", "county"]:
+		for name, yearlyTotals in sorted(cube.getYearlyTotals(level).items()):
+			state = name if level == "state" else getStateOfCounty(name)
+			years = [(year, deaths, population) for year, (deaths, population) in sorted(yearlyTotals.items()) if population > 0]
+			seriesList.append((level, name, state, years))
+
+	return seriesList
+
+
+def packSeries(seriesList):
+	'''
+	Returns a list of series as matrices with one row per series and the years
+	with data packed to the left of each row, so every series can be scored at
+	once with numpy
+
+	RETURN:
+		a (years, deaths, populations, lengths) tuple, where lengths holds the
+		number of years each series has; entries past a row's length are 0
+	'''
+	width = max((len(years) for level, name, state, years in seriesList), default=0)
+	years = numpy.zeros((len(seriesList), width), dtype=numpy.int64)
+	deaths = numpy.zeros((len(seriesList), width))
+	populations = numpy.zeros((len(seriesList), width))
+	lengths = numpy.zeros(len(seriesList), dtype=numpy.int64)
+
+	for row, (level, name, state, seriesYears) in enumerate(seriesList):
+		lengths[row] = len(seriesYears)
+
+		if seriesYears:
+			years[row, :len(seriesYears)], deaths[row, :len(seriesYears)], populations[row, :len(seriesYears)] = zip(*seriesYears)
+
+	return years, deaths, populations, lengths
+
+
+def getRates(deaths, populations):
+	'''
+	Returns deaths per 100,000 people rounded to 3 decimal places, as getRate
+	does, for every entry of two matrices, with 0 where there is no population
+	'''
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		return numpy.where(populations > 0, numpy.round(deaths * 100000 / numpy.where(populations > 0, populations, 1), 3), 0)
+
+
+def getLogLikelihoods(deaths, populations):
+	'''
+	Returns the Poisson log likelihood of runs of years at their own rates,
+	leaving out the terms that cancel when runs are compared, for every entry
+	of two matrices; runs with no deaths score 0
+	'''
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		return numpy.where(deaths > 0, deaths * numpy.log(deaths / populations) - deaths, 0)
+
+
+def makeAlert(level, name, state, year, kind, score, deaths, population, rateBefore):
+	'''
+	Returns an alert as a dictionary with the keys in ALERT_COLUMNS
+	'''
+	return {
+		"level": level,
+		"name": name,
+		"state": state,
+		"year": int(year),
+		"kind": kind,
+		"score": round(float(score), 3),
+		"deaths": float(deaths),
+		"population": float(population),
+		"rateBefore": float(rateBefore),
+		"rate": getRate(float(deaths), float(population))
+	}
+
+
+def findYearOverYearAlerts(seriesList, years, deaths, populations, lengths):
+	'''
+	Returns an alert for each pair of consecutive years, in any series, whose
+	rates differ by at least YEAR_OVER_YEAR_Z and MIN_RELATIVE_CHANGE. The z
+	statistic is the Poisson score test for equal rates, using the pooled rate
+	for the variance so years with few or no deaths are still scored.
+	'''
+	previousDeaths, previousPopulations = deaths[:, :-1], populations[:, :-1]
+	currentDeaths, currentPopulations = deaths[:, 1:], populations[:, 1:]
+	columns = numpy.arange(years.shape[1] - 1)
+	consecutive = (columns[None, :] + 1 < lengths[:, None]) & (years[:, 1:] == years[:, :-1] + 1)
+
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		pooledRates = (previousDeaths + currentDeaths) / (previousPopulations + currentPopulations)
+		variances = pooledRates * (1 / previousPopulations + 1 / currentPopulations)
+		z = (currentDeaths / currentPopulations - previousDeaths / previousPopulations) / numpy.sqrt(variances)
+
+	previousRates = getRates(previousDeaths, previousPopulations)
+	changes = numpy.abs(getRates(currentDeaths, currentPopulations) - previousRates)
+	flagged = consecutive & (variances > 0)
+	flagged &= (numpy.abs(numpy.where(flagged, z, 0)) >= YEAR_OVER_YEAR_Z) & (changes >= MIN_RELATIVE_CHANGE * previousRates)
+	alerts = []
+
+	for row, column in numpy.argwhere(flagged):
+		level, name, state, seriesYears = seriesList[row]
+		alerts.append(makeAlert(level, name, state, years[row, column + 1], "yearOverYear", z[row, column],
+			currentDeaths[row, column], currentPopulations[row, column], previousRates[row, column]))
+
+	return alerts
+
+
+def findChangePoints(seriesList, years, deaths, populations, lengths):
+	'''
+	Returns an alert for the best single change point of each series whose
+	statistic reaches CHANGE_POINT_STATISTIC. Every split leaving
+	MIN_SEGMENT_YEARS years on each side of every series is scored at once
+	from running totals.
+	'''
+	if years.shape[1] < 2 * MIN_SEGMENT_YEARS:
+		return []
+
+	rows = numpy.arange(len(seriesList))
+	deathsBefore = numpy.cumsum(deaths, axis=1)[:, :-1]
+	populationsBefore = numpy.cumsum(populations, axis=1)[:, :-1]
+	totalDeaths = deaths.sum(axis=1)[:, None]
+	totalPopulations = populations.sum(axis=1)[:, None]
+	deathsAfter = totalDeaths - deathsBefore
+	populationsAfter = totalPopulations - populationsBefore
+
+	# Column k splits a series after its first k + 1 years
+	splits = numpy.arange(1, years.shape[1])
+	valid = (splits[None, :] >= MIN_SEGMENT_YEARS) & (lengths[:, None] - splits[None, :] >= MIN_SEGMENT_YEARS)
+
+	baselines = getLogLikelihoods(totalDeaths, totalPopulations)
+	statistics = 2 * (getLogLikelihoods(deathsBefore, populationsBefore) + getLogLikelihoods(deathsAfter, populationsAfter) - baselines)
+	statistics = numpy.where(valid, statistics, -numpy.inf)
+	best = numpy.argmax(statistics, axis=1)
+	bestStatistics = statistics[rows, best]
+	alerts = []
+
+	for row in numpy.flatnonzero(bestStatistics >= CHANGE_POINT_STATISTIC):
+		level, name, state, seriesYears = seriesList[row]
+		column = best[row]
+		rateBefore = getRate(float(deathsBefore[row, column]), float(populationsBefore[row, column]))
+		alerts.append(makeAlert(level, name, state, years[row, column + 1], "changePoint", bestStatistics[row],
+			deathsAfter[row, column], populationsAfter[row, column], rateBefore))
+
+	return alerts
+
+
+def scoreSeries(seriesChunk):
+	'''
+	Returns the alerts for a list of series, scoring them all at once. Runs
+	inside a worker process when the job is parallel.
+	'''
+	if not seriesChunk:
+		return []
+
+	matrices = packSeries(seriesChunk)
+
+	return findYearOverYearAlerts(seriesChunk, *matrices) + findChangePoints(seriesChunk, *matrices)
+
+
+def getWorkerCount(seriesCount, workers=None):
+	'''
+	Returns how many processes to score seriesCount series in. An explicit
+	workers is used as given. By default there is one per CPU, but never so
+	many that a process gets fewer than MIN_SERIES_PER_WORKER series, since
+	starting one costs more than scoring that many.
+	'''
+	if workers is not None:
+		return max(1, workers)
+
+	return max(1, min(os.cpu_count() or 1, seriesCount // MIN_SERIES_PER_WORKER))
+
+
+def detectAnomalies(seriesList, workers=None):
+	'''
+	Scores every series and returns all of their alerts
+
+	PARAMETERS:
+		seriesList - the series from getSeries
+		workers - the number of processes to score in; by default one per CPU
+		for large inputs (see getWorkerCount); with 1, the series are scored in
+		this process
+
+	RETURN:
+		a list of alerts, strongest first
+	'''
+	workers = getWorkerCount(len(seriesList), workers)
+
+	if workers <= 1:
+		alerts = scoreSeries(seriesList)
+
+	else:
+		chunkSize = math.ceil(len(seriesList) / workers)
+		chunks = [seriesList[start:start + chunkSize] for start in range(0, len(seriesList), chunkSize)]
+		context = multiprocessing.get_context("spawn")
+		alerts = []
+
+		with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+			for chunkAlerts in executor.map(scoreSeries, chunks):
+				alerts.extend(chunkAlerts)
+
+	alerts.sort(key=lambda alert: (-abs(alert["score"]), alert["name"], alert["year"]))
+
+	return alerts
+
+
+def runJob(dataSource, workers=None):
+	'''
+	Reads every state and county series, scores them and stores the alerts
+
+	RETURN:
+		a dictionary with the number of "series" scored, the number of "alerts"
+		of each kind and the number of "seconds" the job took
+	'''
+	startTime = time.monotonic()
+	seriesList = getSeries(HomicideCube.build(dataSource))
+	alerts = detectAnomalies(seriesList, workers)
+	dataSource.saveAlerts(alerts)
+
+	kinds = {}
+	for alert in alerts:
+		kinds[alert["kind"]] = kinds.get(alert["kind"], 0) + 1
+
+	return {"series": len(seriesList), "alerts": kinds, "seconds": round(time.monotonic() - startTime, 3)}
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Flag unusual jumps and change points in homicide rates")
+	parser.add_argument("--workers", type=int, default=None,
+		help="processes to score the series in (default one per CPU for large inputs)")
+	arguments = parser.parse_args()
+
+	config = loadConfig()
+	connection = psycopg2.connect(**getConnectionParameters(config))
+	summary = runJob(DataSource(connection, config["ITERSIZE"]), arguments.workers)
+	connection.close()
+
+	print(f"Scored {summary['series']} series in {summary['seconds']} seconds: {summary['alerts']}")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,189 @@
+'''
+cachewarmer.py precomputes every national and state query result and loads
+them into the result cache, so that no user request has to wait on the
+database. The work is spread across a pool of processes, each of which
+opens its own database connection.
+'''
+
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+
+from datasource import FIRST_YEAR, LAST_YEAR
+from resultcache import makeNationalKey, makeStateKey
+
+
+def getWarmupKeys(states):
+	'''
+	Returns the key of every query the site can be asked for: the nation and
+	each state over every valid (startYear, endYear) pair. National keys come
+	first since they back the home page.
+
+	PARAMETERS:
+		states - the state names to warm, typically the keys of stateDictionary
+
+	RETURN:
+		a list of cache keys
+	'''
+	yearRanges = []
+
+	for startYear in range(FIRST_YEAR, LAST_YEAR + 1):
+		for endYear in range(startYear, LAST_YEAR + 1):
+			yearRanges.append((startYear, endYear))
+
+	keys = [makeNationalKey(startYear, endYear) for startYear, endYear in yearRanges]
+
+	for state in states:
+		for startYear, endYear in yearRanges:
+			keys.append(makeStateKey(startYear, endYear, state))
+
+	return keys
+
+
+def computeKey(key):
+	'''
+	Computes the result for a single cache key. Runs inside a worker process,
+	which connects to the database with the settings in its environment the
+	first time webapp runs a query.
+
+	PARAMETERS:
+		key - a key built by makeNationalKey or makeStateKey
+
+	RETURN:
+		a tuple of the key, the computed data table (or None) and an error
+		message (or None)
+	'''
+	import webapp
+
+	try:
+		if key[0] == "national":
+			result = webapp.getNationalQueryData(key[1], key[2])
+
+		else:
+			result = webapp.getStateQueryData(key[1], key[2], key[3])
+
+		return key, result, None
+
+	except Exception as e:
+		return key, None, str(e)
+
+
+def printProgress(done, total, failed):
+	'''
+	Prints how far along the warm-up is, roughly every five percent
+	'''
+	step = max(total // 20, 1)
+
+	if done % step == 0 or done == total:
+		print(f"Cache warm-up: {done}/{total} done, {failed} failed")
+
+
+def warmCache(cache, keys, workers=None, progress=printProgress):
+	'''
+	Computes every key that is not already cached and stores the results in
+	cache as they finish, stopping if the cache is cleared meanwhile. At most two tasks per worker are outstanding at
+	once, so memory stays bounded no matter how many keys there are.
+
+	PARAMETERS:
+		cache - the ResultCache to fill
+		keys - the keys to compute, from getWarmupKeys
+		workers - the number of worker processes, defaulting to the CPU count
+		progress - called as progress(done, total, failed) after each key,
+		or None for no reporting
+
+	RETURN:
+		a dictionary with the number of keys "warmed", the number that "failed"
+		and the number of "seconds" the warm-up took
+	'''
+	startTime = time.monotonic()
+	generation = cache.getGeneration()
+	keys = [key for key in keys if not cache.contains(key)]
+	total = len(keys)
+	workers = workers or os.cpu_count() or 1
+	maxPending = workers * 2
+	done = 0
+	failed = 0
+
+	# Spawned workers start clean instead of inheriting this process's connection
+	context = multiprocessing.get_context("spawn")
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+		remaining = iter(keys)
+		pending = set()
+
+		while True:
+			# A cleared cache has a warm-up of its own, so this one stops early
+			while len(pending) < maxPending and cache.getGeneration() == generation:
+				key = next(remaining, None)
+
+				if key is None:
+					break
+
+				pending.add(executor.submit(computeKey, key))
+
+			if not pending:
+				break
+
+			finished, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+			for future in finished:
+				key, result, error = future.result()
+				done = done + 1
+
+				if error is None:
+					cache.set(key, result, generation)
+
+				else:
+					failed = failed + 1
+					print(f"Cache warm-up failed for {key}: {error}")
+
+				if progress is not None:
+					progress(done, total, failed)
+
+	return {"warmed": done - failed, "failed": failed, "seconds": round(time.monotonic() - startTime, 3)}
+
+
+def runBuilders(builders):
+	'''
+	Runs each builder in this process. A builder that fails is reported and
+	left for the first request that needs it to retry.
+	'''
+	for builder in builders:
+		try:
+			builder()
+
+		except Exception as e:
+			print(f"Cache warm-up failed for {builder.__name__}: {e}")
+
+
+def runWarmer(cache, keys, workers, builders):
+	'''
+	Runs the builders, then warmCache
+	'''
+	runBuilders(builders)
+
+	return warmCache(cache, keys, workers)
+
+
+def startWarmer(cache, states, workers=None, builders=()):
+	'''
+	Runs warmCache over every national and state key on a background thread,
+	so the server can start answering requests while the cache fills.
+
+	PARAMETERS:
+		cache - the ResultCache to fill
+		states - the state names to warm
+		workers - the number of worker processes, defaulting to the CPU count
+		builders - functions that build this process's in-memory structures,
+		like webapp.getTrendPanel, run on the same thread before the keys
+
+	RETURN:
+		the started thread
+	'''
+	keys = getWarmupKeys(states)
+	thread = threading.Thread(target=runWarmer, args=(cache, keys, workers, builders), daemon=True)
+	thread.start()
+
+	return thread
@@ -0,0 +1,216 @@
+'''
+comparison.py compares homicide in two periods, for example 1999-2005
+against 2011-2017, for any set of states and counties at once. Both periods
+are read from the precomputed cube, so each period costs one scan of the
+all-causes rollup and one of the by-cause rollup however many places are
+compared.
+
+Changes are flagged as significant with two-sided z-tests at the 5% level:
+rates treat deaths as Poisson counts, and cause shares compare the two
+periods' proportions of deaths.
+
+Cause shares are of all deaths, with the deaths of causes CDC suppressed
+shown as OTHER, so they add up to 100 like the state page's. The state page
+also counts a cause as Other when it is missing in any year of the range,
+so its shares can still differ.
+'''
+
+import math
+
+from datasource import FIRST_YEAR, LAST_YEAR
+from cube import getRate
+
+# |z| at or above this is significant at the 5% level
+SIGNIFICANCE_Z = 1.96
+
+NATION = "United States"
+
+# The share of deaths not covered by a reported cause
+OTHER = "Other"
+
+
+def checkPeriod(period):
+	'''
+	Raises ValueError unless period is a (startYear, endYear) tuple within
+	FIRST_YEAR to LAST_YEAR with startYear no later than endYear
+	'''
+	startYear, endYear = period
+
+	if startYear > endYear or startYear < FIRST_YEAR or endYear > LAST_YEAR:
+		raise ValueError(f"Invalid period {startYear}-{endYear}: years must be between {FIRST_YEAR} and {LAST_YEAR}, start first")
+
+
+def getRateZ(firstDeaths, firstPopulation, secondDeaths, secondPopulation):
+	'''
+	Returns the z statistic for the change between two rates, treating each
+	period's deaths as a Poisson count, or None if either period has no
+	population or neither has any deaths
+	'''
+	if firstPopulation == 0 or secondPopulation == 0:
+		return None
+
+	variance = firstDeaths / firstPopulation ** 2 + secondDeaths / secondPopulation ** 2
+
+	if variance == 0:
+		return None
+
+	return (secondDeaths / secondPopulation - firstDeaths / firstPopulation) / math.sqrt(variance)
+
+
+def getShareZ(firstCount, firstTotal, secondCount, secondTotal):
+	'''
+	Returns the z statistic for the change between two shares, using the
+	pooled two-proportion test, or None if it cannot be computed
+	'''
+	if firstTotal == 0 or secondTotal == 0:
+		return None
+
+	pooled = (firstCount + secondCount) / (firstTotal + secondTotal)
+	variance = pooled * (1 - pooled) * (1 / firstTotal + 1 / secondTotal)
+
+	if variance == 0:
+		return None
+
+	return (secondCount / secondTotal - firstCount / firstTotal) / math.sqrt(variance)
+
+
+def isSignificant(z):
+	'''
+	Returns whether a z statistic is significant, False if there is none
+	'''
+	return z is not None and abs(z) >= SIGNIFICANCE_Z
+
+
+def getPeriodFigures(cube, level, names, period):
+	'''
+	Returns one period's deaths, population and deaths by cause for each of
+	the requested places, with one scan of each rollup
+
+	PARAMETERS:
+		cube - the HomicideCube to read from
+		level - "state", "county", or "nation" for the whole country
+		names - the state or county names to include (ignored for "nation")
+		period - a (startYear, endYear) tuple
+
+	RETURN:
+		a dictionary from each place name to a dictionary with its "deaths",
+		"population" and "causes", a dictionary from cause to deaths
+	'''
+	filters = {"year": period}
+	groupBy = []
+
+	if level != "nation":
+		filters[level] = names
+		groupBy = [level]
+
+	figures = {}
+
+	for result in cube.query(groupBy, filters, ["deaths", "population"]):
+		name = result.get(level, NATION)
+		figures[name] = {"deaths": result["deaths"], "population": result["population"], "causes": {}}
+
+	for result in cube.query(groupBy + ["cause"], filters, ["deaths"]):
+		name = result.get(level, NATION)
+		if name in figures:
+			figures[name]["causes"][result["cause"]] = result["deaths"]
+
+	return figures
+
+
+def compareCauses(first, second):
+	'''
+	Returns the share of all deaths by each cause in both periods, its change
+	in percentage points and whether the change is significant, sorted by the
+	size of the change. Deaths not covered by a reported cause are shown as
+	OTHER when there are any.
+	'''
+	firstTotal = first["deaths"]
+	secondTotal = second["deaths"]
+	firstCauses = dict(first["causes"])
+	secondCauses = dict(second["causes"])
+	firstOther = firstTotal - sum(firstCauses.values())
+	secondOther = secondTotal - sum(secondCauses.values())
+
+	if firstOther > 0 or secondOther > 0:
+		firstCauses[OTHER] = max(firstOther, 0)
+		secondCauses[OTHER] = max(secondOther, 0)
+
+	causes = []
+
+	for cause in set(firstCauses) | set(secondCauses):
+		firstCount = firstCauses.get(cause, 0)
+		secondCount = secondCauses.get(cause, 0)
+		firstShare = round(firstCount * 100 / firstTotal, 2) if firstTotal else 0
+		secondShare = round(secondCount * 100 / secondTotal, 2) if secondTotal else 0
+
+		causes.append({
+			"cause": cause,
+			"firstShare": firstShare,
+			"secondShare": secondShare,
+			"shareChange": round(secondShare - firstShare, 2),
+			"significant": isSignificant(getShareZ(firstCount, firstTotal, secondCount, secondTotal))
+		})
+
+	causes.sort(key=lambda cause: (-abs(cause["shareChange"]), cause["cause"]))
+
+	return causes
+
+
+def comparePlace(level, name, first, second):
+	'''
+	Returns the comparison of one place's two periods
+	'''
+	firstRate = getRate(first["deaths"], first["population"])
+	secondRate = getRate(second["deaths"], second["population"])
+	z = getRateZ(first["deaths"], first["population"], second["deaths"], second["population"])
+
+	return {
+		"level": level,
+		"name": name,
+		"first": {"deaths": first["deaths"], "population": first["population"], "rate": firstRate},
+		"second": {"deaths": second["deaths"], "population": second["population"], "rate": secondRate},
+		"rateChange": round(secondRate - firstRate, 3),
+		"percentChange": round((secondRate - firstRate) * 100 / firstRate, 2) if firstRate else None,
+		"zScore": round(z, 3) if z is not None else None,
+		"significant": isSignificant(z),
+		"causes": compareCauses(first, second)
+	}
+
+
+def comparePeriods(cube, firstPeriod, secondPeriod, states=None, counties=None):
+	'''
+	Compares the homicide rate and the mix of causes between two periods for
+	each requested place
+
+	PARAMETERS:
+		cube - the HomicideCube to read from
+		firstPeriod - the earlier (startYear, endYear) tuple
+		secondPeriod - the later (startYear, endYear) tuple
+		states - a list of state names to compare
+		counties - a list of county names, like "Cuyahoga County, OH", to compare;
+		the nation as a whole is compared when neither states nor counties are given
+
+	RETURN:
+		a list with one comparison per place that has data in both periods (see
+		comparePlace), states first and then counties, in the order requested
+
+	Raises ValueError for an invalid period.
+	'''
+	checkPeriod(firstPeriod)
+	checkPeriod(secondPeriod)
+
+	places = [("state", states or []), ("county", counties or [])]
+	if not states and not counties:
+		places = [("nation", [NATION])]
+
+	comparisons = []
+
+	for level, names in places:
+		first = getPeriodFigures(cube, level, names, firstPeriod)
+		second = getPeriodFigures(cube, level, names, secondPeriod)
+
+		for name in names:
+			if name in first and name in second:
+				comparisons.append(comparePlace(level, name, first[name], second[name]))
+
+	return comparisons
@@ -0,0 +1,91 @@
+'''
+config.py reads the web app's settings from the environment, so that
+credentials and tuning knobs do not live in the source.
+
+	HOMICIDE_DB_NAME - the database to connect to (default "huhe")
+	HOMICIDE_DB_USER - the user to connect as (default the database name)
+	HOMICIDE_DB_PASSWORD - the user's password (default none, so libpq falls
+		back to PGPASSWORD or ~/.pgpass)
+	HOMICIDE_DB_HOST - the database host or socket directory (default libpq's)
+	HOMICIDE_DB_PORT - the database port (default libpq's)
+	HOMICIDE_ITERSIZE - rows fetched per round trip when streaming (default 2000)
+	HOMICIDE_QUERY_TIMEOUT - seconds to wait on an identical in-flight query (default 60)
+	HOMICIDE_WARM_CACHE - "1" to warm the result cache when the app is created (default "1")
+	HOMICIDE_SLOW_QUERY_MS - statements at least this slow are logged (default 200)
+	HOMICIDE_EXPLAIN_SAMPLE_RATE - fraction of slow statements to EXPLAIN ANALYZE (default 0)
+	HOMICIDE_SLOW_QUERY_BUFFER - slow statements kept for /admin/slowQueries/ (default 100)
+	HOMICIDE_ADMIN_TOKEN - the token the /admin/ routes require; they are
+		disabled when it is not set
+	HOMICIDE_NATIONAL_CONCURRENCY - uncached national queries a worker runs at once (default 1)
+	HOMICIDE_STATE_CONCURRENCY - uncached state queries a worker runs at once (default 4)
+	HOMICIDE_BUILD_CONCURRENCY - full reads of every state and county table (for
+		the cube and county panel) a worker runs at once (default 1)
+	HOMICIDE_ADMISSION_QUEUE - queries of each kind that may wait for a turn (default 32)
+	HOMICIDE_ADMISSION_DEADLINE - seconds a query may wait before the request
+		gets a 503 (default 10)
+	HOMICIDE_GEOGRAPHY_FILE - the JSON file of custom county groups, such as metro
+		areas (default geographies.json next to the app; see geography.py)
+'''
+
+import os
+
+from datasource import DEFAULT_ITERSIZE
+
+# The database the app reads when HOMICIDE_DB_NAME is not set
+DEFAULT_DB_NAME = "huhe"
+
+DEFAULT_GEOGRAPHY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "geographies.json")
+
+
+def loadConfig(environ=None):
+	'''
+	Returns the app's settings as a dictionary
+
+	PARAMETERS:
+		environ - the mapping to read settings from, defaulting to os.environ
+
+	RETURN:
+		a dictionary of settings, with environment values converted to the
+		types the app expects
+	'''
+	if environ is None:
+		environ = os.environ
+
+	databaseName = environ.get("HOMICIDE_DB_NAME", DEFAULT_DB_NAME)
+
+	return {
+		"DATABASE_NAME": databaseName,
+		"DATABASE_USER": environ.get("HOMICIDE_DB_USER", databaseName),
+		"DATABASE_PASSWORD": environ.get("HOMICIDE_DB_PASSWORD"),
+		"DATABASE_HOST": environ.get("HOMICIDE_DB_HOST"),
+		"DATABASE_PORT": environ.get("HOMICIDE_DB_PORT"),
+		"ITERSIZE": int(environ.get("HOMICIDE_ITERSIZE", DEFAULT_ITERSIZE)),
+		"QUERY_TIMEOUT": float(environ.get("HOMICIDE_QUERY_TIMEOUT", 60)),
+		"WARM_CACHE": environ.get("HOMICIDE_WARM_CACHE", "1") == "1",
+		"SLOW_QUERY_MS": float(environ.get("HOMICIDE_SLOW_QUERY_MS", 200)),
+		"EXPLAIN_SAMPLE_RATE": float(environ.get("HOMICIDE_EXPLAIN_SAMPLE_RATE", 0)),
+		"SLOW_QUERY_BUFFER": int(environ.get("HOMICIDE_SLOW_QUERY_BUFFER", 100)),
+		"ADMIN_TOKEN": environ.get("HOMICIDE_ADMIN_TOKEN"),
+		"NATIONAL_CONCURRENCY": int(environ.get("HOMICIDE_NATIONAL_CONCURRENCY", 1)),
+		"STATE_CONCURRENCY": int(environ.get("HOMICIDE_STATE_CONCURRENCY", 4)),
+		"BUILD_CONCURRENCY": int(environ.get("HOMICIDE_BUILD_CONCURRENCY", 1)),
+		"ADMISSION_QUEUE": int(environ.get("HOMICIDE_ADMISSION_QUEUE", 32)),
+		"ADMISSION_DEADLINE": float(environ.get("HOMICIDE_ADMISSION_DEADLINE", 10)),
+		"GEOGRAPHY_FILE": environ.get("HOMICIDE_GEOGRAPHY_FILE", DEFAULT_GEOGRAPHY_FILE)
+	}
+
+
+def getConnectionParameters(config):
+	'''
+	Returns the keyword arguments for psycopg2.connect described by config,
+	leaving out any setting that was not given so libpq can use its defaults
+	'''
+	parameters = {
+		"database": config["DATABASE_NAME"],
+		"user": config["DATABASE_USER"],
+		"password": config["DATABASE_PASSWORD"],
+		"host": config["DATABASE_HOST"],
+		"port": config["DATABASE_PORT"]
+	}
+
+	return {name: value for name, value in parameters.items() if value is not None}
@@ -0,0 +1,289 @@
+'''
+countypanel.py holds every county's history in one structure, so a county,
+a state's counties or all counties can be read without scanning the
+per-year county tables.
+
+The panel is a county x year x cause matrix stored sparsely in flat typed
+arrays. Counties are rows ordered by FIPS code, so each state's counties are
+one contiguous block (a county's FIPS code is its state's code times 1000
+plus its own). Each (county, year) cell has a mask value saying whether CDC
+reported the county that year and, if so, its population and the deaths of
+each reported cause, stored back to back in compressed sparse row form.
+A cause missing from a reported cell was suppressed for having too few deaths.
+'''
+
+import array
+
+from datasource import FIRST_YEAR, LAST_YEAR
+from cube import getStateOfCounty, getRate
+
+# Mask values of a (county, year) cell
+MISSING = 0
+REPORTED = 1
+
+
+class CountyPanel:
+	'''
+	CountyPanel is read-only once built. Cell i is county row i // numYears
+	and year FIRST_YEAR + i % numYears; its causes and deaths are the entries
+	cellStarts[i] up to cellStarts[i + 1] of causeIndexes and deaths.
+	'''
+
+	def __init__(self, fipsCodes, names, causes):
+		'''
+		PARAMETERS:
+			fipsCodes - every county's FIPS code, sorted
+			names - each county's name, in the same order
+			causes - every cause of death, sorted
+		'''
+		self.years = list(range(FIRST_YEAR, LAST_YEAR + 1))
+		self.numYears = len(self.years)
+		self.fipsCodes = array.array('l', fipsCodes)
+		self.names = names
+		self.causes = causes
+		self.rowOfFips = {fips: row for row, fips in enumerate(fipsCodes)}
+		self.rowOfName = {name: row for row, name in enumerate(names)}
+		self.causeIndex = {cause: index for index, cause in enumerate(causes)}
+
+		cellCount = len(fipsCodes) * self.numYears
+		self.mask = array.array('b', bytes(cellCount))
+		self.population = array.array('d', [0]) * cellCount
+		self.cellStarts = array.array('l', [0]) * (cellCount + 1)
+		self.causeIndexes = array.array('h')
+		self.deaths = array.array('d')
+
+		# state name -> (first row, row after the last), contiguous by FIPS order
+		self.stateRows = {}
+
+		for row, name in enumerate(names):
+			state = getStateOfCounty(name)
+			first = self.stateRows.get(state, (row, row))[0]
+			self.stateRows[state] = (first, row + 1)
+
+
+	@classmethod
+	def build(cls, dataSource):
+		'''
+		Reads every county row of every year once and returns the panel
+
+		PARAMETERS:
+			dataSource - the DataSource to read from
+		'''
+		cells = {}
+		names = {}
+		causes = set()
+
+		for year, rows in dataSource.getCountyQuery(FIRST_YEAR, LAST_YEAR, "%", iterate=True):
+			for row in rows:
+				name, fips, cause, deaths, population = row[1], row[2], row[3], row[5], row[6]
+
+				if fips is None or getStateOfCounty(name) is None:
+					continue
+
+				fips = int(fips)
+				names[fips] = name
+				causes.add(cause)
+				cell = cells.setdefault((fips, year), [population or 0, []])
+				cell[1].append((cause, deaths or 0))
+
+		fipsCodes = sorted(names)
+		panel = cls(fipsCodes, [names[fips] for fips in fipsCodes], sorted(causes))
+		panel.fill(cells)
+
+		return panel
+
+
+	def fill(self, cells):
+		'''
+		Stores the cells read by build, in cell order
+
+		PARAMETERS:
+			cells - a dictionary from (fips, year) to a [population, [(cause, deaths), ...]] pair
+		'''
+		cell = 0
+
+		for fips in self.fipsCodes:
+			for year in self.years:
+				if (fips, year) in cells:
+					population, causeDeaths = cells[(fips, year)]
+					self.mask[cell] = REPORTED
+					self.population[cell] = population
+
+					for cause, deaths in sorted(causeDeaths, key=lambda pair: self.causeIndex[pair[0]]):
+						self.causeIndexes.append(self.causeIndex[cause])
+						self.deaths.append(deaths)
+
+				cell = cell + 1
+				self.cellStarts[cell] = len(self.deaths)
+
+
+	def getRow(self, county):
+		'''
+		Returns the row of a county given by FIPS code or canonical name
+
+		Raises ValueError if the panel has no such county.
+		'''
+		row = self.rowOfFips.get(county) if isinstance(county, int) else self.rowOfName.get(county)
+
+		if row is None:
+			raise ValueError(f"No county data for {county}")
+
+		return row
+
+
+	def getRows(self, state=None):
+		'''
+		Returns the range of rows of a state's counties, or of all counties
+		'''
+		if state is None:
+			return range(len(self.fipsCodes))
+
+		if state not in self.stateRows:
+			raise ValueError(f"No county data for {state}")
+
+		return range(*self.stateRows[state])
+
+
+	def getCellRange(self, row, startYear, endYear):
+		'''
+		Returns the first cell and the cell after the last for a county's years
+		'''
+		if startYear > endYear or startYear < FIRST_YEAR or endYear > LAST_YEAR:
+			raise ValueError(f"Years must be between {FIRST_YEAR} and {LAST_YEAR}, start first")
+
+		first = row * self.numYears + startYear - FIRST_YEAR
+
+		return first, first + endYear - startYear + 1
+
+
+	def getDeaths(self, firstCell, endCell, cause=None):
+		'''
+		Returns the reported deaths in a run of cells, of one cause or all
+		'''
+		start, end = self.cellStarts[firstCell], self.cellStarts[endCell]
+
+		if cause is None:
+			return sum(self.deaths[start:end])
+
+		index = self.causeIndex.get(cause)
+
+		return sum(deaths for causeIndex, deaths in zip(self.causeIndexes[start:end], self.deaths[start:end]) if causeIndex == index)
+
+
+	def getHistory(self, county):
+		'''
+		Returns a county's figures for every year
+
+		PARAMETERS:
+			county - the county's FIPS code or canonical name
+
+		RETURN:
+			a dictionary with the county's "fips", "county" name and "years", a list
+			with one dictionary per year holding the "year", whether it was
+			"reported", and if so its "population", "deaths" and "rate" over the
+			reported causes and the deaths of each reported cause ("causes")
+		'''
+		row = self.getRow(county)
+		firstCell, endCell = self.getCellRange(row, FIRST_YEAR, LAST_YEAR)
+		years = []
+
+		for cell in range(firstCell, endCell):
+			year = {"year": self.years[cell - firstCell], "reported": self.mask[cell] == REPORTED}
+
+			if year["reported"]:
+				start, end = self.cellStarts[cell], self.cellStarts[cell + 1]
+				year["population"] = self.population[cell]
+				year["deaths"] = sum(self.deaths[start:end])
+				year["rate"] = getRate(year["deaths"], year["population"])
+				year["causes"] = {self.causes[self.causeIndexes[entry]]: self.deaths[entry] for entry in range(start, end)}
+
+			years.append(year)
+
+		return {"fips": f"{self.fipsCodes[row]:05d}", "county": self.names[row], "years": years}
+
+
+	def getRanking(self, startYear, endYear, state=None, cause=None, limit=None, minYears=None):
+		'''
+		Ranks counties by their rate over a year range, counting only the years
+		each county was reported. A county reported in a single unusual year
+		would otherwise outrank counties with a full record, so counties
+		reported in fewer than minYears of the years are left out.
+
+		PARAMETERS:
+			startYear - the first year to include
+			endYear - the last year to include
+			state - a state name to only rank its counties
+			cause - a cause of death to only count its deaths
+			limit - the number of counties to return, or None for all
+			minYears - the fewest reported years a county needs to be ranked,
+			or None for half of the range's years, rounded up
+
+		RETURN:
+			a list of dictionaries with each county's "fips", "county" name,
+			"deaths", "population", "rate" and "yearsReported", highest rate first
+
+		Raises ValueError if limit is less than 1 or minYears is not between 1
+		and the number of years in the range.
+		'''
+		numYears = endYear - startYear + 1
+
+		if minYears is None:
+			minYears = (numYears + 1) // 2
+
+		if limit is not None and limit < 1:
+			raise ValueError("The limit must be at least 1")
+
+		if not 1 <= minYears <= max(numYears, 1):
+			raise ValueError(f"The minimum years reported must be between 1 and {numYears}")
+
+		ranking = []
+
+		for row in self.getRows(state):
+			firstCell, endCell = self.getCellRange(row, startYear, endYear)
+			yearsReported = sum(self.mask[firstCell:endCell])
+
+			if yearsReported < minYears:
+				continue
+
+			deaths = self.getDeaths(firstCell, endCell, cause)
+			population = sum(self.population[firstCell:endCell])
+
+			ranking.append({
+				"fips": f"{self.fipsCodes[row]:05d}",
+				"county": self.names[row],
+				"deaths": deaths,
+				"population": population,
+				"rate": getRate(deaths, population),
+				"yearsReported": yearsReported
+			})
+
+		ranking.sort(key=lambda county: (-county["rate"], county["county"]))
+
+		return ranking[:limit] if limit is not None else ranking
+
+
+	def getMap(self, year, state=None, cause=None):
+		'''
+		Returns every county's rate in one year, for drawing a map
+
+		PARAMETERS:
+			year - the year to map
+			state - a state name to only map its counties
+			cause - a cause of death to only count its deaths
+
+		RETURN:
+			a list of dictionaries with each county's "fips", "county" name and
+			"rate", which is None when the county was not reported that year
+		'''
+		counties = []
+
+		for row in self.getRows(state):
+			cell, endCell = self.getCellRange(row, year, year)
+			rate = None
+
+			if self.mask[cell] == REPORTED:
+				rate = getRate(self.getDeaths(cell, endCell, cause), self.population[cell])
+
+			counties.append({"fips": f"{self.fipsCodes[row]:05d}", "county": self.names[row], "rate": rate})
+
+		return counties
@@ -0,0 +1,285 @@
+'''
+cube.py answers aggregate questions over year x geography x cause without
+a new query path for each one. Every year's state and county rows are read
+once and rolled up into every combination of dimensions ahead of time, so
+every question is answered by a scan of one or two small precomputed
+tables rather than of the rows.
+
+Populations are summed over distinct (place, year) pairs, so over several
+years they are person-years and the rate is the average annual rate per
+100,000 people, as on the state page.
+'''
+
+import itertools
+
+from datasource import FIRST_YEAR, LAST_YEAR, STATE_DICTIONARY
+
+DIMENSIONS = ["year", "state", "county", "cause"]
+MEASURES = ["deaths", "population", "rate"]
+
+STATE_NAMES = {code: name for name, code in STATE_DICTIONARY.items()}
+
+
+def getStateOfCounty(county):
+	'''
+	Returns the state name for a county name like "Cuyahoga County, OH", or
+	None if the suffix is not a known state code
+	'''
+	return STATE_NAMES.get(county.rsplit(", ", 1)[-1])
+
+
+def getRate(deaths, population):
+	'''
+	Returns deaths per 100,000 people rounded to 3 decimal places, or 0 when
+	there is no population
+	'''
+	if population == 0:
+		return 0
+
+	return round(deaths * 100000 / population, 3)
+
+
+class HomicideCube:
+	'''
+	HomicideCube holds the precomputed rollups. There are two sets of facts:
+	state facts from the state tables, whose Total rows give exact state totals,
+	and county facts from the county tables, which only include the county and
+	cause pairs CDC did not suppress. Questions that involve counties are
+	answered from county facts and all others from state facts.
+	'''
+
+	def __init__(self):
+		# (factSet, dimensions, byCause) -> {key tuple: [deaths, population]}
+		self.cuboids = {}
+
+
+	@classmethod
+	def build(cls, dataSource, startYear=FIRST_YEAR, endYear=LAST_YEAR):
+		'''
+		Reads every state and county row in the year range, one year at a time,
+		and returns a cube with all rollups computed
+
+		PARAMETERS:
+			dataSource - the DataSource to read from
+			startYear - the first year to include
+			endYear - the last year to include
+
+		RETURN:
+			a HomicideCube
+		'''
+		cube = cls()
+		stateYears = dataSource.getUSAQuery(startYear, endYear, iterate=True)
+		countyYears = dataSource.getCountyQuery(startYear, endYear, "%", iterate=True)
+
+		for year, rows in stateYears:
+			for row in rows:
+				cube.addStateRow(year, row)
+
+		for year, rows in countyYears:
+			cube.addCountyRows(year, rows)
+
+		return cube
+
+
+	def addFact(self, factSet, dimensions, facts, deaths, population):
+		'''
+		Adds one fact to every rollup of the given dimensions. Facts broken down
+		by cause and all-causes facts go into separate rollups, so rolling up
+		over cause never adds a cause's deaths to its own total.
+
+		PARAMETERS:
+			factSet - "state" or "county", the table the fact came from
+			dimensions - the names of the fact's dimensions, in DIMENSIONS order
+			facts - the fact's value for each of those dimensions
+			deaths - the fact's deaths
+			population - the fact's population
+		'''
+		byCause = "cause" in dimensions
+
+		for size in range(len(dimensions) + 1):
+			for indexes in itertools.combinations(range(len(dimensions)), size):
+				grouped = tuple(dimensions[index] for index in indexes)
+
+				# Rolling up over cause is answered from the all-causes facts instead
+				if ("cause" in grouped) != byCause:
+					continue
+
+				key = tuple(facts[index] for index in indexes)
+				cuboid = self.cuboids.setdefault((factSet, grouped, byCause), {})
+				cell = cuboid.setdefault(key, [0, 0])
+				cell[0] += deaths
+				cell[1] += population
+
+
+	def addStateRow(self, year, row):
+		'''
+		Adds one row of a states table. Cause rows become cause facts and each
+		state's Total row becomes its all-causes fact; the national Total row
+		is skipped, since it is the sum of the states.
+		'''
+		notes, state, deaths, population = row[0], row[1], row[5] or 0, row[6] or 0
+
+		if state not in STATE_DICTIONARY:
+			return
+
+		if notes == "Total":
+			self.addFact("state", ("year", "state"), (year, state), deaths, population)
+
+		else:
+			self.addFact("state", ("year", "state", "cause"), (year, state, row[3]), deaths, population)
+
+
+	def addCountyRows(self, year, rows):
+		'''
+		Adds one year of a counties table. Each row becomes a cause fact, and
+		each county's reported causes are summed into its all-causes fact.
+		'''
+		countyTotals = {}
+
+		for row in rows:
+			county, deaths, population = row[1], row[5] or 0, row[6] or 0
+			state = getStateOfCounty(county)
+
+			if state is None:
+				continue
+
+			self.addFact("county", ("year", "state", "county", "cause"), (year, state, county, row[3]), deaths, population)
+
+			total = countyTotals.setdefault((state, county), [0, population])
+			total[0] += deaths
+
+		for (state, county), (deaths, population) in countyTotals.items():
+			self.addFact("county", ("year", "state", "county"), (year, state, county), deaths, population)
+
+
+	def query(self, groupBy, filters=None, measures=None):
+		'''
+		Returns the measures for each group of the requested dimensions
+
+		PARAMETERS:
+			groupBy - a list of dimensions to group by, any subset of DIMENSIONS
+			filters - a dictionary from dimension to a list of accepted values;
+			"year" may also be given as a (startYear, endYear) tuple
+			measures - the measures to return, any subset of MEASURES (default all)
+
+		RETURN:
+			a list of dictionaries, one per group, sorted by group, each holding
+			the group's dimension values and measures
+
+		Raises ValueError for an unknown dimension or measure.
+		'''
+		filters = filters or {}
+		measures = measures or MEASURES
+
+		for dimension in list(groupBy) + list(filters):
+			if dimension not in DIMENSIONS:
+				raise ValueError(f"Unknown dimension: {dimension}")
+
+		for measure in measures:
+			if measure not in MEASURES:
+				raise ValueError(f"Unknown measure: {measure}")
+
+		groupBy = [dimension for dimension in DIMENSIONS if dimension in groupBy]
+		groups = self.aggregate(groupBy, filters)
+
+		# Each cause fact carries its place and year's whole population, so summing
+		# several causes' facts would count that population once per cause, and
+		# a cause's facts only cover the places that reported it. Deaths come from
+		# the cause facts and population from the all-causes facts of the same
+		# places and years instead, so a cause's rate is the same whether it is
+		# grouped by or filtered on.
+		if "cause" in groupBy or "cause" in filters:
+			placeGroupBy = [dimension for dimension in groupBy if dimension != "cause"]
+			placeFilters = {dimension: filters[dimension] for dimension in filters if dimension != "cause"}
+			placeGroups = self.aggregate(placeGroupBy, placeFilters)
+
+			if "cause" in groupBy:
+				causeIndex = groupBy.index("cause")
+				groups = {groupKey: [deaths, placeGroups.get(groupKey[:causeIndex] + groupKey[causeIndex + 1:], [0, 0])[1]]
+					for groupKey, (deaths, population) in groups.items()}
+
+			else:
+				groups = {groupKey: [groups[groupKey][0] if groupKey in groups else 0, population]
+					for groupKey, (deaths, population) in placeGroups.items()}
+
+		results = []
+
+		for groupKey in sorted(groups, key=lambda key: tuple(str(value) for value in key)):
+			deaths, population = groups[groupKey]
+			result = dict(zip(groupBy, groupKey))
+			allMeasures = {"deaths": deaths, "population": population, "rate": getRate(deaths, population)}
+
+			for measure in measures:
+				result[measure] = allMeasures[measure]
+
+			results.append(result)
+
+		return results
+
+
+	def aggregate(self, groupBy, filters):
+		'''
+		Sums the facts of the cuboid for groupBy and filters into groups
+
+		PARAMETERS:
+			groupBy - the dimensions to group by, in DIMENSIONS order
+			filters - a dictionary from dimension to accepted values, as in query
+
+		RETURN:
+			a dictionary from each group's tuple of groupBy values to its
+			[deaths, population]
+		'''
+		involved = tuple(dimension for dimension in DIMENSIONS if dimension in groupBy or dimension in filters)
+		factSet = "county" if "county" in involved else "state"
+		cuboid = self.cuboids.get((factSet, involved, "cause" in involved), {})
+		accepted = {dimension: self.getAcceptedValues(dimension, filters[dimension]) for dimension in filters}
+		groups = {}
+
+		for key, (deaths, population) in cuboid.items():
+			values = dict(zip(involved, key))
+
+			if any(values[dimension] not in accepted[dimension] for dimension in accepted):
+				continue
+
+			groupKey = tuple(values[dimension] for dimension in groupBy)
+			cell = groups.setdefault(groupKey, [0, 0])
+			cell[0] += deaths
+			cell[1] += population
+
+		return groups
+
+
+	def getYearlyTotals(self, level):
+		'''
+		Returns the all-causes deaths and population of every state or county
+		in every year it has data for
+
+		PARAMETERS:
+			level - "state" or "county"
+
+		RETURN:
+			a dictionary from each state or county name to a dictionary from year
+			to a (deaths, population) tuple
+		'''
+		if level == "county":
+			cuboid = self.cuboids.get(("county", ("year", "state", "county"), False), {})
+
+		else:
+			cuboid = self.cuboids.get(("state", ("year", "state"), False), {})
+
+		totals = {}
+
+		for key, (deaths, population) in cuboid.items():
+			totals.setdefault(key[-1], {})[key[0]] = (deaths, population)
+
+		return totals
+
+
+	def getAcceptedValues(self, dimension, accepted):
+		'''
+		Returns the set of values a filter accepts, expanding a year range
+		'''
+		if dimension == "year" and isinstance(accepted, tuple):
+			return set(range(accepted[0], accepted[1] + 1))
+
+		return set(accepted)
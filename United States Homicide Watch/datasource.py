@@ -1,5 +1,96 @@
 import psycopg2
 import getpass
+import time
+import uuid
+
+from querytrace import QueryTracer
+
+# The first and last years of CDC data loaded into the database
+FIRST_YEAR = 1999
+LAST_YEAR = 2017
+
+# Rows fetched from a server-side cursor per round trip
+DEFAULT_ITERSIZE = 2000
+
+# The alerts table written by anomalies.py, one row per flagged jump or change point
+# The most alerts getAlerts returns at once
+MAX_ALERTS = 1000
+
+ALERT_COLUMNS = ["level", "name", "state", "year", "kind", "score", "deaths", "population", "rateBefore", "rate"]
+
+ALERTS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS alerts (
+	level text,
+	name text,
+	state text,
+	year integer,
+	kind text,
+	score real,
+	deaths real,
+	population real,
+	ratebefore real,
+	rate real
+);
+CREATE INDEX IF NOT EXISTS alerts_place ON alerts (level, name);
+CREATE INDEX IF NOT EXISTS alerts_state ON alerts (state, year);
+CREATE INDEX IF NOT EXISTS alerts_year ON alerts (year);
+"""
+
+# Every state name the app accepts and its USPS code
+STATE_DICTIONARY = {
+	"Alabama" : "AL",
+	"Alaska" : "AK",
+	"Arizona" : "AZ",
+	"Arkansas" : "AR",
+	"California" : "CA",
+	"Colorado" : "CO",
+	"Connecticut" : "CT",
+	"Delaware" : "DE",
+	"Florida" : "FL",
+	"Georgia" : "GA",
+	"Hawaii" : "HI",
+	"Idaho" : "ID",
+	"Illinois" : "IL",
+	"Indiana" : "IN",
+	"Iowa" : "IA",
+	"Kansas" : "KS",
+	"Kentucky" : "KY",
+	"Louisiana" : "LA",
+	"Maine" : "ME",
+	"Maryland" : "MD",
+	"Massachusetts" : "MA",
+	"Michigan" : "MI",
+	"Minnesota" : "MN",
+	"Mississippi" : "MS",
+	"Missouri" : "MO",
+	"Montana" : "MT",
+	"Nebraska" : "NE",
+	"Nevada" : "NV",
+	"New Hampshire" : "NH",
+	"New Jersey" : "NJ",
+	"New Mexico" : "NM",
+	"New York" : "NY",
+	"North Carolina" : "NC",
+	"North Dakota" : "ND",
+	"Ohio" : "OH",
+	"Oklahoma" : "OK",
+	"Oregon" : "OR",
+	"Pennsylvania" : "PA",
+	"Rhode Island" : "RI",
+	"South Carolina" : "SC",
+	"South Dakota" : "SD",
+	"Tennessee" : "TN",
+	"Texas" : "TX",
+	"Utah" : "UT",
+	"Vermont" : "VT",
+	"Virginia" : "VA",
+	"Washington" : "WA",
+	"West Virginia" : "WV",
+	"Wisconsin" : "WI",
+	"Wyoming" : "WY",
+	"District of Columbia" : "DC"
+}
+
 
 class DataSource:
 	'''
@@ -8,70 +99,30 @@ class DataSource:
 	or some other collection or object.
 	'''
 
-	def __init__(self, connection):
+	def __init__(self, connection, itersize=DEFAULT_ITERSIZE, tracer=None):
+		'''
+		PARAMETERS:
+			connection - an open database connection
+			itersize - the number of rows fetched per round trip by the
+			iterator mode of the query methods
+			tracer - the QueryTracer that times every statement, or None for
+			one with the default settings
+		'''
 		self.connection = connection
-		self.stateDictionary = {
-				"Alabama" : "AL",
-				"Alaska" : "AK",
-				"Arizona" : "AZ",
-				"Arkansas" : "AR",
-				"California" : "CA",
-				"Colorado" : "CO",
-				"Connecticut" : "CT",
-				"Delaware" : "DE",
-				"Florida" : "FL",
-				"Georgia" : "GA",
-				"Hawaii" : "HI",
-				"Idaho" : "ID",
-				"Illinois" : "IL",
-				"Indiana" : "IN",
-				"Iowa" : "IA",
-				"Kansas" : "KS",
-				"Kentucky" : "KY",
-				"Louisiana" : "LA",
-				"Maine" : "ME",
-				"Maryland" : "MD",
-				"Massachusetts" : "MA",
-				"Michigan" : "MI",
-				"Minnesota" : "MN",
-				"Mississippi" : "MS",
-				"Missouri" : "MO",
-				"Montana" : "MT",
-				"Nebraska" : "NE",
-				"Nevada" : "NV",
-				"New Hampshire" : "NH",
-				"New Jersey" : "NJ",
-				"New Mexico" : "NM",
-				"New York" : "NY",
-				"North Carolina" : "NC",
-				"North Dakota" : "ND",
-				"Ohio" : "OH",
-				"Oklahoma" : "OK",
-				"Oregon" : "OR",
-				"Pennsylvania" : "PA",
-				"Rhode Island" : "RI",
-				"South Carolina" : "SC",
-				"South Dakota" : "SD",
-				"Tennessee" : "TN",
-				"Texas" : "TX",
-				"Utah" : "UT",
-				"Vermont" : "VT",
-				"Virginia" : "VA",
-				"Washington" : "WA",
-				"West Virginia" : "WV",
-				"Wisconsin" : "WI",
-				"Wyoming" : "WY",
-				"District of Columbia" : "DC"
-				}
-
-
-	def getUSAQuery(self, startYear, endYear):
+		self.itersize = itersize
+		self.tracer = tracer if tracer is not None else QueryTracer()
+		self.stateDictionary = STATE_DICTIONARY
+
+
+	def getUSAQuery(self, startYear, endYear, iterate=False):
 		'''
 		returns a list of all states and their associated homicide data
 
 		PARAMETERS:
 			startYear - the first year of data to draw from
 			endYear - the last year of data to draw from
+			iterate - if True, return a generator of (year, rows) pairs whose rows
+			are streamed from the database instead of a list of lists
 
 		RETURN:
 			a list of all of the states and associated homicide data for each
@@ -87,6 +138,9 @@ class DataSource:
 		except Exception as e:
 			return e
 
+		if iterate:
+			return self.iterateYears(self.getUSASingleYearQuery, startYear, endYear)
+
 		yearRange = endYear - startYear + 1
 
 		try:
@@ -103,12 +157,13 @@ class DataSource:
 		return []
 
 
-	def getUSASingleYearQuery(self, year):
+	def getUSASingleYearQuery(self, year, iterate=False):
 		'''
 		returns a list of all states and thier associated homicide data
 		
 		PARAMETERS:
 			year: the year of data to draw from
+			iterate: if True, return a generator that streams the rows instead of a list
 		
 		RETURN:
 			a list of all states and associated data
@@ -120,13 +175,14 @@ class DataSource:
 		except Exception as e:
 			return e
 
+		if iterate:
+			return self.iterateQuery(f"SELECT * FROM states{year}")
+
 		results = []
 
 		try:
-			cursor = self.connection.cursor()
 			query = f"SELECT * FROM states{year}"
-			cursor.execute(query)
-			results = cursor.fetchall()
+			results = self.fetchAll(query)
 
 		except Exception as e:
 			print("Something when wrong when excecuting the query (state)" + str(e))
@@ -136,13 +192,15 @@ class DataSource:
 		return []
 
 
-	def getUSATotals(self, startYear, endYear):
+	def getUSATotals(self, startYear, endYear, iterate=False):
 		'''
 		returns just the totals for the whole USA and each state
 
 		PARAMETERS:
 			startYear: The first year to gather data for
 			endYear: the lastyear to gather data for (inclusive)
+			iterate: if True, return a generator of (year, rows) pairs whose rows
+			are streamed from the database instead of a list of lists
 
 		calls getUSASingleYearTotals
 		'''
@@ -151,6 +209,9 @@ class DataSource:
 
 		except Exception as e:
 			return e
+
+		if iterate:
+			return self.iterateYears(self.getUSASingleYearTotals, startYear, endYear)
 		
 		results = []
 		yearRange = endYear - startYear + 1
@@ -162,12 +223,13 @@ class DataSource:
 		return results
 
 
-	def getUSASingleYearTotals(self, year):
+	def getUSASingleYearTotals(self, year, iterate=False):
 		'''
 		returns the totals for the whole USA and each state
 
 		PARAMETERS:
 			year: the year to gather data for
+			iterate: if True, return a generator that streams the rows instead of a list
 		'''
 		results = []
 
@@ -177,11 +239,12 @@ class DataSource:
 		except Exception as e:
 			return e
 
+		if iterate:
+			return self.iterateQuery(f"SELECT * FROM states{year} WHERE notes = 'Total'")
+
 		try:
-			cursor = self.connection.cursor()
 			query = f"SELECT * FROM states{year} WHERE notes = 'Total'"
-			cursor.execute(query)
-			results = cursor.fetchall()
+			results = self.fetchAll(query)
 
 		except Exception as e:
 			print("Something went wrong when executing the query (USATotals)" + str(e))
@@ -189,7 +252,7 @@ class DataSource:
 		return results
 
 
-	def getStateQuery(self, startYear, endYear, state):
+	def getStateQuery(self, startYear, endYear, state, iterate=False):
 		'''
 		returns a list of data for the specified state, including both general
 		data and data for each county
@@ -198,6 +261,9 @@ class DataSource:
 			startYear - the first year of data to draw from
 			endYear - the last year of data to draw from
 			state: the state to get data for
+			iterate: if True, return a generator of (year, rows) pairs whose rows
+			are streamed from the database. As with getStateSingleYearQuery, the
+			streamed rows do not include county data.
 
 		RETURN:
 			a list of data for the state, as a list of lists
@@ -212,6 +278,9 @@ class DataSource:
 		except Exception as e:
 			return e
 
+		if iterate:
+			return self.iterateYears(self.getStateSingleYearQuery, startYear, endYear, state)
+
 		results = []
 		yearDifference = endYear - startYear
 		i = 0
@@ -223,7 +292,7 @@ class DataSource:
 		return results
 
 
-	def getStateSingleYearQuery(self, year, state):
+	def getStateSingleYearQuery(self, year, state, iterate=False):
 		'''
 		returns a list of data for the specified state, including both general
 		data and data for each county, for a single year
@@ -231,6 +300,9 @@ class DataSource:
 		PARAMETERS:
 			year: the year to get data for
 			state: the state to get data for
+			iterate: if True, return a generator that streams only the state's own
+			rows (its causes followed by its Total row). Use getCountySingleYearQuery
+			with getCountyPatternForState to stream its counties.
 
 		RETURN:
 			a list of data for the state, as a list of lists.
@@ -243,13 +315,14 @@ class DataSource:
 		except Exception as e:
 			return e
 
+		if iterate:
+			return self.iterateQuery(f"SELECT * FROM states{year} WHERE statename = %s", (state,))
+
 		results = []
 
 		try:
-			cursor = self.connection.cursor()
-			query = f"SELECT * FROM states{year} WHERE statename = '{state}'"
-			cursor.execute(query)
-			results = cursor.fetchall()
+			query = f"SELECT * FROM states{year} WHERE statename = %s"
+			results = self.fetchAll(query, (state,))
 
 		except Exception as e:
 			print("Something when wrong when excecuting the query (state)")
@@ -275,7 +348,7 @@ class DataSource:
 		return f"%{self.stateDictionary.get(state)}"
 
 
-	def getCountyQuery(self,  startYear, endYear, county):
+	def getCountyQuery(self,  startYear, endYear, county, iterate=False):
 		'''
 		returns a list of data for a specific county or list of counties (using LIKE)
 
@@ -283,6 +356,8 @@ class DataSource:
 			startYear - an integer, the first year to get data for
 			endYear - an integer, the last year to get data for
 			county - the expression defining which county names may be excepted
+			iterate - if True, return a generator of (year, rows) pairs whose rows
+			are streamed from the database instead of a list of lists
 		RETURN:
 			a list of data for the county
 
@@ -297,6 +372,9 @@ class DataSource:
 		except Exception as e:
 			return None
 
+		if iterate:
+			return self.iterateYears(self.getCountySingleYearQuery, startYear, endYear, county)
+
 		yearRange = endYear - startYear + 1
 
 		try:
@@ -311,7 +389,7 @@ class DataSource:
 			return None
 
 
-	def getCountySingleYearQuery(self, year, county):
+	def getCountySingleYearQuery(self, year, county, iterate=False):
 		'''
 		returns county data for a single year for one county or a list
 		of counties (using LIKE)
@@ -319,6 +397,7 @@ class DataSource:
 		PARAMETERS:
 			year - the year to get data for
 			county -  the expression defining which county names may be excepted
+			iterate - if True, return a generator that streams the rows instead of a list
 		'''
 
 		try:
@@ -328,16 +407,210 @@ class DataSource:
 		except Exception as e:
 			return None 
 
+		if iterate:
+			return self.iterateQuery(f"SELECT * FROM counties{year} WHERE county LIKE %s", (county,))
+
 		results = []
 
+		query = f"SELECT * FROM counties{year} WHERE county LIKE %s"
+		results = self.fetchAll(query, (county,))
+
+		return results
+
+
+	def fetchAll(self, query, parameters=None):
+		'''
+		Runs a query and returns all of its rows, recording how long it took
+		with the query tracer
+
+		PARAMETERS:
+			query - the SQL to execute
+			parameters - the values for any placeholders in the query
+
+		RETURN:
+			a list of rows
+		'''
 		cursor = self.connection.cursor()
-		query = f"SELECT * FROM counties{year} WHERE county LIKE '{county}'"
-		cursor.execute(query)
-		results = cursor.fetchall()
+		startTime = time.perf_counter()
+
+		try:
+			cursor.execute(query, parameters)
+			results = cursor.fetchall()
+
+		except psycopg2.Error:
+			cursor.close()
+			self.rollBackIfFailed()
+			raise
+
+		self.tracer.record(query, parameters, len(results), time.perf_counter() - startTime)
+		cursor.close()
 
 		return results
 
 
+	def rollBackIfFailed(self):
+		'''
+		Rolls back the shared connection's transaction if a failed statement
+		aborted it. Until then, every later statement on the connection, from
+		any thread, would fail with "current transaction is aborted".
+		'''
+		if self.connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+			self.connection.rollback()
+
+
+	def streamQuery(self, query, parameters=None, itersize=DEFAULT_ITERSIZE):
+		'''
+		Runs a query on a named (server-side) cursor and yields its rows a batch
+		at a time, so the full result is never held in memory at once.
+
+		PARAMETERS:
+			query - the SQL to execute
+			parameters - the values for any placeholders in the query
+			itersize - the number of rows to fetch from the server per batch
+
+		RETURN:
+			a generator of lists of rows, each list at most itersize long
+		'''
+		cursor = self.connection.cursor(name=f"stream_{uuid.uuid4().hex}")
+		cursor.itersize = itersize
+		rowCount = 0
+		elapsed = 0.0
+
+		try:
+			startTime = time.perf_counter()
+			cursor.execute(query, parameters)
+
+			while True:
+				rows = cursor.fetchmany(itersize)
+				elapsed = elapsed + time.perf_counter() - startTime
+
+				if not rows:
+					break
+
+				rowCount = rowCount + len(rows)
+				yield rows
+				startTime = time.perf_counter()
+
+		except psycopg2.Error:
+			cursor.close()
+			self.rollBackIfFailed()
+			raise
+
+		finally:
+			cursor.close()
+			# Only time spent in the database counts, not time the caller spent between batches
+			self.tracer.record(query, parameters, rowCount, elapsed)
+
+
+	def iterateQuery(self, query, parameters=None):
+		'''
+		Yields the rows of a query one at a time, fetching them from a server-side
+		cursor self.itersize rows per round trip. This backs the iterator mode
+		of the query methods.
+
+		PARAMETERS:
+			query - the SQL to execute
+			parameters - the values for any placeholders in the query
+
+		RETURN:
+			a generator of rows
+		'''
+		for rows in self.streamQuery(query, parameters, self.itersize):
+			yield from rows
+
+
+	def iterateYears(self, singleYearQuery, startYear, endYear, *args):
+		'''
+		Yields each year in a range along with a generator of that year's rows,
+		one year at a time, so only one year's cursor is open at once.
+
+		PARAMETERS:
+			singleYearQuery - a single year query method that takes iterate=True
+			startYear - the first year of data to draw from
+			endYear - the last year of data to draw from
+			args - any arguments singleYearQuery takes after the year
+
+		RETURN:
+			a generator of (year, rows) pairs
+		'''
+		for year in range(startYear, endYear + 1):
+			yield year, singleYearQuery(year, *args, iterate=True)
+
+
+	def streamExportRows(self, level, startYear, endYear, state=None, county=None, itersize=DEFAULT_ITERSIZE):
+		'''
+		Yields the raw rows for a national, state or county slice over a year
+		range, with the year prepended to each row, a batch at a time.
+
+		PARAMETERS:
+			level - "national" for every state row, "state" for one state's rows or
+			"county" for county rows
+			startYear - the first year of data to draw from
+			endYear - the last year of data to draw from
+			state - the state to draw from; required for "state", and for "county"
+			limits the counties to that state when no county is given
+			county - the exact name of the county to draw from at the "county"
+			level, like "Cuyahoga County, OH"; every county when None
+			itersize - the number of rows to fetch from the server per batch
+
+		RETURN:
+			a generator of lists of rows
+
+		Raises TypeError or ValueError right away if the arguments are invalid,
+		before any rows are streamed.
+		'''
+		self.checkValidRange(startYear, endYear)
+
+		if level == "national":
+			table, condition, parameters = "states", "", None
+
+		elif level == "state":
+			self.checkValidState(state)
+			table, condition, parameters = "states", " WHERE statename = %s", (state,)
+
+		elif level == "county":
+			# A user's county is matched exactly, so its characters are never read as
+			# LIKE wildcards or escapes; only the app's own state pattern uses LIKE
+			if county is not None:
+				self.checkValidCounty(county)
+				table, condition, parameters = "counties", " WHERE county = %s", (county,)
+
+			elif state is not None:
+				self.checkValidState(state)
+				table, condition, parameters = "counties", " WHERE county LIKE %s", (self.getCountyPatternForState(state),)
+
+			else:
+				table, condition, parameters = "counties", "", None
+
+		else:
+			raise ValueError("Level must be national, state or county")
+
+		return self.streamYearTables(table, condition, parameters, startYear, endYear, itersize)
+
+
+	def streamYearTables(self, table, condition, parameters, startYear, endYear, itersize=DEFAULT_ITERSIZE):
+		'''
+		Yields the rows of one per-year table after another, with the year
+		prepended to each row, a batch at a time.
+
+		PARAMETERS:
+			table - the table name without its year, "states" or "counties"
+			condition - an optional WHERE clause, starting with a space
+			parameters - the values for any placeholders in condition
+			startYear - the first year's table to read
+			endYear - the last year's table to read
+			itersize - the number of rows to fetch from the server per batch
+
+		RETURN:
+			a generator of lists of rows
+		'''
+		for year in range(startYear, endYear + 1):
+			query = f"SELECT * FROM {table}{year}{condition}"
+
+			for rows in self.streamQuery(query, parameters, itersize):
+				yield [(year,) + tuple(row) for row in rows]
+
+
 	def checkValidState(self, state):
 		'''
 		Returns true if the state is a valid US State name. Throws a TypeError
@@ -371,7 +644,7 @@ class DataSource:
 			print("Year must be an integer")
 			raise TypeError("Year must be an integer")
 
-		if(year < 1999 or year > 2017):
+		if(year < FIRST_YEAR or year > LAST_YEAR):
 			print("Invalid year")
 			raise ValueError("Invalid year")
 
@@ -388,7 +661,7 @@ class DataSource:
 		if not (isinstance(startYear, int) and isinstance(endYear, int)):
 			raise TypeError("Years must be integers")
 
-		if (startYear < 1999 or endYear > 2017 or startYear > endYear):
+		if (startYear < FIRST_YEAR or endYear > LAST_YEAR or startYear > endYear):
 			raise ValueError("Invalid year range")
 
 		return True
@@ -406,7 +679,71 @@ class DataSource:
 		return True
 
 
-	def disconnect():
+	def saveAlerts(self, alerts):
+		'''
+		Replaces the contents of the alerts table, creating it if needed, in
+		one transaction so readers never see a partial run
+
+		PARAMETERS:
+			alerts - a list of dictionaries with the keys in ALERT_COLUMNS
+		'''
+		cursor = self.connection.cursor()
+
+		try:
+			cursor.execute(ALERTS_TABLE_SQL)
+			cursor.execute("DELETE FROM alerts")
+			cursor.executemany("INSERT INTO alerts VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+				[[alert[column] for column in ALERT_COLUMNS] for alert in alerts])
+			self.connection.commit()
+
+		except Exception:
+			self.connection.rollback()
+			raise
+
+		finally:
+			cursor.close()
+
+
+	def getAlerts(self, level=None, name=None, state=None, year=None, kind=None, limit=50):
+		'''
+		Returns the stored alerts that match every filter given, strongest first
+
+		PARAMETERS:
+			level - "state" or "county"
+			name - the canonical state or county name
+			state - the state the place is in (for a state, the state itself)
+			year - the year of the jump or change
+			kind - "yearOverYear" or "changePoint"
+			limit - the most alerts to return, from 0 to MAX_ALERTS
+
+		RETURN:
+			a list of rows in ALERT_COLUMNS order, or an empty list if the alerts
+			job has never run
+
+		Raises ValueError if limit is out of range.
+		'''
+		if not 0 <= limit <= MAX_ALERTS:
+			raise ValueError(f"The limit must be between 0 and {MAX_ALERTS}")
+
+		# Check first, since a failed query would abort the shared transaction
+		if self.fetchAll("SELECT to_regclass('alerts')")[0][0] is None:
+			return []
+
+		conditions = []
+		parameters = []
+
+		for column, value in (("level", level), ("name", name), ("state", state), ("year", year), ("kind", kind)):
+			if value is not None:
+				conditions.append(f"{column} = %s")
+				parameters.append(value)
+
+		where = " WHERE " + " AND ".join(conditions) if conditions else ""
+		query = f"SELECT * FROM alerts{where} ORDER BY abs(score) DESC, name, year LIMIT %s"
+
+		return self.fetchAll(query, parameters + [limit])
+
+
+	def disconnect(self):
 		self.connection.close()
 
 
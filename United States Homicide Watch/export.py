@@ -0,0 +1,222 @@
+'''
+export.py turns streams of database rows into downloadable CSV or Parquet
+files. Every function here works on generators and hands back chunks of
+bytes as soon as they are ready, so an export of any size uses about the
+same amount of memory as an export of a single batch.
+'''
+
+import csv
+import io
+import zlib
+
+try:
+	import pyarrow
+	import pyarrow.parquet
+
+except ImportError:
+	pyarrow = None
+
+# Uncompressed CSV bytes gathered before a chunk is handed to the response
+CSV_CHUNK_SIZE = 64 * 1024
+
+STATE_COLUMNS = ["year", "notes", "statename", "statecode", "causeofdeath",
+	"causeofdeathcode", "deaths", "totalpopulation", "cruderate"]
+
+COUNTY_COLUMNS = ["year", "notes", "county", "countycode", "causeofdeath",
+	"causeofdeathcode", "deaths", "totalpopulation", "cruderate"]
+
+EXPORT_FORMATS = {
+	"csv": "text/csv",
+	"parquet": "application/vnd.apache.parquet"
+}
+
+
+def getExportColumns(level):
+	'''
+	Returns the column names of an export at the given level ("national",
+	"state" or "county")
+	'''
+	if level == "county":
+		return COUNTY_COLUMNS
+
+	return STATE_COLUMNS
+
+
+def checkValidFormat(exportFormat):
+	'''
+	Returns true if the export format is supported. Raises ValueError if the
+	format is unknown and RuntimeError if it needs a library that is not installed.
+	'''
+	if exportFormat not in EXPORT_FORMATS:
+		raise ValueError("Format must be csv or parquet")
+
+	if exportFormat == "parquet" and pyarrow is None:
+		raise RuntimeError("Parquet export requires pyarrow to be installed")
+
+	return True
+
+
+def generateCSV(columns, batches):
+	'''
+	Yields a CSV file as chunks of UTF-8 bytes, starting with a header row
+
+	PARAMETERS:
+		columns - the column names for the header
+		batches - a generator of lists of rows
+
+	RETURN:
+		a generator of byte strings of roughly CSV_CHUNK_SIZE each
+	'''
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	writer.writerow(columns)
+
+	for rows in batches:
+		writer.writerows(rows)
+
+		if buffer.tell() >= CSV_CHUNK_SIZE:
+			yield buffer.getvalue().encode("utf-8")
+			buffer.seek(0)
+			buffer.truncate()
+
+	if buffer.tell() > 0:
+		yield buffer.getvalue().encode("utf-8")
+
+
+def gzipChunks(chunks):
+	'''
+	Compresses a stream of byte chunks into a single gzip stream without
+	holding more than one chunk at a time
+
+	PARAMETERS:
+		chunks - a generator of byte strings
+
+	RETURN:
+		a generator of gzip-compressed byte strings
+	'''
+	compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+	for chunk in chunks:
+		compressed = compressor.compress(chunk)
+
+		if compressed:
+			yield compressed
+
+	yield compressor.flush()
+
+
+class _ChunkSink:
+	'''
+	A write-only file that keeps what has been written to it until it is
+	drained, so ParquetWriter output can be streamed a row group at a time.
+	'''
+
+	def __init__(self):
+		self.chunks = []
+		self.position = 0
+		self.closed = False
+
+
+	def write(self, data):
+		data = bytes(data)
+		self.chunks.append(data)
+		self.position = self.position + len(data)
+
+		return len(data)
+
+
+	def tell(self):
+		return self.position
+
+
+	def flush(self):
+		pass
+
+
+	def close(self):
+		self.closed = True
+
+
+	def drain(self):
+		'''
+		Returns everything written since the last drain and forgets it
+		'''
+		data = b"".join(self.chunks)
+		self.chunks = []
+
+		return data
+
+
+def getParquetSchema(columns):
+	'''
+	Returns the pyarrow schema for an export with the given columns. Text
+	columns are strings, the year is an integer and every other column is
+	a float, matching the REAL columns in createtable.sql.
+	'''
+	textColumns = ["notes", "statename", "county", "causeofdeath", "causeofdeathcode"]
+	fields = []
+
+	for column in columns:
+		if column == "year":
+			fields.append(pyarrow.field(column, pyarrow.int16()))
+
+		elif column in textColumns:
+			fields.append(pyarrow.field(column, pyarrow.string()))
+
+		else:
+			fields.append(pyarrow.field(column, pyarrow.float64()))
+
+	return pyarrow.schema(fields)
+
+
+def generateParquet(columns, batches):
+	'''
+	Yields a zstd-compressed Parquet file as chunks of bytes, writing one row
+	group per batch of rows
+
+	PARAMETERS:
+		columns - the column names
+		batches - a generator of lists of rows
+
+	RETURN:
+		a generator of byte strings
+	'''
+	schema = getParquetSchema(columns)
+	sink = _ChunkSink()
+	writer = pyarrow.parquet.ParquetWriter(sink, schema, compression="zstd")
+
+	try:
+		for rows in batches:
+			table = pyarrow.Table.from_pylist([dict(zip(columns, row)) for row in rows], schema=schema)
+			writer.write_table(table)
+			yield sink.drain()
+
+	finally:
+		writer.close()
+
+	yield sink.drain()
+
+
+def generateExport(exportFormat, columns, batches, compress):
+	'''
+	Returns a generator of the bytes of an export in the requested format
+
+	PARAMETERS:
+		exportFormat - "csv" or "parquet"
+		columns - the column names
+		batches - a generator of lists of rows
+		compress - whether to gzip a CSV export. Parquet is always compressed
+		internally, so this has no effect on it.
+
+	RETURN:
+		a generator of byte strings
+	'''
+	if exportFormat == "parquet":
+		return generateParquet(columns, batches)
+
+	chunks = generateCSV(columns, batches)
+
+	if compress:
+		return gzipChunks(chunks)
+
+	return chunks
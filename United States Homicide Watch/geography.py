@@ -0,0 +1,284 @@
+'''
+geography.py defines groups of places larger than a county or state: the
+Census Bureau's regions and divisions, and custom groups of counties such as
+metro areas, listed by FIPS code in a JSON file. Every group's deaths,
+population and deaths by cause in every year are rolled up once when the
+registry is built, so a group's page costs no more than a state's.
+
+The custom groups file maps each group's name to its counties' FIPS codes:
+
+	{"Cleveland Metro": ["39035", "39093"]}
+
+CDC suppresses counties with too few deaths, so a group should only list
+counties the data has; any others are logged when the registry is built and
+left out. County groups only count the years CDC reported for each county.
+A cause is only shown on its own for a group when every member reported it
+in every year of the range; the rest of the group's deaths are "Other", as
+on the state page.
+'''
+
+import json
+import logging
+
+from datasource import FIRST_YEAR, LAST_YEAR
+from nameindex import normalizeName
+
+logger = logging.getLogger("homicidewatch.geography")
+
+CENSUS_DIVISIONS = {
+	"New England": ["Connecticut", "Maine", "Massachusetts", "New Hampshire", "Rhode Island", "Vermont"],
+	"Middle Atlantic": ["New Jersey", "New York", "Pennsylvania"],
+	"East North Central": ["Illinois", "Indiana", "Michigan", "Ohio", "Wisconsin"],
+	"West North Central": ["Iowa", "Kansas", "Minnesota", "Missouri", "Nebraska", "North Dakota", "South Dakota"],
+	"South Atlantic": ["Delaware", "District of Columbia", "Florida", "Georgia", "Maryland", "North Carolina",
+		"South Carolina", "Virginia", "West Virginia"],
+	"East South Central": ["Alabama", "Kentucky", "Mississippi", "Tennessee"],
+	"West South Central": ["Arkansas", "Louisiana", "Oklahoma", "Texas"],
+	"Mountain": ["Arizona", "Colorado", "Idaho", "Montana", "Nevada", "New Mexico", "Utah", "Wyoming"],
+	"Pacific": ["Alaska", "California", "Hawaii", "Oregon", "Washington"]
+}
+
+# Each Census region is made of two or three divisions
+CENSUS_REGIONS = {
+	"Northeast": ["New England", "Middle Atlantic"],
+	"Midwest": ["East North Central", "West North Central"],
+	"South": ["South Atlantic", "East South Central", "West South Central"],
+	"West": ["Mountain", "Pacific"]
+}
+
+
+def getGroupNames(customGroups=None):
+	'''
+	Returns every group's registered name keyed by its normalized name, so
+	names can be resolved without rolling any group up
+
+	PARAMETERS:
+		customGroups - a dictionary from group name to county FIPS codes
+
+	Raises ValueError if two groups' names are the same ignoring case and
+	punctuation, such as a custom group named like a region.
+	'''
+	namesByKey = {}
+
+	for name in list(CENSUS_REGIONS) + list(CENSUS_DIVISIONS) + list(customGroups or {}):
+		key = normalizeName(name)
+
+		if key in namesByKey:
+			raise ValueError(f"The group name {name} is already used by {namesByKey[key]}")
+
+		namesByKey[key] = name
+
+	return namesByKey
+
+
+def loadCustomGroups(path):
+	'''
+	Returns the county groups in a JSON file as a dictionary from group name
+	to a list of FIPS codes, or an empty dictionary if there is no file
+
+	Raises ValueError if the file is not a JSON object of lists of five-digit
+	codes, or if a group's name is already used by a region, a division or
+	another group.
+	'''
+	try:
+		with open(path) as groupsFile:
+			groups = json.load(groupsFile)
+
+	except FileNotFoundError:
+		return {}
+
+	if not isinstance(groups, dict) or not all(isinstance(codes, list) for codes in groups.values()):
+		raise ValueError(f"{path} must map each group name to a list of county FIPS codes")
+
+	for name, codes in groups.items():
+		for code in codes:
+			if not (isinstance(code, str) and len(code) == 5 and code.isdigit()):
+				raise ValueError(f"{path}: {code!r} in {name} is not a five-digit county FIPS code")
+
+	getGroupNames(groups)
+
+	return {name: [int(code) for code in codes] for name, codes in groups.items()}
+
+
+class GeographyRegistry:
+	'''
+	GeographyRegistry holds every group's members and its precomputed yearly
+	rollups. A rollup maps each year to a dictionary with the group's
+	"deaths", "population", "causes", a dictionary of deaths by cause, and
+	"reporters", a dictionary from each cause to the number of members that
+	reported it that year.
+	'''
+
+	def __init__(self):
+		self.groups = {}
+		self.rollups = {}
+		self.namesByKey = {}
+
+
+	@classmethod
+	def build(cls, cube, countyPanel, customGroups=None):
+		'''
+		Returns a registry with every group rolled up
+
+		PARAMETERS:
+			cube - the HomicideCube to roll regions and divisions up from
+			countyPanel - the CountyPanel to roll county groups up from
+			customGroups - a dictionary from group name to county FIPS codes
+		'''
+		registry = cls()
+
+		for region, divisions in CENSUS_REGIONS.items():
+			states = [state for division in divisions for state in CENSUS_DIVISIONS[division]]
+			registry.addStateGroup(cube, region, "region", states)
+
+		for division, states in CENSUS_DIVISIONS.items():
+			registry.addStateGroup(cube, division, "division", states)
+
+		for name, fipsCodes in (customGroups or {}).items():
+			registry.addCountyGroup(countyPanel, name, fipsCodes)
+
+		return registry
+
+
+	def addGroup(self, name, kind, members, rollup):
+		'''
+		Registers a group and its rollup under its name
+
+		Raises ValueError if the name is already used, ignoring case and punctuation.
+		'''
+		key = normalizeName(name)
+
+		if key in self.namesByKey:
+			raise ValueError(f"The group name {name} is already used by {self.namesByKey[key]}")
+
+		self.groups[name] = {"name": name, "kind": kind, "members": members}
+		self.rollups[name] = rollup
+		self.namesByKey[key] = name
+
+
+	def addStateGroup(self, cube, name, kind, states):
+		'''
+		Rolls a group of states up from the cube's state facts
+		'''
+		filters = {"state": states, "year": (FIRST_YEAR, LAST_YEAR)}
+		rollup = {}
+
+		for result in cube.query(["year"], filters, ["deaths", "population"]):
+			rollup[result["year"]] = {"deaths": result["deaths"], "population": result["population"],
+				"causes": {}, "reporters": {}}
+
+		for result in cube.query(["year", "state", "cause"], filters, ["deaths"]):
+			totals = rollup.get(result["year"])
+
+			if totals is not None:
+				cause = result["cause"]
+				totals["causes"][cause] = totals["causes"].get(cause, 0) + result["deaths"]
+				totals["reporters"][cause] = totals["reporters"].get(cause, 0) + 1
+
+		self.addGroup(name, kind, states, rollup)
+
+
+	def addCountyGroup(self, countyPanel, name, fipsCodes):
+		'''
+		Rolls a group of counties up from the county panel. Counties the panel
+		has no data for are logged and listed in the group's "unreported" codes.
+		'''
+		members = []
+		unreported = []
+		rollup = {}
+
+		for fips in fipsCodes:
+			if fips not in countyPanel.rowOfFips:
+				unreported.append(f"{fips:05d}")
+				continue
+
+			history = countyPanel.getHistory(fips)
+			members.append(history["county"])
+
+			for year in history["years"]:
+				if not year["reported"]:
+					continue
+
+				totals = rollup.setdefault(year["year"], {"deaths": 0, "population": 0, "causes": {}, "reporters": {}})
+				totals["deaths"] += year["deaths"]
+				totals["population"] += year["population"]
+
+				for cause, deaths in year["causes"].items():
+					totals["causes"][cause] = totals["causes"].get(cause, 0) + deaths
+					totals["reporters"][cause] = totals["reporters"].get(cause, 0) + 1
+
+		if unreported:
+			logger.warning("No county data for %s in %s; they are left out of it", ", ".join(unreported), name)
+
+		self.addGroup(name, "counties", members, rollup)
+		self.groups[name]["unreported"] = unreported
+
+
+	def resolve(self, name):
+		'''
+		Returns the registered name of a group, ignoring case and punctuation, or
+		None if there is no such group
+		'''
+		return self.namesByKey.get(normalizeName(name or ""))
+
+
+	def getGroups(self):
+		'''
+		Returns every group's name, kind and members, regions first. County
+		groups also list the "unreported" FIPS codes left out of them.
+		'''
+		return list(self.groups.values())
+
+
+	def getYearlyTotals(self, name):
+		'''
+		Returns a group's (deaths, population) in each year it has data for, in
+		the form TrendPanel's PlaceTrend takes
+		'''
+		return {year: (totals["deaths"], totals["population"]) for year, totals in self.rollups[name].items()}
+
+
+	def getSummary(self, name, startYear, endYear):
+		'''
+		Returns a group's totals over a year range in the form summarizeStateYears
+		returns a state's, so the state page's functions can present a group
+
+		PARAMETERS:
+			name - the group's registered name
+			startYear - the first year to include
+			endYear - the last year to include
+
+		RETURN:
+			a dictionary with "numYears", "deaths", "population", "causeOrder" (most
+			deaths first), "causeDeaths", "validCauses" (the causes every member
+			reported in every year) and "singleYearCrudeRates"
+		'''
+		rollup = self.rollups[name]
+		memberCount = len(self.groups[name]["members"])
+		summary = {"numYears": 0, "deaths": 0, "population": 0, "causeOrder": [],
+			"causeDeaths": {}, "validCauses": None, "singleYearCrudeRates": []}
+
+		for year in range(startYear, endYear + 1):
+			totals = rollup.get(year, {"deaths": 0, "population": 0, "causes": {}, "reporters": {}})
+			causes = totals["causes"]
+			completeCauses = {cause for cause, reporters in totals["reporters"].items() if reporters == memberCount}
+
+			summary["numYears"] = summary["numYears"] + 1
+			summary["deaths"] += totals["deaths"]
+			summary["population"] += totals["population"]
+
+			if summary["validCauses"] is None:
+				summary["validCauses"] = completeCauses
+
+			else:
+				summary["validCauses"] &= completeCauses
+
+			for cause in causes:
+				summary["causeDeaths"][cause] = summary["causeDeaths"].get(cause, 0) + causes[cause]
+
+			rate = round(totals["deaths"] * 100000 / totals["population"], 3) if totals["population"] else 0
+			summary["singleYearCrudeRates"].append(rate)
+
+		summary["causeOrder"] = sorted(summary["causeDeaths"], key=lambda cause: -summary["causeDeaths"][cause])
+
+		return summary
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+'''
+loadtest.py measures how the web app holds up under concurrent traffic. It
+starts the app under gunicorn with a given number of workers and threads,
+replays a mix of national, state and out-of-range requests at increasing
+levels of concurrency, and reports throughput, latency percentiles and the
+error rate for each level. The server is restarted for each level, so every
+level starts from an empty result cache.
+
+The app connects to the database named by --database with the rest of the
+usual HOMICIDE_DB_* settings (see config.py). It must be a throwaway
+database: --load-data drops and recreates its tables and fills them from the
+CSV files in Data/, so the app's default database is refused.
+
+Usage:
+	python3 loadtest.py --database NAME [--workers 4] [--threads 2]
+		[--concurrency 1,4,16,32] [--requests 200] [--load-data]
+'''
+
+import argparse
+import csv
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from config import DEFAULT_DB_NAME, loadConfig, getConnectionParameters
+from datasource import FIRST_YEAR, LAST_YEAR, STATE_DICTIONARY
+
+APP_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# The share of each kind of request in the replayed mix
+REQUEST_MIX = {"national": 0.3, "state": 0.6, "outOfRange": 0.1}
+
+
+def loadData(connection):
+	'''
+	Drops and recreates the per-year tables from createtable.sql and fills
+	them from the CSV exports in Data/. Empty fields are stored as NULL, as
+	COPY would.
+
+	PARAMETERS:
+		connection - a connection to the database to load
+	'''
+	cursor = connection.cursor()
+
+	with open(os.path.join(APP_DIRECTORY, "createtable.sql")) as tableFile:
+		cursor.execute(tableFile.read())
+
+	for table, fileName in (("states", "HomicideUCODState"), ("counties", "HomicideUCODCounty")):
+		for year in range(FIRST_YEAR, LAST_YEAR + 1):
+			path = os.path.join(APP_DIRECTORY, "Data", f"{fileName}{year}.csv")
+
+			with open(path, newline="") as dataFile:
+				rows = list(csv.reader(dataFile))[1:]
+
+			# Skip the footnotes CDC WONDER appends after the data
+			rows = [[value if value != "" else None for value in row] for row in rows if len(row) == 8]
+			cursor.executemany(f"INSERT INTO {table}{year} VALUES (%s, %s, %s, %s, %s, %s, %s, %s)", rows)
+
+	connection.commit()
+
+
+def buildRequestMix(count, seed=0):
+	'''
+	Returns a shuffled list of request paths following REQUEST_MIX
+
+	PARAMETERS:
+		count - the number of paths to build
+		seed - the random seed, so runs can be repeated
+
+	RETURN:
+		a list of URL paths with query strings
+	'''
+	generator = random.Random(seed)
+	states = list(STATE_DICTIONARY)
+	kinds = generator.choices(list(REQUEST_MIX), weights=list(REQUEST_MIX.values()), k=count)
+	paths = []
+
+	for kind in kinds:
+		startYear = generator.randint(FIRST_YEAR, LAST_YEAR)
+		endYear = generator.randint(startYear, LAST_YEAR)
+
+		if kind == "national":
+			paths.append(f"/?startYear={startYear}&endYear={endYear}")
+
+		elif kind == "state":
+			state = urllib.parse.quote(generator.choice(states))
+			paths.append(f"/stateQuery/?state={state}&startYear={startYear}&endYear={endYear}")
+
+		else:
+			paths.append(f"/stateQuery/?state=Ohio&startYear={FIRST_YEAR - 5}&endYear={LAST_YEAR + 5}")
+
+	return paths
+
+
+def getEnvironment(database):
+	'''
+	Returns the environment to run the app in: this one, with the database
+	name replaced and cache warming off
+	'''
+	return dict(os.environ, HOMICIDE_DB_NAME=database, HOMICIDE_WARM_CACHE="0")
+
+
+def startServer(host, port, workers, threads, database):
+	'''
+	Starts the app under gunicorn and waits until it accepts connections
+
+	PARAMETERS:
+		host - the address to bind
+		port - the port to bind
+		workers - the number of gunicorn worker processes
+		threads - the number of threads per worker
+		database - the name of the database the app reads
+
+	RETURN:
+		the gunicorn process
+	'''
+	command = [sys.executable, "-m", "gunicorn", "--preload",
+		"--workers", str(workers), "--threads", str(threads),
+		"--bind", f"{host}:{port}", "--log-level", "warning", "webapp:createApp()"]
+	server = subprocess.Popen(command, cwd=APP_DIRECTORY, env=getEnvironment(database))
+
+	deadline = time.monotonic() + 30
+
+	while time.monotonic() < deadline:
+		if server.poll() is not None:
+			raise RuntimeError("gunicorn exited before it started serving")
+
+		try:
+			socket.create_connection((host, port), timeout=1).close()
+			return server
+
+		except OSError:
+			time.sleep(0.2)
+
+	server.terminate()
+	raise RuntimeError("gunicorn did not start within 30 seconds")
+
+
+def timeRequest(url, timeout):
+	'''
+	Fetches url and returns how long it took in seconds and whether it failed.
+	A request fails if it raises or the server answers with a 5xx status; the
+	error page the app renders for bad input is a normal response.
+	'''
+	startTime = time.perf_counter()
+
+	try:
+		with urllib.request.urlopen(url, timeout=timeout) as response:
+			response.read()
+			failed = response.status >= 500
+
+	except urllib.error.HTTPError as e:
+		failed = e.code >= 500
+
+	except Exception:
+		failed = True
+
+	return time.perf_counter() - startTime, failed
+
+
+def getPercentile(sortedValues, percent):
+	'''
+	Returns the value below which the given percent of sortedValues fall,
+	using the nearest-rank method
+	'''
+	if not sortedValues:
+		return 0
+
+	rank = max(int(round(percent / 100 * len(sortedValues))) - 1, 0)
+
+	return sortedValues[min(rank, len(sortedValues) - 1)]
+
+
+def runLoad(baseUrl, paths, concurrency, timeout=60):
+	'''
+	Replays paths against the server from concurrency threads at once
+
+	PARAMETERS:
+		baseUrl - the server's address, like http://127.0.0.1:8000
+		paths - the request paths to replay
+		concurrency - the number of requests in flight at once
+		timeout - seconds before a single request counts as failed
+
+	RETURN:
+		a dictionary with the "concurrency", number of "requests", "throughput"
+		in requests per second, "p50", "p90" and "p99" latencies in milliseconds
+		and the "errorRate" as a fraction
+	'''
+	startTime = time.perf_counter()
+
+	with ThreadPoolExecutor(max_workers=concurrency) as executor:
+		results = list(executor.map(lambda path: timeRequest(baseUrl + path, timeout), paths))
+
+	elapsed = time.perf_counter() - startTime
+	latencies = sorted(latency * 1000 for latency, failed in results)
+	failures = sum(1 for latency, failed in results if failed)
+
+	return {
+		"concurrency": concurrency,
+		"requests": len(results),
+		"throughput": round(len(results) / elapsed, 1),
+		"p50": round(getPercentile(latencies, 50), 1),
+		"p90": round(getPercentile(latencies, 90), 1),
+		"p99": round(getPercentile(latencies, 99), 1),
+		"errorRate": round(failures / len(results), 4)
+	}
+
+
+def printReport(workers, threads, reports):
+	'''
+	Prints one line per concurrency level
+	'''
+	print(f"\ngunicorn: {workers} workers x {threads} threads")
+	print(f"{'concurrency':>12}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'errors':>9}")
+
+	for report in reports:
+		print(f"{report['concurrency']:>12}{report['requests']:>10}{report['throughput']:>10}"
+			f"{report['p50']:>10}{report['p90']:>10}{report['p99']:>10}{report['errorRate']:>9.2%}")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Load test the web app under gunicorn")
+	parser.add_argument("--database", required=True,
+		help="the throwaway database to test against; not the app's default")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8765)
+	parser.add_argument("--workers", type=int, default=4)
+	parser.add_argument("--threads", type=int, default=2)
+	parser.add_argument("--concurrency", default="1,4,16,32",
+		help="comma separated concurrency levels to test")
+	parser.add_argument("--requests", type=int, default=200,
+		help="requests replayed at each concurrency level")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--load-data", action="store_true",
+		help="drop, recreate and fill the tables in --database first")
+	arguments = parser.parse_args()
+
+	if arguments.database == DEFAULT_DB_NAME:
+		parser.error(f"--database must name a throwaway database, not the app's default {DEFAULT_DB_NAME}")
+
+	if arguments.load_data:
+		config = loadConfig(getEnvironment(arguments.database))
+		connection = psycopg2.connect(**getConnectionParameters(config))
+		loadData(connection)
+		connection.close()
+
+	baseUrl = f"http://{arguments.host}:{arguments.port}"
+	reports = []
+
+	for level, concurrency in enumerate(arguments.concurrency.split(",")):
+		paths = buildRequestMix(arguments.requests, arguments.seed + level)
+		server = startServer(arguments.host, arguments.port, arguments.workers, arguments.threads, arguments.database)
+
+		try:
+			reports.append(runLoad(baseUrl, paths, int(concurrency)))
+
+		finally:
+			server.terminate()
+			server.wait()
+
+	printReport(arguments.workers, arguments.threads, reports)
+
+
+if __name__ == '__main__':
+	main()
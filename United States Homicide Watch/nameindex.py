@@ -0,0 +1,260 @@
+'''
+nameindex.py resolves the names people type into the canonical state and
+county names the tables use. Every state name, USPS code and county name is
+normalized (lowercased, punctuation dropped) and stored in a trie, so exact
+lookups and prefix suggestions cost one walk down the trie, and each node
+keeps its best suggestions precomputed. Input that matches nothing is
+matched against the trie within a small edit distance, counting swapped
+neighbouring letters as one edit, so typos like "Pennsilvania" and "Ohoi"
+still resolve.
+'''
+
+import re
+
+from datasource import STATE_DICTIONARY
+from cube import getStateOfCounty
+
+# Suggestions kept at each trie node for each level, the most autocomplete can return
+SUGGESTION_LIMIT = 10
+
+# The kinds of place an entry can be; None stands for either
+LEVELS = [None, "state", "county"]
+
+NON_ALPHANUMERIC_PATTERN = re.compile(r"[^a-z0-9]+")
+
+# The words that end county names, which people often leave out
+COUNTY_SUFFIX_PATTERN = re.compile(r" (County|Parish|Borough|Census Area|Municipality|city)$")
+
+
+def normalizeName(text):
+	'''
+	Returns text lowercased with runs of punctuation and whitespace replaced by
+	single spaces, like "St. Louis city, MO" -> "st louis city mo"
+	'''
+	return NON_ALPHANUMERIC_PATTERN.sub(" ", text.lower()).strip()
+
+
+def getMaximumDistance(text):
+	'''
+	Returns how many typos are tolerated in normalized text: none in codes and
+	other very short input, one in short names and two in longer ones
+	'''
+	if len(text) <= 3:
+		return 0
+
+	if len(text) <= 6:
+		return 1
+
+	return 2
+
+
+def getSortKey(entry):
+	'''
+	Orders entries with states before counties, then alphabetically
+	'''
+	level, name = entry
+
+	return (level != "state", name)
+
+
+class _TrieNode:
+	'''
+	One node of the trie: the entries whose aliases end here and, for each
+	level in LEVELS, the best entries of that level whose aliases start with
+	the node's prefix.
+	'''
+
+	def __init__(self):
+		self.children = {}
+		self.entries = set()
+		self.suggestions = {}
+
+
+class NameIndex:
+	'''
+	NameIndex maps aliases to entries, where an entry is a ("state", name) or
+	("county", name) tuple of a canonical name. A county is reachable by its
+	full name ("Cuyahoga County, OH"), with its state spelled out ("Cuyahoga
+	County, Ohio") and by its own name alone, with or without its suffix
+	("Cuyahoga County", "Cuyahoga"), which may match several counties, or
+	with the state's code ("Cuyahoga OH").
+	'''
+
+	def __init__(self):
+		self.root = _TrieNode()
+
+
+	@classmethod
+	def build(cls, counties=()):
+		'''
+		Returns an index of every state and the given counties
+
+		PARAMETERS:
+			counties - county names like "Cuyahoga County, OH"
+		'''
+		index = cls()
+
+		for state, code in STATE_DICTIONARY.items():
+			index.add(state, ("state", state))
+			index.add(code, ("state", state))
+
+		for county in counties:
+			state = getStateOfCounty(county)
+			countyName, code = county.rsplit(", ", 1) if ", " in county else (county, "")
+			shortName = COUNTY_SUFFIX_PATTERN.sub("", countyName)
+
+			index.add(county, ("county", county))
+			index.add(countyName, ("county", county))
+			index.add(shortName, ("county", county))
+			index.add(f"{shortName} {code}", ("county", county))
+
+			if state is not None:
+				index.add(f"{countyName} {state}", ("county", county))
+				index.add(f"{shortName} {state}", ("county", county))
+
+		index.computeSuggestions(index.root)
+
+		return index
+
+
+	def add(self, alias, entry):
+		'''
+		Adds an alias for an entry. computeSuggestions must be run after the
+		last alias is added.
+		'''
+		node = self.root
+
+		for character in normalizeName(alias):
+			node = node.children.setdefault(character, _TrieNode())
+
+		node.entries.add(entry)
+
+
+	def computeSuggestions(self, node):
+		'''
+		Fills in the suggestions of node and every node below it, returning
+		node's suggestions. Each level keeps its own list, so a level with many
+		entries under a prefix cannot crowd the other out.
+		'''
+		candidates = {level: {entry for entry in node.entries if level is None or entry[0] == level} for level in LEVELS}
+
+		for child in node.children.values():
+			childSuggestions = self.computeSuggestions(child)
+
+			for level in LEVELS:
+				candidates[level].update(childSuggestions[level])
+
+		node.suggestions = {level: sorted(candidates[level], key=getSortKey)[:SUGGESTION_LIMIT] for level in LEVELS}
+
+		return node.suggestions
+
+
+	def findNode(self, text):
+		'''
+		Returns the node for normalized text, or None if no alias starts with it
+		'''
+		node = self.root
+
+		for character in text:
+			node = node.children.get(character)
+
+			if node is None:
+				return None
+
+		return node
+
+
+	def suggest(self, prefix, level=None, limit=SUGGESTION_LIMIT):
+		'''
+		Returns the entries with an alias that starts with prefix
+
+		PARAMETERS:
+			prefix - the text typed so far
+			level - "state" or "county" to only suggest one kind of place
+			limit - the most entries to return, at most SUGGESTION_LIMIT
+
+		RETURN:
+			a list of entries, states first and then alphabetically
+
+		Raises ValueError for an unknown level or a negative limit.
+		'''
+		if level not in LEVELS:
+			raise ValueError(f"Unknown level: {level}")
+
+		if limit < 0:
+			raise ValueError("The limit must not be negative")
+
+		node = self.findNode(normalizeName(prefix))
+
+		if node is None:
+			return []
+
+		return node.suggestions[level][:limit]
+
+
+	def resolve(self, text, level=None):
+		'''
+		Returns the one entry text names, allowing a few typos when nothing
+		matches exactly
+
+		PARAMETERS:
+			text - the name as the user typed it
+			level - "state" or "county" to only accept one kind of place
+
+		RETURN:
+			the entry, or None if text matches no entry or several equally well
+		'''
+		text = normalizeName(text)
+		node = self.findNode(text)
+		matches = set()
+
+		if node is not None:
+			matches = {entry for entry in node.entries if level is None or entry[0] == level}
+
+		if not matches:
+			matches = self.findClosest(text, getMaximumDistance(text), level)
+
+		if len(matches) != 1:
+			return None
+
+		return matches.pop()
+
+
+	def findClosest(self, text, maximumDistance, level=None):
+		'''
+		Returns the entries whose aliases are the fewest edits from text, if that
+		is no more than maximumDistance. An edit is inserting, deleting or
+		changing a letter or swapping two neighbouring ones. Each trie node
+		extends its parent's row of the edit distance table, and a branch is
+		abandoned as soon as every value in its row is past the best distance.
+		'''
+		best = {"distance": maximumDistance, "entries": set()}
+		firstRow = list(range(len(text) + 1))
+
+		def search(node, previousRow, secondPreviousRow, previousCharacter):
+			for character, child in node.children.items():
+				row = [previousRow[0] + 1]
+
+				for column in range(1, len(text) + 1):
+					cost = 0 if text[column - 1] == character else 1
+					row.append(min(row[column - 1] + 1, previousRow[column] + 1, previousRow[column - 1] + cost))
+
+					if (column > 1 and secondPreviousRow is not None and text[column - 1] == previousCharacter
+							and text[column - 2] == character):
+						row[column] = min(row[column], secondPreviousRow[column - 2] + 1)
+
+				entries = {entry for entry in child.entries if level is None or entry[0] == level}
+
+				if entries and row[-1] < best["distance"]:
+					best["distance"], best["entries"] = row[-1], set(entries)
+
+				elif entries and row[-1] == best["distance"]:
+					best["entries"].update(entries)
+
+				if min(row) <= best["distance"]:
+					search(child, row, previousRow, character)
+
+		if maximumDistance > 0:
+			search(self.root, firstRow, None, None)
+
+		return best["entries"]
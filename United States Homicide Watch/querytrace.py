@@ -0,0 +1,126 @@
+'''
+querytrace.py times the statements DataSource runs. Statements slower than
+a threshold are logged with their parameters and row counts and kept in a
+small ring buffer, and a sample of them can have their plans captured with
+EXPLAIN (ANALYZE, BUFFERS) so the next hot query can be found without an
+external profiler.
+'''
+
+import collections
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger("homicidewatch.queries")
+
+
+class QueryTracer:
+	'''
+	QueryTracer collects timings for one process's statements. It is
+	thread-safe, since one DataSource is shared by all of a worker's threads.
+	'''
+
+	def __init__(self, slowSeconds=0.2, explainSampleRate=0.0, bufferSize=100, connect=None):
+		'''
+		PARAMETERS:
+			slowSeconds - statements that take at least this long are logged and buffered
+			explainSampleRate - the fraction of slow statements, from 0 to 1, whose
+			plans are captured with EXPLAIN (ANALYZE, BUFFERS). This re-runs the
+			statement, so keep it low in production.
+			bufferSize - the number of slow statements kept for the admin page
+			connect - a function that opens a new database connection, used for
+			the EXPLAINs so they never touch the connection the app's queries
+			share; no plans are captured without it
+		'''
+		self.slowSeconds = slowSeconds
+		self.explainSampleRate = explainSampleRate if connect is not None else 0.0
+		self.connect = connect
+		self.explainConnection = None
+		self.explainLock = threading.Lock()
+		self.lock = threading.Lock()
+		self.slowQueries = collections.deque(maxlen=bufferSize)
+		self.statementCount = 0
+		self.slowCount = 0
+		self.totalSeconds = 0.0
+
+
+	def record(self, query, parameters, rowCount, seconds):
+		'''
+		Records one statement's timing, logging and buffering it if it was slow
+
+		PARAMETERS:
+			query - the SQL that was run
+			parameters - the values bound to the query's placeholders
+			rowCount - the number of rows the statement returned
+			seconds - how long the statement took, including fetching its rows
+		'''
+		with self.lock:
+			self.statementCount = self.statementCount + 1
+			self.totalSeconds = self.totalSeconds + seconds
+
+			if seconds < self.slowSeconds:
+				return
+
+			self.slowCount = self.slowCount + 1
+
+		logger.warning("Slow query (%.1f ms, %d rows): %s %s", seconds * 1000, rowCount, query, parameters)
+
+		plan = None
+		if random.random() < self.explainSampleRate:
+			plan = self.explain(query, parameters)
+
+		entry = {
+			"time": time.time(),
+			"query": query,
+			"parameters": list(parameters) if parameters is not None else None,
+			"rows": rowCount,
+			"milliseconds": round(seconds * 1000, 3),
+			"plan": plan
+		}
+
+		with self.lock:
+			self.slowQueries.append(entry)
+
+
+	def explain(self, query, parameters):
+		'''
+		Returns the EXPLAIN (ANALYZE, BUFFERS) plan of a query as a list of lines.
+		The EXPLAIN runs on the tracer's own autocommit connection, opened on
+		first use, so a failure cannot affect the transaction or the named
+		cursors of the connection the app's other queries share.
+
+		RETURN:
+			the plan's lines, or a single line describing why it could not be captured
+		'''
+		with self.explainLock:
+			try:
+				if self.explainConnection is None or self.explainConnection.closed:
+					self.explainConnection = self.connect()
+					self.explainConnection.autocommit = True
+
+				cursor = self.explainConnection.cursor()
+
+				try:
+					cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, parameters)
+					return [row[0] for row in cursor.fetchall()]
+
+				finally:
+					cursor.close()
+
+			except Exception as e:
+				return [f"EXPLAIN failed: {e}"]
+
+
+	def getReport(self):
+		'''
+		Returns the totals and the buffered slow statements, newest first
+		'''
+		with self.lock:
+			return {
+				"statements": self.statementCount,
+				"slowStatements": self.slowCount,
+				"totalMilliseconds": round(self.totalSeconds * 1000, 3),
+				"slowThresholdMilliseconds": round(self.slowSeconds * 1000, 3),
+				"slowQueries": list(reversed(self.slowQueries))
+			}
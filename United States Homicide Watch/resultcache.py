@@ -0,0 +1,114 @@
+'''
+resultcache.py holds the finished national and state query results so that
+a page for a range that has already been computed does not touch the
+database again.
+'''
+
+import threading
+
+
+def makeNationalKey(startYear, endYear):
+	'''
+	Returns the cache key for a national query over the given year range
+	'''
+	return ("national", startYear, endYear)
+
+
+def makeStateKey(startYear, endYear, state):
+	'''
+	Returns the cache key for a state query over the given year range. The
+	state should already have been cleaned with cleanStateInput.
+	'''
+	return ("state", startYear, endYear, state)
+
+
+def makeGroupKey(startYear, endYear, group):
+	'''
+	Returns the cache key for a region or county group query over the given
+	year range. The group should already have been resolved to its registered name.
+	'''
+	return ("group", startYear, endYear, group)
+
+
+class ResultCache:
+	'''
+	ResultCache is a thread-safe map from query keys to the data tables
+	built by getNationalQueryData and getStateQueryData.
+
+	The key space is small and fixed (every valid year range for the nation
+	and for each state), so entries are never evicted; clear() empties the
+	cache when the underlying data is refreshed.
+
+	Each clear() starts a new generation. A computation records the generation
+	before it starts and passes it to set(), so a result computed from the old
+	data that finishes after a clear() is dropped instead of cached.
+	'''
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.results = {}
+		self.generation = 0
+
+
+	def get(self, key):
+		'''
+		Returns the cached result for key, or None if there is none
+		'''
+		with self.lock:
+			return self.results.get(key)
+
+
+	def getGeneration(self):
+		'''
+		Returns the current generation, to pass to set once a result is computed
+		'''
+		with self.lock:
+			return self.generation
+
+
+	def set(self, key, result, generation=None):
+		'''
+		Stores result under key, replacing any earlier result
+
+		PARAMETERS:
+			key - the query's key
+			result - the computed data table
+			generation - the generation the computation started in, from
+			getGeneration; the result is dropped if the cache has been cleared
+			since. None stores it regardless.
+
+		RETURN:
+			True if the result was stored
+		'''
+		with self.lock:
+			if generation is not None and generation != self.generation:
+				return False
+
+			self.results[key] = result
+
+			return True
+
+
+	def contains(self, key):
+		'''
+		Returns True if a result is cached for key
+		'''
+		with self.lock:
+			return key in self.results
+
+
+	def clear(self):
+		'''
+		Removes every cached result and starts a new generation
+		'''
+		with self.lock:
+			self.results.clear()
+			self.generation = self.generation + 1
+
+
+	def size(self):
+		'''
+		Returns the number of cached results
+		'''
+		with self.lock:
+			return len(self.results)
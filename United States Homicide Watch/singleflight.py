@@ -0,0 +1,132 @@
+'''
+singleflight.py makes sure that only one copy of an expensive computation
+runs at a time for any given key. Threads that ask for a key which is
+already being computed wait for that computation and share its result
+(or its exception) instead of starting their own.
+'''
+
+import threading
+
+
+class SingleFlightTimeout(Exception):
+	'''
+	Raised when a thread waiting on another thread's computation gives up
+	before that computation finishes.
+	'''
+	pass
+
+
+class _Call:
+	'''
+	A single in-progress computation and the outcome its waiters will share.
+	'''
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+
+
+class SingleFlight:
+	'''
+	SingleFlight coalesces concurrent calls that share a key so that only
+	one of them does the work. The first caller for a key runs the function;
+	every caller that arrives while it is running blocks until it finishes
+	and receives the same result, or has the same exception raised.
+
+	Nothing is kept once a computation finishes, so SingleFlight is not a
+	cache; the next call for the same key runs the function again.
+	'''
+
+	def __init__(self, timeout=None):
+		'''
+		PARAMETERS:
+			timeout - the default number of seconds a waiting caller will wait for
+			another caller's computation, or None to wait forever
+		'''
+		self.timeout = timeout
+		self.lock = threading.Lock()
+		self.calls = {}
+
+
+	def do(self, key, function, *args, timeout=None):
+		'''
+		Runs function(*args) unless a computation for key is already in progress,
+		in which case it waits for that computation instead.
+
+		PARAMETERS:
+			key - a hashable value identifying the computation, built from the
+			normalized request parameters
+			function - the function to call if no computation for key is running
+			args - the arguments to pass to function
+			timeout - the number of seconds to wait for another caller's computation,
+			overriding the default given to the constructor
+
+		RETURN:
+			whatever function returned, for the caller that ran it and for
+			every caller that waited on it
+
+		Raises SingleFlightTimeout if the computation did not finish in time, and
+		re-raises whatever exception function raised.
+		'''
+		if timeout is None:
+			timeout = self.timeout
+
+		with self.lock:
+			call = self.calls.get(key)
+
+			if call is None:
+				call = _Call()
+				self.calls[key] = call
+				isLeader = True
+
+			else:
+				isLeader = False
+
+		if isLeader:
+			return self.runCall(key, call, function, args)
+
+		if not call.done.wait(timeout):
+			raise SingleFlightTimeout(f"Timed out waiting for {key}")
+
+		if call.error is not None:
+			raise call.error
+
+		return call.result
+
+
+	def runCall(self, key, call, function, args):
+		'''
+		Runs the computation for key, publishes its outcome to the waiters and
+		removes it from the in-progress table.
+
+		PARAMETERS:
+			key - the key the computation was started under
+			call - the _Call that waiters are blocked on
+			function - the function to run
+			args - the arguments to pass to function
+
+		RETURN:
+			whatever function returned
+		'''
+		try:
+			call.result = function(*args)
+			return call.result
+
+		except Exception as e:
+			call.error = e
+			raise
+
+		finally:
+			with self.lock:
+				del self.calls[key]
+
+			call.done.set()
+
+
+	def inFlight(self):
+		'''
+		Returns the number of computations currently in progress
+		'''
+		with self.lock:
+			return len(self.calls)
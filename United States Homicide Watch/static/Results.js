@@ -0,0 +1,104 @@
+// Draws the charts on the state results page from the resultsData object
+// the page defines, so the chart setup is a static file browsers can cache.
+
+function getRandomNumberInRange(min, max){
+	var randomNumber = Math.random();
+	var preFloorNumber = (randomNumber * (max - min)) + min;
+	var postFloorNumber = Math.floor(preFloorNumber);
+	return postFloorNumber;
+}
+
+
+function getRandomColor() {
+	var red = Math.round(getRandomNumberInRange(0, 200));
+	var green = Math.round(getRandomNumberInRange(0, 200));
+	var blue = Math.round(getRandomNumberInRange(0, 200));
+	return 'rgba(' + red + ',' + green + ',' + blue + ')';
+}
+
+function getRandomColors(length) {
+	var colors = [];
+	for (var j = 0; j < length; j++) {
+		var newColor = getRandomColor();
+		colors[j] = newColor;
+	}
+	return colors;
+}
+
+
+function adjustColors(colors, alpha){
+	var adjustedColors = [];
+	for (var i = 0; i < colors.length; i++){
+		var currentColor = colors[i];
+		var partialColorString = currentColor.slice(0, currentColor.length - 1);
+		var newColorString = partialColorString + "," + alpha + ")";
+		adjustedColors[i] = newColorString;
+	}
+	return adjustedColors;
+}
+
+function makeLineChart(resultsData) {
+	var lineContext = document.getElementById('linecanvas').getContext('2d');
+	window.lineChart = new Chart(lineContext, {
+		type: 'line',
+		data: {
+			labels: resultsData.labels,
+			datasets: [{
+				label: resultsData.label,
+				pointBackgroundColor: 'rgba(255, 0, 0, 1)',
+				backgroundColor: 'rgba(0, 0, 100, 0.2)',
+				borderColor: 'rgba(0, 0, 100, 0.9)',
+				data: resultsData.data
+				},
+				{
+				label: '3-Year Moving Average',
+				fill: false,
+				pointRadius: 0,
+				borderColor: 'rgba(200, 120, 0, 0.9)',
+				data: resultsData.movingAverages[3] || []
+				},
+				{
+				label: '5-Year Moving Average',
+				fill: false,
+				pointRadius: 0,
+				borderColor: 'rgba(0, 130, 60, 0.9)',
+				data: resultsData.movingAverages[5] || []
+				},
+				]
+		},
+		options: {
+			title: {
+				display: false,
+				text: 'Example line chart for homicides over time'
+			},
+		}
+	});
+}
+
+function makePieChart(resultsData){
+	var piecontext = document.getElementById("piecanvas").getContext("2d");
+	var baseColors = getRandomColors(resultsData.pielabels.length);
+	var outlineColors = adjustColors(baseColors, 1.0);
+	var backgroundColors = adjustColors(baseColors, 0.3);
+
+	window.pieChart = new Chart(piecontext, {
+		type: "pie",
+		data: {
+			labels: resultsData.pielabels,
+			datasets: [{
+				label: resultsData.pielabel,
+				pointBackgroundColor: 'rgba(255, 0, 0, 1)',
+				backgroundColor: backgroundColors,
+				borderColor: outlineColors,
+				data: resultsData.piedata
+			},
+		]
+	},
+	options: {
+		title: {
+			display: false,
+			text: "this should not display"
+		},
+	}
+	});
+}
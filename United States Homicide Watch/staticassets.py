@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+'''
+staticassets.py builds the static files for production. Every file in
+static/ is copied into static/build/ under a name that includes a hash of
+its content, like logo.3f2a9c1b7d4e.png, and text files are also written
+gzipped (.gz) and, when the brotli package is installed, brotli compressed
+(.br) at the highest levels. A manifest maps each original name to its
+fingerprinted one.
+
+Since a fingerprinted file never changes, browsers and proxies can cache it
+forever. When the manifest exists, the web app's url_for('static', ...) links
+point at the fingerprinted files and /static/build/ serves the compressed
+variants with immutable caching headers; a front-end server can serve
+static/build/ directly instead (see the README).
+
+Usage:
+	python3 staticassets.py
+'''
+
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+APP_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIRECTORY = os.path.join(APP_DIRECTORY, "static")
+BUILD_DIRECTORY = "build"
+MANIFEST_NAME = "assets.json"
+
+# Files worth compressing; images are already compressed
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".html", ".json", ".xml", ".svg", ".ico", ".txt"}
+
+# The precompressed variants of a file, as (encoding, extension), preferred first
+ENCODED_VARIANTS = (("br", ".br"), ("gzip", ".gz"))
+
+# How long browsers may cache fingerprinted files, in seconds (one year)
+IMMUTABLE_MAX_AGE = 31536000
+
+CSS_URL_PATTERN = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def getFingerprint(content):
+	'''
+	Returns the first 12 hex digits of the SHA-256 hash of content
+	'''
+	return hashlib.sha256(content).hexdigest()[:12]
+
+
+def getFingerprintedName(name, fingerprint):
+	'''
+	Returns name with the fingerprint before its extension, like
+	"css/site.css" -> "css/site.0123456789ab.css"
+	'''
+	base, extension = os.path.splitext(name)
+
+	return f"{base}.{fingerprint}{extension}"
+
+
+def rewriteCssUrls(content, name, manifest):
+	'''
+	Returns a stylesheet with each relative url(...) that names a built file
+	replaced by the file's fingerprinted name, so a changed image gets a new
+	link even though the stylesheet only refers to it
+
+	PARAMETERS:
+		content - the stylesheet's bytes
+		name - the stylesheet's path relative to static/
+		manifest - the original to fingerprinted names built so far
+	'''
+	directory = posixpath.dirname(name)
+	builtDirectory = posixpath.join(BUILD_DIRECTORY, directory)
+
+	def replaceUrl(match):
+		quote, url = match.group(1), match.group(2)
+		target = posixpath.normpath(posixpath.join(directory, url))
+
+		if target not in manifest:
+			return match.group(0)
+
+		relative = posixpath.relpath(manifest[target], builtDirectory)
+
+		return f"url({quote}{relative}{quote})"
+
+	return CSS_URL_PATTERN.sub(replaceUrl, content.decode("utf-8")).encode("utf-8")
+
+
+def writeCompressed(path, content):
+	'''
+	Writes the gzip and, if available, brotli variants of a file next to it.
+	The gzip header's timestamp is fixed, so rebuilding unchanged files
+	produces identical output.
+	'''
+	with open(path + ".gz", "wb") as gzipFile:
+		gzipFile.write(gzip.compress(content, compresslevel=9, mtime=0))
+
+	if brotli is not None:
+		with open(path + ".br", "wb") as brotliFile:
+			brotliFile.write(brotli.compress(content, quality=11))
+
+
+def getSourceFiles(staticDirectory):
+	'''
+	Returns the paths of the files in staticDirectory relative to it, leaving
+	out the build directory, with stylesheets last so the files they refer to
+	are fingerprinted first
+	'''
+	names = []
+
+	for directory, subdirectories, files in os.walk(staticDirectory):
+		relativeDirectory = os.path.relpath(directory, staticDirectory)
+
+		if relativeDirectory == ".":
+			subdirectories[:] = [subdirectory for subdirectory in subdirectories if subdirectory != BUILD_DIRECTORY]
+			relativeDirectory = ""
+
+		for fileName in files:
+			if not fileName.startswith("."):
+				names.append(os.path.join(relativeDirectory, fileName).replace(os.sep, "/"))
+
+	return sorted(names, key=lambda name: (name.endswith(".css"), name))
+
+
+def buildAssets(staticDirectory=STATIC_DIRECTORY):
+	'''
+	Rebuilds static/build/ from scratch and writes its manifest
+
+	PARAMETERS:
+		staticDirectory - the static directory to build
+
+	RETURN:
+		the manifest, a dictionary from each file's path relative to static/
+		to its fingerprinted path, also relative to static/
+	'''
+	buildDirectory = os.path.join(staticDirectory, BUILD_DIRECTORY)
+	shutil.rmtree(buildDirectory, ignore_errors=True)
+	manifest = {}
+
+	for name in getSourceFiles(staticDirectory):
+		with open(os.path.join(staticDirectory, name), "rb") as sourceFile:
+			content = sourceFile.read()
+
+		if name.endswith(".css"):
+			content = rewriteCssUrls(content, name, manifest)
+
+		builtName = BUILD_DIRECTORY + "/" + getFingerprintedName(name, getFingerprint(content))
+		builtPath = os.path.join(staticDirectory, builtName)
+		os.makedirs(os.path.dirname(builtPath), exist_ok=True)
+
+		with open(builtPath, "wb") as builtFile:
+			builtFile.write(content)
+
+		if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+			writeCompressed(builtPath, content)
+
+		manifest[name] = builtName
+
+	with open(os.path.join(buildDirectory, MANIFEST_NAME), "w") as manifestFile:
+		json.dump(manifest, manifestFile, indent=1, sort_keys=True)
+
+	return manifest
+
+
+def loadManifest(staticDirectory=STATIC_DIRECTORY):
+	'''
+	Returns the manifest written by buildAssets, or an empty dictionary if the
+	assets have not been built, in which case the original files are served
+	'''
+	try:
+		with open(os.path.join(staticDirectory, BUILD_DIRECTORY, MANIFEST_NAME)) as manifestFile:
+			return json.load(manifestFile)
+
+	except FileNotFoundError:
+		return {}
+
+
+def getEncodedVariant(path, acceptEncodings):
+	'''
+	Returns the best precompressed variant of a built file the client accepts
+
+	PARAMETERS:
+		path - the built file's path
+		acceptEncodings - the request's parsed Accept-Encoding header, as in
+		flask's request.accept_encodings, so an encoding given q=0 is refused
+
+	RETURN:
+		a (path, encoding) tuple, where encoding is "br", "gzip" or None for the
+		uncompressed file
+	'''
+	best, bestQuality = (path, None), 0
+
+	for encoding, extension in ENCODED_VARIANTS:
+		quality = acceptEncodings.quality(encoding)
+
+		if quality > bestQuality and os.path.isfile(path + extension):
+			best, bestQuality = (path + extension, encoding), quality
+
+	return best
+
+
+def main():
+	manifest = buildAssets()
+	compressed = "gzip and brotli" if brotli is not None else "gzip (install brotli for .br files)"
+	print(f"Built {len(manifest)} files into static/{BUILD_DIRECTORY}/, compressed with {compressed}")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,89 @@
+'''
+test_admission.py checks that AdmissionGate admits up to its limit, queues
+up to its queue size and turns the rest away with a Retry-After.
+
+Usage:
+	python3 -m unittest test_admission
+'''
+
+import threading
+import unittest
+
+from admission import AdmissionGate, AdmissionRejected
+
+
+class AdmissionGateTest(unittest.TestCase):
+
+	def testAdmitsUpToLimit(self):
+		gate = AdmissionGate("state", 2, 0, 1)
+		gate.acquire()
+		gate.acquire()
+
+		with self.assertRaises(AdmissionRejected):
+			gate.acquire()
+
+		gate.release(0.5)
+		gate.acquire()
+
+		self.assertEqual(gate.getMetrics()["admitted"], 3)
+		self.assertEqual(gate.getMetrics()["rejected"], 1)
+
+
+	def testFullQueueIsShed(self):
+		gate = AdmissionGate("national", 1, 1, 5)
+		gate.acquire()
+		queued = threading.Thread(target=gate.acquire)
+		queued.start()
+
+		while gate.getMetrics()["waiting"] == 0:
+			queued.join(0.01)
+
+		with self.assertRaises(AdmissionRejected) as rejected:
+			gate.acquire()
+
+		self.assertGreaterEqual(rejected.exception.retryAfter, 1)
+
+		gate.release(0.1)
+		queued.join(5)
+		self.assertEqual(gate.getMetrics()["active"], 1)
+
+
+	def testQueuedRequestGivesUpAtDeadline(self):
+		gate = AdmissionGate("state", 1, 1, 0.05)
+		gate.acquire()
+
+		with self.assertRaises(AdmissionRejected) as rejected:
+			gate.acquire()
+
+		self.assertEqual(rejected.exception.retryAfter, 1)
+		self.assertEqual(gate.getMetrics()["waiting"], 0)
+
+
+	def testSlowRequestsAreShedWithoutWaiting(self):
+		gate = AdmissionGate("state", 1, 4, 10)
+
+		# Once requests take 30 seconds on average, the expected wait is past the
+		# deadline, so the next one is told to retry at once instead of queueing
+		gate.acquire()
+		gate.release(30)
+		gate.acquire()
+
+		with self.assertRaises(AdmissionRejected) as rejected:
+			gate.acquire()
+
+		self.assertEqual(rejected.exception.retryAfter, 10)
+		self.assertEqual(gate.getMetrics()["queued"], 0)
+
+
+	def testAdmitReleasesOnError(self):
+		gate = AdmissionGate("build", 1, 0, 1)
+
+		with self.assertRaises(ValueError):
+			with gate.admit():
+				raise ValueError("build failed")
+
+		self.assertEqual(gate.getMetrics()["active"], 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
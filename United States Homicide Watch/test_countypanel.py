@@ -0,0 +1,83 @@
+'''
+test_countypanel.py checks CountyPanel's histories and rankings against a
+small hand-made set of counties.
+
+Usage:
+	python3 -m unittest test_countypanel
+'''
+
+import unittest
+
+from countypanel import CountyPanel
+
+FIREARM = "Assault by firearm"
+SHARP = "Assault by sharp object"
+
+
+class CountyPanelTest(unittest.TestCase):
+
+	def setUp(self):
+		fipsCodes = [39007, 39035, 39049]
+		names = ["Ashtabula County, OH", "Cuyahoga County, OH", "Franklin County, OH"]
+		self.panel = CountyPanel(fipsCodes, names, [FIREARM, SHARP])
+		cells = {(39007, 2012): [100000, [(FIREARM, 20)]]}
+
+		for year in range(2010, 2013):
+			cells[(39035, year)] = [1000000, [(FIREARM, 80), (SHARP, 10)]]
+			cells[(39049, year)] = [1000000, [(FIREARM, 50)]]
+
+		self.panel.fill(cells)
+
+
+	def getRanked(self, *args, **keywords):
+		return [(county["county"], county["rate"]) for county in self.panel.getRanking(*args, **keywords)]
+
+
+	def testRankingByRate(self):
+		self.assertEqual(self.getRanked(2010, 2012, "Ohio", minYears=1),
+			[("Ashtabula County, OH", 20.0), ("Cuyahoga County, OH", 9.0), ("Franklin County, OH", 5.0)])
+
+
+	def testRankingLeavesOutCountiesWithFewYears(self):
+		self.assertEqual(self.getRanked(2010, 2012),
+			[("Cuyahoga County, OH", 9.0), ("Franklin County, OH", 5.0)])
+		self.assertEqual(self.getRanked(2012, 2012),
+			[("Ashtabula County, OH", 20.0), ("Cuyahoga County, OH", 9.0), ("Franklin County, OH", 5.0)])
+
+
+	def testRankingByCause(self):
+		self.assertEqual(self.getRanked(2010, 2012, cause=SHARP),
+			[("Cuyahoga County, OH", 1.0), ("Franklin County, OH", 0)])
+
+
+	def testRankingLimit(self):
+		self.assertEqual(self.getRanked(2010, 2012, limit=1), [("Cuyahoga County, OH", 9.0)])
+
+		for limit in [0, -1]:
+			with self.assertRaises(ValueError):
+				self.panel.getRanking(2010, 2012, limit=limit)
+
+
+	def testRankingRejectsBadMinYears(self):
+		for minYears in [0, 4]:
+			with self.assertRaises(ValueError):
+				self.panel.getRanking(2010, 2012, minYears=minYears)
+
+
+	def testHistoryMarksUnreportedYears(self):
+		history = self.panel.getHistory(39007)
+		years = {year["year"]: year for year in history["years"]}
+
+		self.assertEqual(history["fips"], "39007")
+		self.assertFalse(years[2011]["reported"])
+		self.assertEqual(years[2012]["causes"], {FIREARM: 20})
+		self.assertEqual(years[2012]["rate"], 20.0)
+
+
+	def testUnknownCountyIsRejected(self):
+		with self.assertRaises(ValueError):
+			self.panel.getHistory("Nowhere County, OH")
+
+
+if __name__ == '__main__':
+	unittest.main()
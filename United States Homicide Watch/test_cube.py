@@ -0,0 +1,67 @@
+'''
+test_cube.py checks HomicideCube's rollups against small hand-made tables.
+
+Usage:
+	python3 -m unittest test_cube
+'''
+
+import unittest
+
+from cube import HomicideCube
+
+
+def makeStateRow(notes, state, cause, deaths, population):
+	'''
+	Returns a row shaped like a states table row
+	'''
+	return (notes, state, None, cause, None, deaths, population, None)
+
+
+class CauseFilterTest(unittest.TestCase):
+
+	def setUp(self):
+		self.cube = HomicideCube()
+
+		for year in [2010, 2011]:
+			self.cube.addStateRow(year, makeStateRow(None, "Ohio", "A", 10, 1000000))
+			self.cube.addStateRow(year, makeStateRow(None, "Ohio", "B", 20, 1000000))
+			self.cube.addStateRow(year, makeStateRow("Total", "Ohio", None, 40, 1000000))
+
+
+	def testSeveralCausesCountPopulationOnce(self):
+		result = self.cube.query(["state"], {"state": ["Ohio"], "cause": ["A", "B"], "year": [2010]})
+
+		self.assertEqual(result, [{"state": "Ohio", "deaths": 30, "population": 1000000, "rate": 3.0}])
+
+
+	def testSeveralCausesOverSeveralYears(self):
+		result = self.cube.query(["year"], {"cause": ["A", "B"]})
+
+		self.assertEqual([row["population"] for row in result], [1000000, 1000000])
+		self.assertEqual(self.cube.query([], {"cause": ["A", "B"]}),
+			[{"deaths": 60, "population": 2000000, "rate": 3.0}])
+
+
+	def testGroupingByCauseMatchesFilteringByCause(self):
+		# Michigan only reports cause A, but its people count toward B's rate too
+		self.cube.addStateRow(2010, makeStateRow(None, "Michigan", "A", 5, 2000000))
+		self.cube.addStateRow(2010, makeStateRow("Total", "Michigan", None, 5, 2000000))
+
+		grouped = self.cube.query(["cause"], {"year": [2010]})
+
+		self.assertEqual([(row["cause"], row["population"]) for row in grouped], [("A", 3000000), ("B", 3000000)])
+
+		for row in grouped:
+			filtered = self.cube.query([], {"year": [2010], "cause": [row["cause"]]})
+			self.assertEqual(filtered[0]["rate"], row["rate"])
+
+
+	def testGroupingByYearAndCause(self):
+		result = self.cube.query(["year", "cause"], {"cause": ["B"]})
+
+		self.assertEqual(result, [{"year": 2010, "cause": "B", "deaths": 20, "population": 1000000, "rate": 2.0},
+			{"year": 2011, "cause": "B", "deaths": 20, "population": 1000000, "rate": 2.0}])
+
+
+if __name__ == '__main__':
+	unittest.main()
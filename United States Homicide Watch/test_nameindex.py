@@ -0,0 +1,75 @@
+'''
+test_nameindex.py checks NameIndex's exact lookups, prefix suggestions and
+edit-distance matching of misspelled names.
+
+Usage:
+	python3 -m unittest test_nameindex
+'''
+
+import unittest
+
+from nameindex import NameIndex, normalizeName
+
+COUNTIES = ["Cuyahoga County, OH", "Franklin County, OH", "Franklin County, PA", "St. Louis city, MO"]
+
+
+class NameIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		self.index = NameIndex.build(COUNTIES)
+
+
+	def testNormalizeName(self):
+		self.assertEqual(normalizeName("St. Louis city, MO"), "st louis city mo")
+
+
+	def testExactNamesResolve(self):
+		self.assertEqual(self.index.resolve("ohio"), ("state", "Ohio"))
+		self.assertEqual(self.index.resolve("OH", "state"), ("state", "Ohio"))
+		self.assertEqual(self.index.resolve("cuyahoga county ohio"), ("county", "Cuyahoga County, OH"))
+		self.assertEqual(self.index.resolve("Cuyahoga"), ("county", "Cuyahoga County, OH"))
+
+
+	def testAmbiguousNameDoesNotResolve(self):
+		self.assertIsNone(self.index.resolve("Franklin County"))
+		self.assertEqual(self.index.resolve("Franklin PA"), ("county", "Franklin County, PA"))
+
+
+	def testTyposResolveWithinEditDistance(self):
+		self.assertEqual(self.index.resolve("Pennsilvania"), ("state", "Pennsylvania"))
+		self.assertEqual(self.index.resolve("Ohoi"), ("state", "Ohio"))
+		self.assertEqual(self.index.resolve("Cuyhoga"), ("county", "Cuyahoga County, OH"))
+
+
+	def testTooManyTyposDoNotResolve(self):
+		self.assertIsNone(self.index.resolve("Oxxx"))
+		self.assertIsNone(self.index.resolve("Pxnnsxlvxnix"))
+
+
+	def testShortCodesAllowNoTypos(self):
+		self.assertIsNone(self.index.resolve("OX"))
+
+
+	def testFindClosestReturnsEveryNearestEntry(self):
+		self.assertEqual(self.index.findClosest("frankln", 2, "county"),
+			{("county", "Franklin County, OH"), ("county", "Franklin County, PA")})
+
+
+	def testSuggestionsByPrefix(self):
+		self.assertEqual(self.index.suggest("new", "state", 3),
+			[("state", "New Hampshire"), ("state", "New Jersey"), ("state", "New Mexico")])
+		self.assertEqual(self.index.suggest("fran", "county"),
+			[("county", "Franklin County, OH"), ("county", "Franklin County, PA")])
+		self.assertEqual(self.index.suggest("zzz"), [])
+
+
+	def testSuggestRejectsBadArguments(self):
+		with self.assertRaises(ValueError):
+			self.index.suggest("oh", "city")
+
+		with self.assertRaises(ValueError):
+			self.index.suggest("oh", None, -1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,54 @@
+'''
+test_resultcache.py checks that ResultCache drops results computed before
+the cache was cleared for a data refresh.
+
+Usage:
+	python3 -m unittest test_resultcache
+'''
+
+import unittest
+
+from resultcache import ResultCache, makeNationalKey, makeStateKey
+
+
+class ResultCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.cache = ResultCache()
+		self.key = makeStateKey(2010, 2012, "Ohio")
+
+
+	def testResultFromCurrentGenerationIsStored(self):
+		generation = self.cache.getGeneration()
+
+		self.assertTrue(self.cache.set(self.key, {"stateCrudeRate": 5.1}, generation))
+		self.assertEqual(self.cache.get(self.key), {"stateCrudeRate": 5.1})
+
+
+	def testResultComputedBeforeClearIsDropped(self):
+		generation = self.cache.getGeneration()
+		self.cache.clear()
+
+		self.assertFalse(self.cache.set(self.key, {"stateCrudeRate": 5.1}, generation))
+		self.assertIsNone(self.cache.get(self.key))
+		self.assertFalse(self.cache.contains(self.key))
+
+
+	def testClearEmptiesCache(self):
+		self.cache.set(self.key, {}, self.cache.getGeneration())
+		self.cache.set(makeNationalKey(2010, 2012), {})
+		self.cache.clear()
+
+		self.assertEqual(self.cache.size(), 0)
+		self.assertEqual(self.cache.getGeneration(), 1)
+
+
+	def testResultWithoutGenerationIsAlwaysStored(self):
+		self.cache.clear()
+
+		self.assertTrue(self.cache.set(self.key, {}))
+		self.assertTrue(self.cache.contains(self.key))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,110 @@
+'''
+test_singleflight.py checks that SingleFlight runs one computation per key
+and shares its result or exception with every caller that waited on it.
+
+Usage:
+	python3 -m unittest test_singleflight
+'''
+
+import threading
+import time
+import unittest
+
+from singleflight import SingleFlight, SingleFlightTimeout
+
+
+class SingleFlightTest(unittest.TestCase):
+
+	def setUp(self):
+		self.singleFlight = SingleFlight()
+		self.started = threading.Event()
+		self.release = threading.Event()
+		self.calls = 0
+
+
+	def blockedFunction(self, result):
+		'''
+		Counts the call and returns result once the test releases it
+		'''
+		self.calls = self.calls + 1
+		self.started.set()
+		self.release.wait(5)
+
+		return result
+
+
+	def runCallers(self, count, function, *args):
+		'''
+		Starts a leader and count - 1 waiters on the same key, releases the
+		computation once they are all waiting and returns each caller's
+		("result", value) or ("error", exception)
+		'''
+		outcomes = [None] * count
+
+		def call(index):
+			try:
+				outcomes[index] = ("result", self.singleFlight.do("key", function, *args))
+
+			except Exception as e:
+				outcomes[index] = ("error", e)
+
+		threads = [threading.Thread(target=call, args=(index,)) for index in range(count)]
+		threads[0].start()
+		self.started.wait(5)
+
+		for thread in threads[1:]:
+			thread.start()
+
+		# Give the waiters time to reach the in-progress computation
+		time.sleep(0.1)
+		self.release.set()
+
+		for thread in threads:
+			thread.join(5)
+
+		return outcomes
+
+
+	def testConcurrentCallsShareOneComputation(self):
+		outcomes = self.runCallers(5, self.blockedFunction, 42)
+
+		self.assertEqual(self.calls, 1)
+		self.assertEqual(outcomes, [("result", 42)] * 5)
+		self.assertEqual(self.singleFlight.inFlight(), 0)
+
+
+	def testErrorIsRaisedInEveryCaller(self):
+		def failingFunction():
+			self.blockedFunction(None)
+			raise ValueError("no such state")
+
+		outcomes = self.runCallers(3, failingFunction)
+
+		self.assertEqual(self.calls, 1)
+		self.assertTrue(all(kind == "error" and isinstance(error, ValueError) for kind, error in outcomes))
+		self.assertEqual(self.singleFlight.inFlight(), 0)
+
+
+	def testWaiterTimesOut(self):
+		leader = threading.Thread(target=self.singleFlight.do, args=("key", self.blockedFunction, 1))
+		leader.start()
+		self.started.wait(5)
+
+		with self.assertRaises(SingleFlightTimeout):
+			self.singleFlight.do("key", self.blockedFunction, 2, timeout=0.01)
+
+		self.release.set()
+		leader.join(5)
+		self.assertEqual(self.calls, 1)
+
+
+	def testFinishedComputationIsNotKept(self):
+		self.release.set()
+
+		self.assertEqual(self.singleFlight.do("key", self.blockedFunction, 1), 1)
+		self.assertEqual(self.singleFlight.do("key", self.blockedFunction, 2), 2)
+		self.assertEqual(self.calls, 2)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,92 @@
+'''
+test_trends.py checks PlaceTrend's prefix sums against moving averages and
+slopes computed directly from the yearly totals.
+
+Usage:
+	python3 -m unittest test_trends
+'''
+
+import unittest
+
+from cube import getRate
+from datasource import FIRST_YEAR, LAST_YEAR
+from trends import PlaceTrend, TrendPanel, WINDOWS
+
+# The year with no data in the test series
+MISSING_YEAR = FIRST_YEAR + 7
+
+
+def getDirectSlope(points):
+	'''
+	Returns the least-squares slope through (x, y) points, rounded as PlaceTrend rounds it
+	'''
+	n = len(points)
+	meanX = sum(x for x, y in points) / n
+	meanY = sum(y for x, y in points) / n
+	numerator = sum((x - meanX) * (y - meanY) for x, y in points)
+	denominator = sum((x - meanX) ** 2 for x, y in points)
+
+	return round(numerator / denominator, 3)
+
+
+class PlaceTrendTest(unittest.TestCase):
+
+	def setUp(self):
+		self.totals = {}
+
+		for year in range(FIRST_YEAR, LAST_YEAR + 1):
+			if year != MISSING_YEAR:
+				self.totals[year] = (100 + (year * 37) % 23, 1000000 + year * 10)
+
+		self.trend = PlaceTrend(self.totals)
+
+
+	def testMovingAveragesMatchDirectSums(self):
+		for window in WINDOWS:
+			for end, year in enumerate(range(FIRST_YEAR, LAST_YEAR + 1)):
+				years = range(year - window + 1, year + 1)
+				expected = None
+
+				if all(windowYear in self.totals for windowYear in years):
+					expected = getRate(sum(self.totals[windowYear][0] for windowYear in years),
+						sum(self.totals[windowYear][1] for windowYear in years))
+
+				self.assertEqual(self.trend.movingAverages[window][end], expected, (window, year))
+
+
+	def testSlopeMatchesDirectRegression(self):
+		for startYear, endYear in [(FIRST_YEAR, LAST_YEAR), (FIRST_YEAR + 3, FIRST_YEAR + 12), (MISSING_YEAR - 1, MISSING_YEAR + 1)]:
+			points = [(year - FIRST_YEAR, getRate(*self.totals[year])) for year in range(startYear, endYear + 1) if year in self.totals]
+
+			self.assertAlmostEqual(self.trend.getSlope(startYear, endYear), getDirectSlope(points), places=3)
+
+
+	def testSlopeNeedsTwoYears(self):
+		self.assertIsNone(self.trend.getSlope(MISSING_YEAR - 1, MISSING_YEAR))
+
+
+	def testRangeAroundMissingYear(self):
+		result = self.trend.getRange(MISSING_YEAR, MISSING_YEAR + 1)
+
+		self.assertEqual(result["rates"][0], None)
+		self.assertEqual(result["yearOverYear"], [None, None])
+		self.assertEqual(result["latestChange"], None)
+
+
+	def testRangeOutsideYearsIsRejected(self):
+		with self.assertRaises(ValueError):
+			self.trend.getRange(FIRST_YEAR - 1, LAST_YEAR)
+
+		with self.assertRaises(ValueError):
+			self.trend.getRange(LAST_YEAR, FIRST_YEAR)
+
+
+class TrendPanelTest(unittest.TestCase):
+
+	def testUnknownPlaceIsRejected(self):
+		with self.assertRaises(ValueError):
+			TrendPanel().getTrend("state", "Ohio", FIRST_YEAR, LAST_YEAR)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,200 @@
+'''
+trends.py turns each state's and county's yearly totals into trend series:
+3- and 5-year moving average rates, year-over-year changes in the rate and
+the slope of the rate over any range of years.
+
+The whole panel is built in one pass from the cube's yearly totals. Each
+place keeps running (prefix) sums of its deaths, population and the
+regression terms, so every moving average is the difference of two prefix
+sums and the slope over any year range takes constant time, however many
+places or years are asked about.
+'''
+
+from datasource import FIRST_YEAR, LAST_YEAR
+from cube import getRate
+
+WINDOWS = [3, 5]
+
+
+class PlaceTrend:
+	'''
+	PlaceTrend holds one state's or county's series over FIRST_YEAR to
+	LAST_YEAR. Years the place has no data for are None in every series.
+	'''
+
+	def __init__(self, yearlyTotals):
+		'''
+		PARAMETERS:
+			yearlyTotals - a dictionary from year to a (deaths, population) tuple
+		'''
+		self.rates = []
+
+		# prefix[i] holds the sums over the first i years, so the sums over
+		# years a to b are prefix[b + 1] - prefix[a]
+		self.deathSums = [0]
+		self.populationSums = [0]
+		self.countSums = [0]
+		self.xSums = [0]
+		self.ySums = [0.0]
+		self.xySums = [0.0]
+		self.xxSums = [0]
+
+		for x, year in enumerate(range(FIRST_YEAR, LAST_YEAR + 1)):
+			deaths, population = yearlyTotals.get(year, (0, 0))
+			present = year in yearlyTotals and population > 0
+			rate = getRate(deaths, population) if present else None
+
+			self.rates.append(rate)
+			self.deathSums.append(self.deathSums[-1] + deaths)
+			self.populationSums.append(self.populationSums[-1] + population)
+			self.countSums.append(self.countSums[-1] + present)
+			self.xSums.append(self.xSums[-1] + (x if present else 0))
+			self.ySums.append(self.ySums[-1] + (rate if present else 0))
+			self.xySums.append(self.xySums[-1] + (x * rate if present else 0))
+			self.xxSums.append(self.xxSums[-1] + (x * x if present else 0))
+
+		self.movingAverages = {window: self.getMovingAverages(window) for window in WINDOWS}
+		self.yearOverYear = [None] + [self.getChange(self.rates[i - 1], self.rates[i]) for i in range(1, len(self.rates))]
+
+
+	def getMovingAverages(self, window):
+		'''
+		Returns the moving average rate ending at each year, pooling the deaths
+		and population of the window's years. A year whose window reaches past
+		FIRST_YEAR or misses any year's data has no average.
+		'''
+		averages = []
+
+		for end in range(1, len(self.rates) + 1):
+			start = end - window
+
+			if start < 0 or self.countSums[end] - self.countSums[start] < window:
+				averages.append(None)
+
+			else:
+				averages.append(getRate(self.deathSums[end] - self.deathSums[start], self.populationSums[end] - self.populationSums[start]))
+
+		return averages
+
+
+	def getChange(self, previous, current):
+		'''
+		Returns the change from one year's rate to the next, or None if either is missing
+		'''
+		if previous is None or current is None:
+			return None
+
+		return round(current - previous, 3)
+
+
+	def getIndexes(self, startYear, endYear):
+		'''
+		Returns the index of startYear and the index after endYear in the series
+
+		Raises ValueError unless FIRST_YEAR <= startYear <= endYear <= LAST_YEAR.
+		'''
+		if startYear > endYear or startYear < FIRST_YEAR or endYear > LAST_YEAR:
+			raise ValueError(f"Years must be between {FIRST_YEAR} and {LAST_YEAR}, start first")
+
+		return startYear - FIRST_YEAR, endYear - FIRST_YEAR + 1
+
+
+	def getSlope(self, startYear, endYear):
+		'''
+		Returns the least-squares slope of the rate over the years with data in
+		the range, in deaths per 100,000 people per year, or None if fewer than
+		two years have data
+
+		Raises ValueError for a range outside FIRST_YEAR to LAST_YEAR.
+		'''
+		start, end = self.getIndexes(startYear, endYear)
+		n = self.countSums[end] - self.countSums[start]
+		x = self.xSums[end] - self.xSums[start]
+		y = self.ySums[end] - self.ySums[start]
+		xy = self.xySums[end] - self.xySums[start]
+		xx = self.xxSums[end] - self.xxSums[start]
+		denominator = n * xx - x * x
+
+		if n < 2 or denominator == 0:
+			return None
+
+		return round((n * xy - x * y) / denominator, 3)
+
+
+	def getRange(self, startYear, endYear):
+		'''
+		Returns the place's series cut to a year range
+
+		PARAMETERS:
+			startYear - the first year to include
+			endYear - the last year to include
+
+		RETURN:
+			a dictionary with the "years" in the range, the "rates" each year, the
+			"movingAverages" for each window size, the "yearOverYear" changes, the
+			"slope" of the rate over the range and the "latestChange" from the
+			year before endYear to endYear, or None if the range is a single year
+
+		Raises ValueError for a range outside FIRST_YEAR to LAST_YEAR.
+		'''
+		start, end = self.getIndexes(startYear, endYear)
+
+		return {
+			"years": list(range(startYear, endYear + 1)),
+			"rates": self.rates[start:end],
+			"movingAverages": {window: averages[start:end] for window, averages in self.movingAverages.items()},
+			"yearOverYear": self.yearOverYear[start:end],
+			"slope": self.getSlope(startYear, endYear),
+			"latestChange": self.yearOverYear[end - 1] if endYear > startYear else None
+		}
+
+
+class TrendPanel:
+	'''
+	TrendPanel holds a PlaceTrend for every state and every county. County
+	totals only include the causes CDC did not suppress, as in the cube.
+	'''
+
+	def __init__(self):
+		self.places = {}
+
+
+	@classmethod
+	def build(cls, cube):
+		'''
+		Returns a panel with every state's and county's series computed
+
+		PARAMETERS:
+			cube - a HomicideCube covering FIRST_YEAR to LAST_YEAR
+		'''
+		panel = cls()
+
+		for level in ["state", "county"]:
+			for name, yearlyTotals in cube.getYearlyTotals(level).items():
+				panel.places[(level, name)] = PlaceTrend(yearlyTotals)
+
+		return panel
+
+
+	def getTrend(self, level, name, startYear, endYear):
+		'''
+		Returns a state's or county's trend series over a year range
+
+		PARAMETERS:
+			level - "state" or "county"
+			name - the state name, or the county name like "Cuyahoga County, OH"
+			startYear - the first year to include
+			endYear - the last year to include
+
+		RETURN:
+			the dictionary described in PlaceTrend.getRange
+
+		Raises ValueError if there is no data for the place or the range is
+		outside FIRST_YEAR to LAST_YEAR.
+		'''
+		place = self.places.get((level, name))
+
+		if place is None:
+			raise ValueError(f"No data for {level} {name}")
+
+		return place.getRange(startYear, endYear)
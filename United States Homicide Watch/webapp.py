@@ -6,15 +6,479 @@ for the html to present.
 '''
 
 import flask
-from flask import render_template, request
+from flask import render_template, request, Response, stream_with_context
 import json
 import sys
+import os
+import hmac
+import threading
+import collections
+import itertools
+import mimetypes
 from datasource import *
+from singleflight import SingleFlight, SingleFlightTimeout
+from querytrace import QueryTracer
+from admission import AdmissionGate, AdmissionRejected
+from resultcache import ResultCache, makeNationalKey, makeStateKey, makeGroupKey
+from config import loadConfig, getConnectionParameters
+from cube import HomicideCube
+from trends import TrendPanel, PlaceTrend
+from nameindex import NameIndex, normalizeName
+from countypanel import CountyPanel
+from geography import GeographyRegistry, loadCustomGroups, getGroupNames
+import comparison
+import staticassets
+from werkzeug.security import safe_join
+from markupsafe import Markup
 import psycopg2
 
-app = flask.Flask(__name__)
-connection = psycopg2.connect(database="huhe", user="huhe", password="tree695eye")
-dataSource = DataSource(connection)
+# export (pyarrow) and cachewarmer (multiprocessing) are imported where they are
+# used, so importing this module stays fast
+
+pages = flask.Blueprint("pages", __name__)
+config = loadConfig()
+
+# This process's DataSource, created on first use by getDataSource
+dataSource = None
+dataSourceLock = threading.Lock()
+
+# Connections a forked child inherited from its parent. They are kept referenced
+# because closing one, even by garbage collection, would end the parent's session.
+inheritedConnections = []
+
+singleFlight = SingleFlight(config["QUERY_TIMEOUT"])
+resultCache = ResultCache()
+
+# The thread filling the result cache, started by startCacheWarmer, and whether
+# it was still running when this process was forked
+warmerThread = None
+warmerInterrupted = False
+
+
+def makeAdmissionGates(config):
+	'''
+	Returns the AdmissionGate for each kind of uncached query, keyed like the
+	first element of a cache key
+	'''
+	return {
+		"national": AdmissionGate("national", config["NATIONAL_CONCURRENCY"], config["ADMISSION_QUEUE"], config["ADMISSION_DEADLINE"]),
+		"state": AdmissionGate("state", config["STATE_CONCURRENCY"], config["ADMISSION_QUEUE"], config["ADMISSION_DEADLINE"]),
+		"group": AdmissionGate("group", config["STATE_CONCURRENCY"], config["ADMISSION_QUEUE"], config["ADMISSION_DEADLINE"]),
+		"build": AdmissionGate("build", config["BUILD_CONCURRENCY"], config["ADMISSION_QUEUE"], config["ADMISSION_DEADLINE"])
+	}
+
+
+admissionGates = makeAdmissionGates(config)
+
+# The errors that mean the server is too busy to answer now, sent as a 503
+OVERLOAD_ERRORS = (AdmissionRejected, SingleFlightTimeout)
+
+# The seconds a client is asked to wait after its identical query timed out
+TIMEOUT_RETRY_AFTER = 5
+
+# This process's HomicideCube, built on first use by getCube. It is read-only
+# once built, so workers forked after it is built can share it.
+homicideCube = None
+cubeLock = threading.Lock()
+
+# Original to fingerprinted static file names, loaded by createApp when
+# staticassets.py has built them
+staticManifest = {}
+
+# Results.html rendered once around a marker, as the (before, after) strings
+# that surround each query's ResultsData.html fragment
+RESULTS_MARKER = "<!-- results data -->"
+resultsShell = None
+resultsShellLock = threading.Lock()
+
+# This process's TrendPanel, built from the cube on first use by getTrendPanel
+trendPanel = None
+trendLock = threading.Lock()
+
+# The states need no database, so their names are indexed up front; the index
+# with counties is built from the cube on first use by getNameIndex
+stateNameIndex = NameIndex.build()
+nameIndex = None
+nameIndexLock = threading.Lock()
+
+# This process's CountyPanel, built on first use by getCountyPanel
+countyPanel = None
+countyPanelLock = threading.Lock()
+
+# This process's GeographyRegistry of regions, divisions and county groups,
+# rolled up from the cube and county panel on first use by getGeographyRegistry
+geographyRegistry = None
+geographyLock = threading.Lock()
+
+# The custom county groups in GEOGRAPHY_FILE, read on first use by getCustomGroups
+customGroups = None
+customGroupsLock = threading.Lock()
+
+
+def createApp(overrides=None):
+	'''
+	Builds the Flask app. Unless WARM_CACHE is set, nothing here connects to
+	the database; each process connects the first time it runs a query, so the
+	app can be imported by tools and tests without touching the network.
+
+	With WARM_CACHE set, the cube, trend panel, name index and group rollups
+	are built here, before gunicorn --preload forks its workers so they share
+	them, and the result cache starts filling on a background thread.
+
+	PARAMETERS:
+		overrides - a dictionary of settings to use instead of the ones read
+		from the environment (see config.py)
+
+	RETURN:
+		the Flask app
+	'''
+	if overrides:
+		config.update(overrides)
+
+	singleFlight.timeout = config["QUERY_TIMEOUT"]
+	admissionGates.update(makeAdmissionGates(config))
+
+	app = flask.Flask(__name__)
+	app.config.update(config)
+	app.register_blueprint(pages)
+
+	global resultsShell
+
+	staticManifest.clear()
+	staticManifest.update(staticassets.loadManifest(app.static_folder))
+	resultsShell = None
+
+	if config["WARM_CACHE"]:
+		import cachewarmer
+
+		cachewarmer.runBuilders(getWarmBuilders())
+		startCacheWarmer()
+
+	return app
+
+
+def getDataSource():
+	'''
+	Returns this process's DataSource, connecting to the database the first
+	time it is called
+	'''
+	global dataSource
+
+	with dataSourceLock:
+		if dataSource is None:
+			parameters = getConnectionParameters(config)
+			connection = psycopg2.connect(**parameters)
+			tracer = QueryTracer(config["SLOW_QUERY_MS"] / 1000, config["EXPLAIN_SAMPLE_RATE"], config["SLOW_QUERY_BUFFER"],
+									connect=lambda: psycopg2.connect(**parameters))
+			dataSource = DataSource(connection, config["ITERSIZE"], tracer)
+
+	return dataSource
+
+
+def forgetParentDataSource():
+	'''
+	Runs in a child process right after a fork, so that the child opens its own
+	connection instead of sharing its parent's socket
+	'''
+	global dataSource, dataSourceLock
+
+	if dataSource is not None:
+		inheritedConnections.append(dataSource.connection)
+		inheritedConnections.append(dataSource.tracer.explainConnection)
+
+	dataSource = None
+	dataSourceLock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=forgetParentDataSource)
+
+
+def noteWarmerBeforeFork():
+	'''
+	Runs in a process about to fork and records whether its cache warm-up is
+	still running, since the child will not inherit the warm-up's thread
+	'''
+	global warmerInterrupted
+
+	warmerInterrupted = warmerThread is not None and warmerThread.is_alive()
+
+
+def resumeWarmerInChild():
+	'''
+	Runs in a child process right after a fork. The warm-up thread may have held
+	the cache's lock, so the child gets a new one, and a warm-up the parent had
+	not finished carries on here with the keys the child does not have yet.
+	'''
+	resultCache.lock = threading.Lock()
+
+	if warmerInterrupted:
+		startCacheWarmer()
+
+
+os.register_at_fork(before=noteWarmerBeforeFork, after_in_child=resumeWarmerInChild)
+
+
+def getQueryData(key, function, *args):
+	'''
+	Returns the cached data table for key, computing it with function(*args)
+	and caching it if it is not there yet. Identical requests that arrive
+	while the table is being computed share the one computation. Only that
+	computation goes through the admission gate for its kind of query, so
+	cached and already-running requests are never queued or rejected.
+
+	PARAMETERS:
+		key - the cache key, from makeNationalKey or makeStateKey
+		function - getNationalQueryData or getStateQueryData
+		args - the arguments to pass to function
+
+	RETURN:
+		the data table for key
+	'''
+	dataTable = resultCache.get(key)
+
+	if dataTable is None:
+		dataTable = singleFlight.do(key, computeAndCache, key, function, *args)
+
+	return dataTable
+
+
+def computeAndCache(key, function, *args):
+	'''
+	Computes function(*args) once admitted by key's gate and stores the result
+	in the cache under key, unless refreshCache cleared the cache meanwhile
+
+	Raises AdmissionRejected if the gate turns the computation away.
+	'''
+	generation = resultCache.getGeneration()
+
+	with admissionGates[key[0]].admit():
+		dataTable = function(*args)
+
+	resultCache.set(key, dataTable, generation)
+
+	return dataTable
+
+
+def refreshCache():
+	'''
+	Empties the result cache and the in-memory structures built from the
+	database and starts rebuilding the trend panel and group rollups and
+	re-warming the cache in the background. Call this after the data in the
+	database has been refreshed; POST /admin/refresh/ calls it.
+
+	RETURN:
+		the thread running the warm-up
+	'''
+	global homicideCube, trendPanel, nameIndex, countyPanel, geographyRegistry, customGroups
+
+	resultCache.clear()
+	homicideCube = None
+	trendPanel = None
+	nameIndex = None
+	countyPanel = None
+	geographyRegistry = None
+	customGroups = None
+
+	return startCacheWarmer()
+
+
+def getWarmBuilders():
+	'''
+	Returns the functions that build this process's in-memory structures, in
+	the order a warm-up runs them
+	'''
+	return [getTrendPanel, getCountyPanel, getNameIndex, getGeographyRegistry]
+
+
+def startCacheWarmer():
+	'''
+	Builds any in-memory structures not built yet and fills the result cache
+	with every national and state query on a background thread
+
+	RETURN:
+		the thread running the warm-up
+	'''
+	import cachewarmer
+	global warmerThread
+
+	warmerThread = cachewarmer.startWarmer(resultCache, list(STATE_DICTIONARY), builders=getWarmBuilders())
+
+	return warmerThread
+
+
+def getCube():
+	'''
+	Returns this process's HomicideCube, building it from the database the
+	first time it is called. Builds go through the "build" admission gate.
+
+	Raises AdmissionRejected if the cube must be built and the gate turns it away.
+	'''
+	global homicideCube
+
+	cube = homicideCube
+
+	if cube is None:
+		with admissionGates["build"].admit(), cubeLock:
+			if homicideCube is None:
+				homicideCube = HomicideCube.build(getDataSource())
+
+			cube = homicideCube
+
+	return cube
+
+
+def getTrendPanel():
+	'''
+	Returns this process's TrendPanel, building every state's and county's
+	trend series from the cube the first time it is called. The cube is built
+	through the "build" admission gate before trendLock is taken, so the lock
+	is only ever held for the panel's own build.
+
+	Raises AdmissionRejected if the cube must be built and the gate turns it away.
+	'''
+	global trendPanel
+
+	panel = trendPanel
+
+	if panel is None:
+		cube = getCube()
+
+		with trendLock:
+			if trendPanel is None:
+				trendPanel = TrendPanel.build(cube)
+
+			panel = trendPanel
+
+	return panel
+
+
+def getOptionalTrend(level, name, startYear, endYear):
+	'''
+	Returns a place's trend series for a page that can be shown without it, or
+	None if the trend panel cannot be built right now or has no such place
+	'''
+	try:
+		return getTrendPanel().getTrend(level, name, startYear, endYear)
+
+	except (ValueError, AdmissionRejected, psycopg2.Error):
+		return None
+
+
+def getCountyPanel():
+	'''
+	Returns this process's CountyPanel, reading every county table once the
+	first time it is called. Builds go through the "build" admission gate.
+
+	Raises AdmissionRejected if the panel must be built and the gate turns it away.
+	'''
+	global countyPanel
+
+	panel = countyPanel
+
+	if panel is None:
+		with admissionGates["build"].admit(), countyPanelLock:
+			if countyPanel is None:
+				countyPanel = CountyPanel.build(getDataSource())
+
+			panel = countyPanel
+
+	return panel
+
+
+def getGeographyRegistry():
+	'''
+	Returns this process's GeographyRegistry, rolling every region, division
+	and county group up the first time it is called. The cube and county panel
+	it is rolled up from are built through the "build" admission gate before
+	geographyLock is taken, so the lock is only ever held for the rollups.
+
+	Raises AdmissionRejected if a build is needed and the gate turns it away.
+	'''
+	global geographyRegistry
+
+	registry = geographyRegistry
+
+	if registry is None:
+		cube, panel, groups = getCube(), getCountyPanel(), getCustomGroups()
+
+		with geographyLock:
+			if geographyRegistry is None:
+				geographyRegistry = GeographyRegistry.build(cube, panel, groups)
+
+			registry = geographyRegistry
+
+	return registry
+
+
+def getCustomGroups():
+	'''
+	Returns the custom county groups in GEOGRAPHY_FILE, reading the file the
+	first time it is called
+
+	Raises ValueError if the file is malformed or reuses a group's name.
+	'''
+	global customGroups
+
+	with customGroupsLock:
+		if customGroups is None:
+			customGroups = loadCustomGroups(config["GEOGRAPHY_FILE"])
+
+		return customGroups
+
+
+def resolveGroup(group):
+	'''
+	Returns the registered name of the region, division or county group the
+	user typed, like "Midwest" for "midwest". Only the group names are needed,
+	so nothing is rolled up.
+
+	Raises ValueError if it names no group.
+	'''
+	name = getGroupNames(getCustomGroups()).get(normalizeName(group or ""))
+
+	if name is None:
+		raise ValueError(f"Region or group not found: {group}")
+
+	return name
+
+
+def getNameIndex():
+	'''
+	Returns this process's NameIndex of every state and every county in the
+	cube, building it the first time it is called. The cube is built through
+	the "build" admission gate before nameIndexLock is taken.
+
+	Raises AdmissionRejected if the cube must be built and the gate turns it away.
+	'''
+	global nameIndex
+
+	index = nameIndex
+
+	if index is None:
+		cube = getCube()
+
+		with nameIndexLock:
+			if nameIndex is None:
+				nameIndex = NameIndex.build(cube.getYearlyTotals("county"))
+
+			index = nameIndex
+
+	return index
+
+
+def resolveCounty(county):
+	'''
+	Returns the canonical name of the county the user typed, like
+	"Cuyahoga County, OH" for "cuyahoga county ohio"
+
+	Raises ValueError if it names no county or several.
+	'''
+	entry = getNameIndex().resolve(county or "", "county")
+
+	if entry is None:
+		raise ValueError(f"County not found: {county} (give the state too if several counties share the name)")
+
+	return entry[1]
 
 
 def getStateQueryData(startYear, endYear, state):
@@ -37,23 +501,58 @@ def getStateQueryData(startYear, endYear, state):
 		a list of the years in the specified range, and another dictionary storing each cause and the percentage of
 		homicides it was responsible for
 
-	Calls getStateCrudeRate, getCausesAndPercentages, getStateSingleYearCrudeRates, getYearRange,
-	and getNationalCrudeRate
+	Calls summarizeStateYears, getStateCrudeRate, getCausesAndPercentages, getYearRange,
+	summarizeNationalYears and getNationalCrudeRate
 	'''
 	dataTable = {}
-	fullList = dataSource.getStateQuery(startYear, endYear, state)
+	yearRows = getDataSource().getStateQuery(startYear, endYear, state, iterate=True)
+
+	if isinstance(yearRows, Exception):
+		raise yearRows
+
+	stateSummary = summarizeStateYears(yearRows)
+
+	dataTable["yearRange"] = getYearRange(startYear, endYear)
+	dataTable["singleYearCrudeRates"] = stateSummary["singleYearCrudeRates"]
+
+	dataTable["stateCrudeRate"] = getStateCrudeRate(stateSummary)
+	dataTable["causesAndPercentages"] = getCausesAndPercentages(stateSummary)
+
+	nationTotals = getDataSource().getUSATotals(startYear, endYear, iterate=True)
+	dataTable["nationalCrudeRate"] = getNationalCrudeRate(summarizeNationalYears(nationTotals))
+
+	return dataTable
+
+
+def getGroupQueryData(startYear, endYear, group):
+	'''
+	Returns the same data table as getStateQueryData for a region, division or
+	county group, along with the group's "trend" series. The group's figures
+	come from its precomputed rollups, so only the national rate is read from
+	the database once they are built.
+
+	PARAMETERS:
+		startYear - the first year of data to draw from
+		endYear - the last year of data to draw from
+		group - the registered name of the group
 
-	if isinstance(fullList, Exception):
-		raise fullList
+	RETURN:
+		a dictionary with the same keys as getStateQueryData's and "trend", the
+		dictionary described in PlaceTrend.getRange
+	'''
+	dataTable = {}
+	registry = getGeographyRegistry()
+	groupSummary = registry.getSummary(group, startYear, endYear)
+	dataTable["trend"] = PlaceTrend(registry.getYearlyTotals(group)).getRange(startYear, endYear)
 
 	dataTable["yearRange"] = getYearRange(startYear, endYear)
-	dataTable["singleYearCrudeRates"] = getStateSingleYearCrudeRates(startYear, endYear, state)
+	dataTable["singleYearCrudeRates"] = groupSummary["singleYearCrudeRates"]
 
-	dataTable["stateCrudeRate"] = getStateCrudeRate(fullList)
-	dataTable["causesAndPercentages"] = getCausesAndPercentages(fullList)
+	dataTable["stateCrudeRate"] = getStateCrudeRate(groupSummary)
+	dataTable["causesAndPercentages"] = getCausesAndPercentages(groupSummary)
 
-	nationTotals = dataSource.getUSATotals(startYear, endYear)
-	dataTable["nationalCrudeRate"] = getNationalCrudeRate(nationTotals)
+	nationTotals = getDataSource().getUSATotals(startYear, endYear, iterate=True)
+	dataTable["nationalCrudeRate"] = getNationalCrudeRate(summarizeNationalYears(nationTotals))
 
 	return dataTable
 
@@ -72,28 +571,103 @@ def getStateSingleYearCrudeRates(startYear, endYear, state):
     A list of ints each representing the rate of homicide per 100,000 people in
 	each year within the specified range
 
-    Calls getStateCrudeRate
+    Calls summarizeStateYears
     '''
-	list = []
-	rate = 0
-	crudeRates = []
+	yearRows = getDataSource().getStateQuery(startYear, endYear, state, iterate=True)
+
+	if isinstance(yearRows, Exception):
+		raise yearRows
+
+	return summarizeStateYears(yearRows)["singleYearCrudeRates"]
+
+
+def summarizeStateYear(rows):
+	'''
+	Reduces one year of a state's rows to the numbers the state page needs,
+	reading the rows one at a time as they are streamed from the database.
+
+	PARAMETERS:
+		rows - the state's rows for one year in table order: one row per cause,
+		followed by the state's Total row
+
+	RETURN:
+		A dictionary with the year's total "deaths", its "population" and "causes",
+		a dictionary of each counted cause and the deaths it was responsible for
+	'''
+	summary = {"deaths": 0, "population": 0, "causes": {}}
+	recentRows = collections.deque(maxlen=2)
+
+	for index, row in enumerate(rows):
+		if index == 0:
+			summary["population"] = row[6]
+
+		# A row is only counted as a cause once two rows follow it, which leaves out
+		# the Total row and, as the page always has, the last cause before it
+		if len(recentRows) == 2:
+			causeRow = recentRows[0]
+			summary["causes"][causeRow[3]] = summary["causes"].get(causeRow[3], 0) + causeRow[5]
+
+		recentRows.append(row)
+
+	# The Total row is only counted when the state reported at least one cause
+	if len(recentRows) == 2:
+		summary["deaths"] = recentRows[1][5]
+
+	return summary
+
+
+def summarizeStateYears(yearRows):
+	'''
+	Folds a state's streamed data into running totals one year at a time, so
+	only a single year's summary is held in memory at once.
+
+	PARAMETERS:
+		yearRows - (year, rows) pairs, as returned by getStateQuery with iterate=True
+
+	RETURN:
+		A dictionary with the number of years ("numYears"), the total "deaths" and
+		"population" over those years, the causes listed in the first year in
+		order ("causeOrder"), the deaths by cause ("causeDeaths"), the causes
+		reported in every year ("validCauses") and the rate of homicide in each
+		year ("singleYearCrudeRates")
+
+	Calls summarizeStateYear and getStateCrudeRate
+	'''
+	summary = {"numYears": 0, "deaths": 0, "population": 0, "causeOrder": [],
+		"causeDeaths": {}, "validCauses": None, "singleYearCrudeRates": []}
+
+	for year, rows in yearRows:
+		yearSummary = summarizeStateYear(rows)
+		causes = yearSummary["causes"]
+
+		summary["numYears"] = summary["numYears"] + 1
+		summary["deaths"] += yearSummary["deaths"]
+		summary["population"] += yearSummary["population"]
+
+		if summary["validCauses"] is None:
+			summary["causeOrder"] = list(causes)
+			summary["validCauses"] = set(causes)
 
-	for year in range (startYear, endYear + 1):
-		list = dataSource.getStateQuery(year, year, state)
-		rate = getStateCrudeRate(list)
-		crudeRates.append(rate)
+		else:
+			summary["validCauses"] &= set(causes)
 
-	return crudeRates
+		for cause in causes:
+			summary["causeDeaths"][cause] = summary["causeDeaths"].get(cause, 0) + causes[cause]
 
+		yearSummary["numYears"] = 1
+		summary["singleYearCrudeRates"].append(getStateCrudeRate(yearSummary))
 
-def getStateCrudeRate(list):
+	return summary
+
+
+def getStateCrudeRate(summary):
 	'''
 	Returns the average annual rate of homicide in a state (per 100,000 people) over the
 	specified year range. If no data was given over this year range (no population of deaths),
 	we return 0.
 
 	PARAMETERS:
-		list - an array of state homicide data for each year in the range the user queried
+		summary - a state summary from summarizeStateYears
 
 	RETURN:
 		A int representing the average annual number of homicides in the user's
@@ -101,57 +675,39 @@ def getStateCrudeRate(list):
 
 	Calls getAverageStateDeaths, getAverageStatePopulation
 	'''
-	averageDeaths = getAverageStateDeaths(list)
-	averagePopulation = getAverageStatePopulation(list)
+	averageDeaths = getAverageStateDeaths(summary)
+	averagePopulation = getAverageStatePopulation(summary)
 	if(averagePopulation == 0):
 		return 0
-	
+
 	return round(averageDeaths*100000/averagePopulation, 3)
 
 
-def getAverageStateDeaths(list):
+def getAverageStateDeaths(summary):
 	'''
 	Returns the average annual number of homicides in a state (per 100,000 people)
 
 	PARAMETERS:
-		list - an array of state homicide data for each year in the range the user queried
+		summary - a state summary from summarizeStateYears
 
 	RETURN:
 		The average annual number of homicides in the user's requested state (per 100,000)
-
-	Calls getAverageStateDeaths, getAverageStatePopulation
 	'''
-	tupleIndex = 0;
-	stateTotal = 0;
-	numYears = len(list)
-
-	for year in list:
-		tupleIndex = len(year) - 2
-		if(tupleIndex > 0):
-			stateTotal += year[tupleIndex][5]
+	return summary["deaths"]/summary["numYears"]
 
-	return stateTotal/numYears
 
-
-def getAverageStatePopulation(list):
+def getAverageStatePopulation(summary):
 	'''
 	Returns the average annual population of the state over user's queried year range
 
 	PARAMETERS:
-		list - an array of state homicide data for each year in the range the user queried
+		summary - a state summary from summarizeStateYears
 
 	RETURN:
 		The average annual population of the user's specified state over the user's
 		specified year range
 	'''
-	numYears = len(list)
-	total = 0
-
-	for year in list:
-		if(len(year) > 1):
-			total += year[0][6]
-
-	return total/numYears
+	return summary["population"]/summary["numYears"]
 
 
 def getYearRange(startYear, endYear):
@@ -174,12 +730,54 @@ def getYearRange(startYear, endYear):
 	return list
 
 
-def getNationalCrudeRate(list):
+def summarizeNationalYears(yearRows):
+	'''
+	Folds the streamed national totals into running totals one year at a time.
+	Each year's rows are the Total rows of every state followed by the
+	national Total row, so only the last row of each year is kept.
+
+	PARAMETERS:
+		yearRows - (year, rows) pairs, as returned by getUSATotals with iterate=True
+
+	RETURN:
+		A dictionary with the number of years ("numYears"), the total national
+		"deaths" and "population" over those years and the national rate of
+		homicide in each year ("singleYearCrudeRates")
+
+	Calls getNationalCrudeRate
+	'''
+	if isinstance(yearRows, Exception):
+		raise yearRows
+
+	summary = {"numYears": 0, "deaths": 0, "population": 0, "singleYearCrudeRates": []}
+
+	for year, rows in yearRows:
+		yearSummary = {"numYears": 1, "deaths": 0, "population": 0}
+		lastRow = None
+		rowCount = 0
+
+		for row in rows:
+			lastRow = row
+			rowCount = rowCount + 1
+
+		if(rowCount > 1):
+			yearSummary["deaths"] = lastRow[5]
+			yearSummary["population"] = lastRow[6]
+
+		summary["numYears"] = summary["numYears"] + 1
+		summary["deaths"] += yearSummary["deaths"]
+		summary["population"] += yearSummary["population"]
+		summary["singleYearCrudeRates"].append(getNationalCrudeRate(yearSummary))
+
+	return summary
+
+
+def getNationalCrudeRate(summary):
 	'''
 	Returns the national average annual rate of homicide per 100,000 people
 
 	PARAMETERS:
-		list - an array of state homicide data for each year in the range the user queried
+		summary - a national summary from summarizeNationalYears
 
 	RETURN:
 		The national average annual rate of homicide per 100,000 people over the
@@ -187,66 +785,45 @@ def getNationalCrudeRate(list):
 
 	Calls getNationalAverageDeaths and getAverageNationalPopulation
 	'''
-	averageDeaths = getNationalAverageDeaths(list)
-	averagePopulation = getAverageNationalPopulation(list)
+	averageDeaths = getNationalAverageDeaths(summary)
+	averagePopulation = getAverageNationalPopulation(summary)
 
 	return round(averageDeaths*100000/averagePopulation, 3)
 
 
-def getNationalAverageDeaths(list):
+def getNationalAverageDeaths(summary):
 	'''
 	Returns the average annual number of homicides across the nation
 
 	PARAMETERS:
-		list - an array of state homicide data for each year in the range the user queried
+		summary - a national summary from summarizeNationalYears
 
 	RETURN:
 		The national average annual number of homicides
 	'''
-	total = 0
-	tupleIndex = 0
-	numYears = len(list)
+	return summary["deaths"]/summary["numYears"]
 
-	for year in list:
-		tupleIndex = len(year) - 1
-		
-		if(tupleIndex > 0):
-			total += year[tupleIndex][5]
-
-	return total/numYears
 
-
-def getAverageNationalPopulation(list):
+def getAverageNationalPopulation(summary):
 	'''
 	Returns the nation's average population over the user's specified year range
 
 	PARAMETERS:
-		list - an array of state homicide data for each year in the range the user queried
+		summary - a national summary from summarizeNationalYears
 
 	RETURN:
 		The national average population over the specified year range
 	'''
-	numYears = len(list)
-	total = 0
-	tupleIndex = 0
-
-	for year in list:
-		tupleIndex = len(year) - 1
+	return summary["population"]/summary["numYears"]
 
-		if(tupleIndex > 0):
-			total += year[tupleIndex][6]
 
-
-	return total/numYears
-
-
-def getCausesAndPercentages(list):
+def getCausesAndPercentages(summary):
 	'''
 	Returns a dictionary with each key being a cause of homicide and each value being the
 	percentage of homicides the associated cause was responsible for
 
 	PARAMETERS:
-		list - an array of state homicide data for each year in the range the user queried
+		summary - a state summary from summarizeStateYears
 
 	RETURN:
 		A dictionary with each key being a cause of homicide and each value being the
@@ -254,95 +831,73 @@ def getCausesAndPercentages(list):
 
 	Calls isValidCause, getPercent, and getPercentOther
 	'''
-	lastIndex = len(list[0]) - 3
 	causesList = {}
 
-	for index in range(lastIndex):
-		cause = list[0][index][3]
-		if(isValidCause(cause, list)):
-			causesList[cause] = getPercent(cause, list)
+	for cause in summary["causeOrder"]:
+		if(isValidCause(cause, summary)):
+			causesList[cause] = getPercent(cause, summary)
 
-	causesList["Other"] = getPercentOther(causesList, list)
+	causesList["Other"] = getPercentOther(causesList, summary)
 
 	return causesList
 
 
-def isValidCause(cause, list):
+def isValidCause(cause, summary):
 	'''
 	Determines whether the inputted cause has valid data. More specifically, this method
 	checks whether the data for this cause was omitted in any of the specified years
 	and does not regard it as valid in this case.
 
 	PARAMETERS:
-		list - an array of state homicide data for each year in the range the user queried
+		summary - a state summary from summarizeStateYears
 
 	RETURN:
 		A True value if there was data for this cause every year and a False value otherwise
 	'''
-	foundAllYears = True
-
-	for year in list:
-		foundThisYear = False
-		lastIndex = len(year) - 3
+	return cause in summary["validCauses"]
 
-		for index in range(lastIndex):
-			if(year[index][3] == cause):
-				foundThisYear = True
 
-		foundAllYears = foundAllYears and foundThisYear
-
-	return foundAllYears
-
-
-def getPercent(cause, list):
+def getPercent(cause, summary):
 	'''
 	Returns the percentage of total homicides the specified cause of homicide was responsible
 	for
 
 	PARAMETERS:
-		list - an array of state homicide data for each year in the range the user queried
+		summary - a state summary from summarizeStateYears
 
 	RETURN:
 		A String representing a number with at most 3 decimal places representing the percentage
 		of deaths the specified cause was responsible for
 	'''
-	totalDeathsByCause = getTotalDeathsByCause(cause, list)
-	numberOfYears = len(list)
-	totalDeaths = getAverageStateDeaths(list)*numberOfYears
+	totalDeathsByCause = getTotalDeathsByCause(cause, summary)
+	numberOfYears = summary["numYears"]
+	totalDeaths = getAverageStateDeaths(summary)*numberOfYears
 
 	return round(totalDeathsByCause * 100/totalDeaths, 3)
 
 
-def getTotalDeathsByCause(cause, list):
+def getTotalDeathsByCause(cause, summary):
 	'''
 	Returns the total number of deaths the specified cause was responsible for
 	over the user's queried year range in the specified state
 
 	PARAMETERS:
-		list - an array of state homicide data for each year in the range the user queried
+		summary - a state summary from summarizeStateYears
 
 	RETURN:
 		An integer representing the total number of homicides the specified cause contributed
 	'''
-	totalDeaths = 0
-
-	for year in list:
-		lastIndex = len(year) - 3
-
-		for index in range(lastIndex):
-			if(year[index][3] == cause):
-				totalDeaths += year[index][5]
+	return summary["causeDeaths"].get(cause, 0)
 
-	return totalDeaths
 
-
-def getPercentOther(causesList, list):
+def getPercentOther(causesList, summary):
 	'''
 	Returns the percentage of homicides over the user's queried year range and specified state
 	not caused by any of the valid causes already found
 
 	PARAMETERS:
-		list - an array of state homicide data for each year in the range the user queried
+		causesList - the percentages already found for each valid cause
+		summary - a state summary from summarizeStateYears
 
 	RETURN:
 		A String representation of a float rounded to 3 decimal places representing the
@@ -408,9 +963,11 @@ def setYearsToInts(startYear, endYear):
 
 def cleanStateInput(state):
 	'''
-	Re-formats the inputted state to be usable in a SQL query. More specifically, this function
-	returns a String with the leading and trailing white space of the input removed and each word
-	within the string (except conjunctions/prepositions like "of" or "and") capitalized.
+	Re-formats the inputted state to be usable in a SQL query. State names and USPS codes are
+	resolved through the name index, which also tolerates small typos, so "ohio", "OH" and
+	"Ohoi" all become "Ohio". Anything the index cannot resolve is returned with its leading
+	and trailing white space removed and each word within the string (except
+	conjunctions/prepositions like "of" or "and") capitalized.
 	If no string was specified, we simply return "Alabama"
 
 	PARAMETERS:
@@ -426,6 +983,11 @@ def cleanStateInput(state):
 	if state == "":
 		state = "Alabama"
 
+	entry = stateNameIndex.resolve(state, "state")
+
+	if entry is not None:
+		return entry[1]
+
 	correctedState = ""
 	wordList = state.split(" ")
 
@@ -477,14 +1039,16 @@ def getNationalQueryData(startYear, endYear):
 		"singleYearCrudeRates" - the national rate of homicide each year in the range, stored in a list
 	'''
 	nationalQueryData = {}
-	nationTotals = dataSource.getUSATotals(startYear, endYear)
+	nationTotals = getDataSource().getUSATotals(startYear, endYear, iterate=True)
 	if isinstance(nationTotals, Exception):
 		raise nationTotals
 
-	nationalQueryData["nationalCrudeRate"] = getNationalCrudeRate(nationTotals)
+	nationalSummary = summarizeNationalYears(nationTotals)
+
+	nationalQueryData["nationalCrudeRate"] = getNationalCrudeRate(nationalSummary)
 	nationalQueryData["mostDangerousState"], nationalQueryData["mostDangerousStateRate"] = getMostDangerousStateAndData(startYear, endYear)
 	nationalQueryData["yearRange"] = getYearRange(startYear, endYear)
-	nationalQueryData["singleYearCrudeRates"] = getNationalSingleYearCrudeRates(startYear, endYear)
+	nationalQueryData["singleYearCrudeRates"] = nationalSummary["singleYearCrudeRates"]
 
 	return nationalQueryData
 
@@ -493,7 +1057,9 @@ def getMostDangerousStateAndData(startYear, endYear):
 	'''
 	Returns the US state with the highest rate of homicide over the specified
 	range of years and the rate of homicide within this state per 100,000 people in the
-	population
+	population. Each year's table is streamed once and its rows are sorted into
+	states as they are read, rather than querying every state separately. The
+	table has no order, so a state's rows need not be next to each other.
 
 	PARAMETERS:
 		startYear - the first year over which to find homicide data
@@ -503,13 +1069,38 @@ def getMostDangerousStateAndData(startYear, endYear):
 		The most dangerous state, returned as a string, and the state's
 		average annual rate of homicide over the specified range (per 100,000 people)
 		returned as an int
+
+	Calls summarizeStateYear and getStateCrudeRate
 	'''
+	yearRows = getDataSource().getUSAQuery(startYear, endYear, iterate=True)
+
+	if isinstance(yearRows, Exception):
+		raise yearRows
+
+	numYears = endYear - startYear + 1
+	stateSummaries = {}
+
+	for state in STATE_DICTIONARY:
+		stateSummaries[state] = {"numYears": numYears, "deaths": 0, "population": 0}
+
+	for year, rows in yearRows:
+		rowsByState = {}
+
+		for row in rows:
+			if row[1] in stateSummaries:
+				rowsByState.setdefault(row[1], []).append(row)
+
+		for state, stateRows in rowsByState.items():
+			yearSummary = summarizeStateYear(stateRows)
+			stateSummaries[state]["deaths"] += yearSummary["deaths"]
+			stateSummaries[state]["population"] += yearSummary["population"]
+
 	crudeRate = 0
 	currentStateRate = 0
 	mostDangerousState = ""
 
-	for state in dataSource.stateDictionary:
-		currentStateRate = getStateCrudeRate(dataSource.getStateQuery(startYear, endYear, state))
+	for state in STATE_DICTIONARY:
+		currentStateRate = getStateCrudeRate(stateSummaries[state])
 
 		if (currentStateRate > crudeRate):
 			crudeRate = currentStateRate
@@ -531,21 +1122,53 @@ def getNationalSingleYearCrudeRates(startYear, endYear):
     A list of ints each representing the national rate of homicide per 100,000 people in
 	each year within the specified range
 
-    Calls getNationalCrudeRate
+    Calls summarizeNationalYears
     '''
-	list = []
-	rate = 0
-	crudeRates = []
+	nationTotals = getDataSource().getUSATotals(startYear, endYear, iterate=True)
+
+	return summarizeNationalYears(nationTotals)["singleYearCrudeRates"]
+
 
-	for year in range (startYear, endYear + 1):
-		list = dataSource.getUSATotals(year, year)
-		rate = getNationalCrudeRate(list)
-		crudeRates.append(rate)
+@pages.app_url_defaults
+def addStaticFingerprint(endpoint, values):
+	'''
+	Points url_for('static', filename=...) at the fingerprinted copy of the
+	file when the assets have been built, so templates need no changes
+	'''
+	if endpoint == 'static' and values.get('filename') in staticManifest:
+		values['filename'] = staticManifest[values['filename']]
+
+
+@pages.route('/static/build/<path:filename>')
+def getBuiltStaticFile(filename):
+	'''
+	Serves a fingerprinted static file, choosing its brotli or gzip variant
+	when the client accepts it. The file's name changes whenever its content
+	does, so it is marked as cacheable for a year and immutable. The variants
+	are not served on their own, since they would go out without their
+	Content-Encoding.
+	'''
+	path = safe_join(flask.current_app.static_folder, staticassets.BUILD_DIRECTORY, filename)
+	variantExtensions = tuple(extension for encoding, extension in staticassets.ENCODED_VARIANTS)
 
-	return crudeRates
+	if path is None or filename.endswith(variantExtensions) or not os.path.isfile(path):
+		flask.abort(404)
 
+	variant, encoding = staticassets.getEncodedVariant(path, request.accept_encodings)
+	mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
 
-@app.route('/', methods = ['POST', 'GET'])
+	response = flask.send_file(variant, mimetype=mimetype, max_age=staticassets.IMMUTABLE_MAX_AGE)
+	response.cache_control.public = True
+	response.cache_control.immutable = True
+	response.vary.add('Accept-Encoding')
+
+	if encoding:
+		response.headers['Content-Encoding'] = encoding
+
+	return response
+
+
+@pages.route('/', methods = ['POST', 'GET'])
 def getNationalQueryResults():
 	'''
 	Loads the homepage and returns a results page corresponding to the user's query. Directs
@@ -557,7 +1180,7 @@ def getNationalQueryResults():
 		start, end = adjustYears(start, end)
 		start, end = setYearsToInts(start, end)
 
-		dataTable = getNationalQueryData(start, end)
+		dataTable = getQueryData(makeNationalKey(start, end), getNationalQueryData, start, end)
 		
 		return render_template('HomePage2.html',
 									inputdata = dataTable["singleYearCrudeRates"],
@@ -569,12 +1192,65 @@ def getNationalQueryResults():
 									mostDangerousState = dataTable["mostDangerousState"],
 									mostDangerousStateRate = dataTable["mostDangerousStateRate"])
 
+	except OVERLOAD_ERRORS as e:
+
+		return getOverloadedResponse(e)
+
 	except Exception as e:
 
 		return render_template('Error.html', error = e)
 
 
-@app.route('/stateQuery/')
+def getOverloadedResponse(error):
+	'''
+	Returns the short 503 response sent when an admission gate turns a request
+	away or an identical query it waited on did not finish in time, telling
+	the client when to retry
+
+	PARAMETERS:
+		error - the AdmissionRejected or SingleFlightTimeout raised
+	'''
+	retryAfter = error.retryAfter if isinstance(error, AdmissionRejected) else TIMEOUT_RETRY_AFTER
+
+	return Response(str(error), status=503, mimetype='text/plain',
+						headers={"Retry-After": str(retryAfter)})
+
+
+def getResultsShell():
+	'''
+	Returns the parts of Results.html that are the same on every results page,
+	rendering them the first time it is called
+
+	RETURN:
+		the (before, after) strings that surround the results data
+	'''
+	global resultsShell
+
+	with resultsShellLock:
+		if resultsShell is None:
+			page = render_template('Results.html', resultsData = Markup(RESULTS_MARKER))
+			resultsShell = tuple(str(page).split(RESULTS_MARKER))
+
+		return resultsShell
+
+
+def renderResults(**context):
+	'''
+	Renders a state results page. Only the ResultsData.html fragment is
+	rendered per request; the rest of the page comes from getResultsShell.
+
+	PARAMETERS:
+		context - the variables ResultsData.html uses
+
+	RETURN:
+		the page's HTML
+	'''
+	before, after = getResultsShell()
+
+	return before + render_template('ResultsData.html', **context) + after
+
+
+@pages.route('/stateQuery/')
 def getMapQueryResults():
 	'''
 	Loads a resulting state query page if the user clicks on one of the states in the
@@ -590,9 +1266,10 @@ def getMapQueryResults():
 			state = request.args.get('state')
 			state = cleanStateInput(state)
 			
-			dataTable = getStateQueryData(start, end, state)
+			dataTable = getQueryData(makeStateKey(start, end, state), getStateQueryData, start, end, state)
+			trend = getOptionalTrend("state", state, start, end)
 			
-			return render_template('Results.html', stateCrudeRate = dataTable["stateCrudeRate"],
+			return renderResults(stateCrudeRate = dataTable["stateCrudeRate"],
 										nationalCrudeRate = dataTable["nationalCrudeRate"],
 										causesAndPercentages = dataTable["causesAndPercentages"],
 										state = state,
@@ -603,7 +1280,12 @@ def getMapQueryResults():
 										inputtitle = f"{state} Annual Crude Rates",
 										inputpiedata= list(dataTable["causesAndPercentages"].values()),
 										inputpielabels= list(dataTable["causesAndPercentages"].keys()),
-										inputpietitle=f"{state} Homicide Data by Cause of Death")
+										inputpietitle=f"{state} Homicide Data by Cause of Death",
+										trend = trend)
+
+		except OVERLOAD_ERRORS as e:
+
+			return getOverloadedResponse(e)
 
 		except Exception as e:
 
@@ -624,6 +1306,457 @@ def getMapQueryResults():
 										endYear = end)
 
 
+@pages.route('/groupQuery/')
+def getGroupQueryResults():
+	'''
+	Loads the results page for a Census region or division or a custom county
+	group, like /groupQuery/?group=Midwest&startYear=2005&endYear=2015. The page
+	is the same as a state's; see /groups/ for the groups that can be queried.
+	'''
+	try:
+		start = request.args.get('startYear')
+		end = request.args.get('endYear')
+		start, end = adjustYears(start, end)
+		start, end = setYearsToInts(start, end)
+		group = resolveGroup(request.args.get('group'))
+
+		dataTable = getQueryData(makeGroupKey(start, end, group), getGroupQueryData, start, end, group)
+
+		return renderResults(stateCrudeRate = dataTable["stateCrudeRate"],
+									nationalCrudeRate = dataTable["nationalCrudeRate"],
+									causesAndPercentages = dataTable["causesAndPercentages"],
+									state = group,
+									startYear = start,
+									endYear = end,
+									inputdata = dataTable["singleYearCrudeRates"],
+									inputlabels = dataTable["yearRange"],
+									inputtitle = f"{group} Annual Crude Rates",
+									inputpiedata= list(dataTable["causesAndPercentages"].values()),
+									inputpielabels= list(dataTable["causesAndPercentages"].keys()),
+									inputpietitle=f"{group} Homicide Data by Cause of Death",
+									trend = dataTable["trend"])
+
+	except OVERLOAD_ERRORS as e:
+
+		return getOverloadedResponse(e)
+
+	except Exception as e:
+
+		return render_template('Error.html', error = e)
+
+
+@pages.route('/groups/')
+def getGroupList():
+	'''
+	Returns every Census region and division and custom county group, with its
+	kind and member states or counties, as JSON
+	'''
+	try:
+		return flask.jsonify(getGeographyRegistry().getGroups())
+
+	except ValueError as e:
+
+		return flask.jsonify({"error": str(e)}), 400
+
+	except OVERLOAD_ERRORS as e:
+
+		return getOverloadedResponse(e)
+
+	except psycopg2.Error as e:
+
+		return flask.jsonify({"error": str(e)}), 500
+
+
+@pages.route('/countyQuery/')
+def getCountyQueryResults():
+	'''
+	Loads the trend page for a county, given by name like
+	/countyQuery/?county=Cuyahoga County, OH&startYear=2005&endYear=2015.
+	County figures only count the causes CDC did not suppress.
+	'''
+	try:
+		start = request.args.get('startYear')
+		end = request.args.get('endYear')
+		start, end = adjustYears(start, end)
+		start, end = setYearsToInts(start, end)
+		county = resolveCounty(request.args.get('county'))
+
+		trend = getTrendPanel().getTrend("county", county, start, end)
+		totals = getCube().query([], {"county": [county], "year": (start, end)})[0]
+
+		return render_template('CountyResults.html', county = county,
+									countyCrudeRate = totals["rate"],
+									startYear = start,
+									endYear = end,
+									trend = trend)
+
+	except OVERLOAD_ERRORS as e:
+
+		return getOverloadedResponse(e)
+
+	except Exception as e:
+
+		return render_template('Error.html', error = e)
+
+
+@pages.route('/export/')
+def getExportResults():
+	'''
+	Streams the raw rows of a national, state or county slice over a year range
+	as a CSV or Parquet download. Rows are read from the database and written
+	to the response a batch at a time, and CSV is gzipped for clients that
+	accept it. Directs user to an error page if the query was not formatted properly
+	'''
+	import export
+
+	try:
+		start = request.args.get('startYear')
+		end = request.args.get('endYear')
+		start, end = adjustYears(start, end)
+		start, end = setYearsToInts(start, end)
+		level = request.args.get('level', 'national')
+		exportFormat = request.args.get('format', 'csv')
+		state = request.args.get('state')
+		county = request.args.get('county')
+
+		if state is not None:
+			state = cleanStateInput(state)
+
+		export.checkValidFormat(exportFormat)
+		batches = getDataSource().streamExportRows(level, start, end, state, county)
+
+		# Fetch the first batch before any headers are sent, so a query that fails
+		# shows the error page instead of cutting the download short
+		firstBatch = next(batches, None)
+		batches = itertools.chain([] if firstBatch is None else [firstBatch], batches)
+
+		compress = exportFormat == "csv" and request.accept_encodings.quality("gzip") > 0
+		body = export.generateExport(exportFormat, export.getExportColumns(level), batches, compress)
+
+		headers = {"Content-Disposition": f"attachment; filename=homicide_{level}_{start}_{end}.{exportFormat}"}
+		if compress:
+			headers["Content-Encoding"] = "gzip"
+			headers["Vary"] = "Accept-Encoding"
+
+		return Response(stream_with_context(body), mimetype=export.EXPORT_FORMATS[exportFormat], headers=headers)
+
+	except Exception as e:
+
+		return render_template('Error.html', error = e)
+
+
+def getCubeFilters(arguments):
+	'''
+	Reads the cube filters from a request's arguments. startYear and endYear
+	filter years (either may be left out), and state, county and cause may each
+	be repeated to accept several values.
+
+	PARAMETERS:
+		arguments - the request's arguments
+
+	RETURN:
+		a dictionary of filters for HomicideCube.query
+	'''
+	filters = {}
+
+	if arguments.get('startYear') or arguments.get('endYear'):
+		start, end = adjustYears(arguments.get('startYear'), arguments.get('endYear'))
+		filters["year"] = setYearsToInts(start, end)
+
+	if arguments.getlist('state'):
+		filters["state"] = [cleanStateInput(state) for state in arguments.getlist('state')]
+
+	if arguments.getlist('county'):
+		filters["county"] = [resolveCounty(county) for county in arguments.getlist('county')]
+
+	if arguments.getlist('cause'):
+		filters["cause"] = arguments.getlist('cause')
+
+	return filters
+
+
+@pages.route('/cube/')
+def getCubeResults():
+	'''
+	Returns deaths, population and rate grouped by any of year, state, county
+	and cause as JSON, for example /cube/?groupBy=state,cause&startYear=2010&measures=rate.
+	Questions that involve counties only count the causes CDC did not suppress.
+	'''
+	try:
+		groupBy = [dimension for dimension in request.args.get('groupBy', '').split(',') if dimension]
+		measures = [measure for measure in request.args.get('measures', '').split(',') if measure]
+		filters = getCubeFilters(request.args)
+
+		return flask.jsonify(getCube().query(groupBy, filters, measures))
+
+	except ValueError as e:
+
+		return flask.jsonify({"error": str(e)}), 400
+
+	except OVERLOAD_ERRORS as e:
+
+		return getOverloadedResponse(e)
+
+
+def getComparisonPeriod(arguments, prefix):
+	'''
+	Reads one period of a comparison from a request's arguments, like
+	firstStartYear and firstEndYear, filling in a missing year from the other
+
+	RETURN:
+		a (startYear, endYear) tuple of ints
+
+	Raises ValueError if neither year of the period is given.
+	'''
+	start, end = arguments.get(prefix + 'StartYear'), arguments.get(prefix + 'EndYear')
+
+	if not start and not end:
+		raise ValueError(f"Give {prefix}StartYear or {prefix}EndYear")
+
+	start, end = adjustYears(start, end)
+
+	return setYearsToInts(start, end)
+
+
+@pages.route('/compare/')
+def getComparisonResults():
+	'''
+	Compares two periods for any number of states and counties and returns the
+	rate changes, cause-share shifts and significance flags as JSON, for example
+	/compare/?firstStartYear=1999&firstEndYear=2005&secondStartYear=2011&secondEndYear=2017&state=Ohio&county=Cuyahoga County, OH.
+	The nation is compared when no state or county is given.
+	'''
+	try:
+		firstPeriod = getComparisonPeriod(request.args, 'first')
+		secondPeriod = getComparisonPeriod(request.args, 'second')
+		states = [cleanStateInput(state) for state in request.args.getlist('state')]
+		counties = [resolveCounty(county) for county in request.args.getlist('county')]
+
+		for state in states:
+			if state not in STATE_DICTIONARY:
+				raise ValueError(f"State not found: {state}")
+
+		return flask.jsonify(comparison.comparePeriods(getCube(), firstPeriod, secondPeriod, states, counties))
+
+	except ValueError as e:
+
+		return flask.jsonify({"error": str(e)}), 400
+
+	except OVERLOAD_ERRORS as e:
+
+		return getOverloadedResponse(e)
+
+
+def getPanelCounty(county):
+	'''
+	Returns a county argument as the panel indexes it: a FIPS code like
+	"39035" as an int, and anything else as the canonical name
+	'''
+	county = (county or "").strip()
+
+	if county.isdigit():
+		return int(county)
+
+	return resolveCounty(county)
+
+
+@pages.route('/counties/history/')
+def getCountyHistoryResults():
+	'''
+	Returns one county's population, deaths, rate and deaths by cause in every
+	year as JSON, for example /counties/history/?county=39035 or ?county=Cuyahoga County, OH
+	'''
+	try:
+		county = getPanelCounty(request.args.get('county'))
+
+		return flask.jsonify(getCountyPanel().getHistory(county))
+
+	except ValueError as e:
+
+		return flask.jsonify({"error": str(e)}), 400
+
+	except OVERLOAD_ERRORS as e:
+
+		return getOverloadedResponse(e)
+
+
+@pages.route('/counties/ranking/')
+def getCountyRankingResults():
+	'''
+	Returns counties ranked by rate over a year range as JSON, optionally only
+	one state's counties or one cause, for example
+	/counties/ranking/?startYear=2010&endYear=2017&state=Ohio&limit=5. Only
+	counties reported in at least minYears of the years are ranked (default
+	half of them), for example &minYears=8 for counties reported every year.
+	'''
+	try:
+		start, end = setYearsToInts(*adjustYears(request.args.get('startYear'), request.args.get('endYear')))
+		state = request.args.get('state')
+		limit = request.args.get('limit')
+		minYears = request.args.get('minYears')
+
+		if state:
+			state = cleanStateInput(state)
+
+		limit = int(limit) if limit else None
+		minYears = int(minYears) if minYears else None
+
+		ranking = getCountyPanel().getRanking(start, end, state or None, request.args.get('cause'), limit, minYears)
+
+		return flask.jsonify(ranking)
+
+	except ValueError as e:
+
+		return flask.jsonify({"error": str(e)}), 400
+
+	except OVERLOAD_ERRORS as e:
+
+		return getOverloadedResponse(e)
+
+
+@pages.route('/counties/map/')
+def getCountyMapResults():
+	'''
+	Returns every county's rate in one year, keyed by FIPS code for drawing a
+	map, as JSON, for example /counties/map/?year=2015&cause=Assault by handgun discharge
+	'''
+	try:
+		year = int(request.args.get('year', LAST_YEAR))
+		state = request.args.get('state')
+
+		if state:
+			state = cleanStateInput(state)
+
+		return flask.jsonify(getCountyPanel().getMap(year, state or None, request.args.get('cause')))
+
+	except ValueError as e:
+
+		return flask.jsonify({"error": str(e)}), 400
+
+	except OVERLOAD_ERRORS as e:
+
+		return getOverloadedResponse(e)
+
+
+@pages.route('/alerts/')
+def getAlertResults():
+	'''
+	Returns the year-over-year jumps and change points found by anomalies.py as
+	JSON, strongest first, for example /alerts/?state=Ohio&kind=changePoint or
+	/alerts/?level=county&year=2016. Run python3 anomalies.py to refresh them.
+	'''
+	try:
+		level = request.args.get('level') or None
+		state = request.args.get('state')
+		county = request.args.get('county')
+		year = request.args.get('year')
+		name = None
+
+		if state:
+			state = cleanStateInput(state)
+
+		if county:
+			name = resolveCounty(county)
+			level = "county"
+
+		rows = getDataSource().getAlerts(level, name, state or None, int(year) if year else None,
+											request.args.get('kind') or None, int(request.args.get('limit', 50)))
+
+		return flask.jsonify([dict(zip(ALERT_COLUMNS, row)) for row in rows])
+
+	except ValueError as e:
+
+		return flask.jsonify({"error": str(e)}), 400
+
+	except OVERLOAD_ERRORS as e:
+
+		return getOverloadedResponse(e)
+
+	except psycopg2.Error as e:
+
+		return flask.jsonify({"error": str(e)}), 500
+
+
+@pages.route('/autocomplete/')
+def getAutocompleteResults():
+	'''
+	Returns up to ten states and counties whose names start with the text typed
+	so far as JSON, for example /autocomplete/?q=cuy or /autocomplete/?q=new&level=state
+	'''
+	prefix = request.args.get('q', '')
+	level = request.args.get('level') or None
+
+	try:
+		limit = int(request.args.get('limit', 10))
+
+	except ValueError:
+		limit = 10
+
+	try:
+		suggestions = getNameIndex().suggest(prefix, level, limit) if prefix.strip() else []
+
+	except ValueError as e:
+
+		return flask.jsonify({"error": str(e)}), 400
+
+	except OVERLOAD_ERRORS as e:
+
+		return getOverloadedResponse(e)
+
+	return flask.jsonify([{"level": entryLevel, "name": name} for entryLevel, name in suggestions])
+
+
+def checkAdminToken():
+	'''
+	Aborts the request unless it carries the configured admin token in an
+	X-Admin-Token header. It is not read from the URL, which ends up in logs
+	and browser history. The admin routes do not exist (404) when no token is
+	configured.
+	'''
+	if not config["ADMIN_TOKEN"]:
+		flask.abort(404)
+
+	token = request.headers.get('X-Admin-Token')
+
+	if token is None or not hmac.compare_digest(token, config["ADMIN_TOKEN"]):
+		flask.abort(403)
+
+
+@pages.route('/admin/slowQueries/')
+def getSlowQueries():
+	'''
+	Returns this worker's statement timings and its most recent slow statements,
+	with any captured EXPLAIN plans, as JSON
+	'''
+	checkAdminToken()
+
+	return flask.jsonify(getDataSource().tracer.getReport())
+
+
+@pages.route('/admin/admission/')
+def getAdmissionMetrics():
+	'''
+	Returns this worker's admission gates' settings, current load and admitted,
+	queued and rejected counts as JSON
+	'''
+	checkAdminToken()
+
+	return flask.jsonify({name: gate.getMetrics() for name, gate in admissionGates.items()})
+
+
+@pages.route('/admin/refresh/', methods=['POST'])
+def refreshData():
+	'''
+	Empties this worker's result cache and in-memory structures and starts
+	rebuilding them from the database. Every worker has its own, so this only
+	refreshes the worker that answers; restart the server to refresh them all.
+	'''
+	checkAdminToken()
+	refreshCache()
+
+	return flask.jsonify({"refreshed": True, "pid": os.getpid()}), 202
+
+
 if __name__ == '__main__':
 	if len(sys.argv) != 3:
 		print('Usage: {0} host port'.format(sys.argv[0]), file=sys.stderr)
@@ -631,4 +1764,5 @@ if __name__ == '__main__':
 
 	host = sys.argv[1]
 	port = sys.argv[2]
+	app = createApp()
 	app.run(host=host, port=port)